@@ -0,0 +1,113 @@
+"""
+asyncio entry point for the object tracking state machine
+
+object_tracking decodes and analyses the picture on the caller's thread.
+Called from a coroutine, it blocks the event loop for the whole analysis,
+and every other connection of an async server stalls meanwhile.
+
+AsyncTracker runs object_tracking in an executor and awaits it:
+
+- Calls on the same instance are serialized by an asyncio.Lock, so the
+  frames of a camera reach its state machine one at a time and in order.
+  Different instances run concurrently.
+- A call can be cancelled or time out. The analysis already running in
+  the executor cannot be interrupted, so the state machine step is always
+  completed, and the lock is only released when it finishes. The next
+  call waits for it instead of running the state machine concurrently.
+
+"""
+
+import asyncio
+
+from statemachineV2 import SurgicalInstrumentTrackDetect
+
+
+class AsyncTracker(object):
+    """
+    Object tracking state machine with an awaitable object_tracking.
+
+    Attributes:
+        supervisor: The SurgicalInstrumentTrackDetect state machine.
+        executor: Executor running the analysis, None for the default
+            executor of the loop. It must run in the same process as the
+            state machine, a ThreadPoolExecutor.
+        timeout (float): Default timeout in seconds of each call, None
+            for no timeout.
+    """
+
+    def __init__(self, supervisor=None, executor=None, timeout=None,
+                 **fsm_options):
+        """
+        Args:
+            supervisor: The state machine to run. If None, one is created
+                with fsm_options.
+            executor: Executor running the analysis.
+            timeout (float): Default timeout in seconds of each call.
+            **fsm_options: Keyword arguments for SurgicalInstrumentTrackDetect.
+        """
+        if supervisor is None:
+            supervisor = SurgicalInstrumentTrackDetect(**fsm_options)
+        self.supervisor = supervisor
+        self.executor = executor
+        self.timeout = timeout
+        self._lock = asyncio.Lock()
+
+    @property
+    def state(self):
+        return self.supervisor.state
+
+    @property
+    def busy(self):
+        """
+        Whether a state machine step is running or waiting.
+        """
+        return self._lock.locked()
+
+    async def object_tracking(self, picture, timeout=None):
+        """
+        Run object_tracking on the picture without blocking the loop.
+
+        Args:
+            picture: The JPEG picture, as accepted by object_tracking.
+            timeout (float): Timeout in seconds, covering the wait for the
+                previous call and the analysis. The default of the
+                instance if None.
+
+        Returns:
+            The output of object_tracking, (flag, image).
+
+        Raises:
+            TimeoutError: The call did not finish in time. If the analysis
+                had started, it still completes in the executor.
+            asyncio.CancelledError: The call was cancelled, same as above.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        loop = asyncio.get_running_loop()
+        async with asyncio.timeout(timeout):
+            await self._lock.acquire()
+            # No await between acquiring the lock and handing its release
+            # to the executor future
+            try:
+                future = loop.run_in_executor(
+                    self.executor, self.supervisor.object_tracking, picture)
+            except BaseException:
+                self._lock.release()
+                raise
+            future.add_done_callback(self._step_done)
+            # shield keeps the step running if this call is cancelled
+            return await asyncio.shield(future)
+
+    async def wait_idle(self):
+        """
+        Wait for the running state machine step, if any, to finish.
+        """
+        async with self._lock:
+            pass
+
+    def _step_done(self, future):
+        self._lock.release()
+        if not future.cancelled():
+            # Retrieved so an abandoned failed step is not reported as a
+            # never retrieved exception. The awaiting call still raises it
+            future.exception()
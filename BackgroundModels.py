@@ -0,0 +1,294 @@
+"""
+Background subtractor engines
+
+This module builds the background models used by find_foreground_object
+and locate_object of BackgroundSubtractionV2. Every engine follows the
+interface of the OpenCV background subtractors:
+
+    apply(image, learningRate=-1)
+        Updates the model with the image and returns the foreground mask,
+        255 for foreground, 127 for shadows (if detected) and 0 for
+        background.
+
+    getBackgroundImage()
+        Returns the current estimate of the background.
+
+A negative learningRate lets the engine choose its own rate.
+
+"""
+
+import json
+import time
+
+import cv2
+import numpy as np
+
+
+class RunningAverageSubtractor(object):
+    """
+    Background model as the running average of the frames.
+
+    Pure NumPy/accumulateWeighted model. The background is a single
+    float32 image, and foreground pixels are the ones differing from it
+    more than a fixed threshold. Enough for the fixed green sheet
+    background, at a fraction of the cost of MOG2.
+
+    Attributes:
+        threshold (int): Minimum absolute difference to the background
+            for a foreground pixel.
+        default_learning_rate (float): Rate used when apply receives a
+            negative learningRate.
+        background: The float32 background image, or None before the
+            first frame.
+    """
+
+    def __init__(self, threshold=25, default_learning_rate=0.01):
+        self.threshold = threshold
+        self.default_learning_rate = default_learning_rate
+        self.background = None
+
+    def apply(self, image, learningRate=-1):
+        if learningRate < 0:
+            learningRate = self.default_learning_rate
+
+        if self.background is None:
+            # The first frame is the initial background
+            self.background = image.astype(np.float32)
+            return np.zeros(image.shape[:2], dtype=np.uint8)
+
+        # Compare with the model before updating it, as MOG2 does
+        difference = cv2.absdiff(image, self.getBackgroundImage())
+        if difference.ndim == 3:
+            difference = difference.max(axis=2)
+        fgmask = cv2.threshold(difference, self.threshold, 255,
+                               cv2.THRESH_BINARY)[1]
+
+        cv2.accumulateWeighted(image, self.background, learningRate)
+        return fgmask
+
+    def getBackgroundImage(self):
+        if self.background is None:
+            return None
+        return cv2.convertScaleAbs(self.background)
+
+
+def create_mog2():
+    # All default values were confirmed, as testing history and varThreshold
+    # did not alter much the final result
+    return cv2.createBackgroundSubtractorMOG2(
+        history=500, varThreshold=50, detectShadows=True
+    )
+
+
+def create_knn():
+    return cv2.createBackgroundSubtractorKNN(
+        history=500, dist2Threshold=400.0, detectShadows=True
+    )
+
+
+def create_cnt():
+    # Counts how many frames each pixel stays stable. Several times cheaper
+    # than MOG2. 15 frames of stability are half a second at 30 fps
+    return cv2.bgsegm.createBackgroundSubtractorCNT(
+        minPixelStability=15, useHistory=True, maxPixelStability=15 * 60,
+        isParallel=True
+    )
+
+
+def create_gsoc():
+    return cv2.bgsegm.createBackgroundSubtractorGSOC()
+
+
+def create_running_average():
+    return RunningAverageSubtractor()
+
+
+background_engines = {
+    "mog2": create_mog2,
+    "knn": create_knn,
+    "running_average": create_running_average,
+}
+
+# CNT and GSOC come from the opencv-contrib package
+if hasattr(cv2, "bgsegm"):
+    background_engines["cnt"] = create_cnt
+    background_engines["gsoc"] = create_gsoc
+
+
+def create_subtractor(engine="mog2"):
+    """
+    Create a background subtractor engine.
+
+    Args:
+        engine (str): Name of the engine, a key of background_engines.
+
+    Returns:
+        The background subtractor object.
+    """
+    try:
+        factory = background_engines[engine]
+    except KeyError:
+        raise ValueError(f"Unknown background engine '{engine}'. "
+                         f"Available: {list(background_engines)}") from None
+    return factory()
+
+
+# Seeding schedule of each engine with a known background, as the number
+# of times the background image is applied and the learning rate used.
+# MOG2 and the running average are reinitialized from a single image with
+# learning rate 1. KNN and CNT restart their samples (or their stability
+# counters) at every frame with learning rate 1, and need a few frames of
+# the same image instead. CNT needs more than minPixelStability frames.
+seed_schedules = {
+    "mog2": (1, 1.0),
+    "knn": (5, 0.5),
+    "running_average": (1, 1.0),
+    "cnt": (20, 0.5),
+    "gsoc": (1, 1.0),
+}
+
+
+def snapshot_subtractor(subtractor):
+    """
+    Take a snapshot of the learned state of a background subtractor.
+
+    The OpenCV engines do not expose their internal models, so the
+    snapshot is the learned background image, in grayscale like the
+    preprocessed images fed to the engines.
+
+    Args:
+        subtractor: The background subtractor engine.
+
+    Returns:
+        The background image, or None if the engine learned nothing yet.
+    """
+    background = subtractor.getBackgroundImage()
+    if background is None:
+        return None
+    if background.ndim == 3:
+        # GSOC returns a BGR background even when fed grayscale images
+        return cv2.cvtColor(background, cv2.COLOR_BGR2GRAY)
+    return background.copy()
+
+
+def seed_subtractor(subtractor, engine, background):
+    """
+    Warm up a background subtractor with a known background image.
+
+    Args:
+        subtractor: The background subtractor engine.
+        engine (str): Name of the engine, a key of seed_schedules.
+        background: Background image, as returned by snapshot_subtractor.
+
+    Returns:
+        The seeded background subtractor.
+    """
+    frames, learning_rate = seed_schedules.get(engine, (1, 1.0))
+    for _ in range(frames):
+        subtractor.apply(background, learningRate=learning_rate)
+    return subtractor
+
+
+def restore_subtractor(engine, background):
+    """
+    Create a background subtractor with the state of a snapshot.
+
+    A warm reset: the new model starts with the known background, instead
+    of learning it again from the camera frames.
+
+    Args:
+        engine (str): Name of the engine, a key of background_engines.
+        background: Background image, as returned by snapshot_subtractor.
+
+    Returns:
+        The background subtractor object.
+    """
+    return seed_subtractor(create_subtractor(engine), engine, background)
+
+
+def background_difference(background, image):
+    """
+    Mean absolute difference between a background and an image.
+
+    Used to check if a stored background still matches the workplace,
+    for example after the lighting changed.
+
+    Returns:
+        The mean difference in gray levels, or None if the sizes differ.
+    """
+    if background is None or background.shape != image.shape:
+        return None
+    return float(cv2.absdiff(background, image).mean())
+
+
+def save_clean_plate(path, background, engine, settings=None):
+    """
+    Save the background of the empty workplace to disk.
+
+    The clean plate is saved in a .npz file with the background image and
+    its metadata: the engine, the preprocessing settings and the time it
+    was taken.
+
+    Args:
+        path (str): Destination file.
+        background: Grayscale background image of the empty workplace.
+        engine (str): Name of the background engine in use.
+        settings (dict): Preprocessing settings that produced the image.
+    """
+    metadata = {"engine": engine,
+                "settings": settings or {},
+                "timestamp": time.time(),
+                "shape": list(background.shape)}
+    with open(path, "wb") as plate_file:
+        np.savez_compressed(plate_file, background=background,
+                            metadata=np.array(json.dumps(metadata)))
+
+
+def load_clean_plate(path, settings=None, max_age=8 * 3600, image=None,
+                     max_difference=20):
+    """
+    Load a clean plate saved by save_clean_plate, if it is still fresh.
+
+    The plate holds the background image only, not the internal model of
+    the engine that learned it (its variances or samples), which the
+    OpenCV engines don't expose. The engine stored in the metadata is
+    informative: the image seeds a new subtractor of the engine in use,
+    with restore_subtractor and its seed_schedules.
+
+    Args:
+        path (str): Clean plate file.
+        settings (dict): Current preprocessing settings. Plates taken with
+            other settings are rejected.
+        max_age (float): Maximum age of the plate in seconds, or None for
+            no age limit.
+        image: Current preprocessed frame, or None. Plates differing from
+            it by more than max_difference gray levels on average are
+            rejected, as taken with other lighting.
+        max_difference (float): Maximum mean difference to the image.
+
+    Returns:
+        The background image, or None if the plate is missing, malformed
+        or stale.
+    """
+    try:
+        with np.load(path, allow_pickle=False) as plate:
+            background = plate["background"]
+            metadata = json.loads(str(plate["metadata"]))
+        plate_settings = metadata["settings"]
+        timestamp = float(metadata["timestamp"])
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        print(f"Clean plate not loaded: {e}")
+        return None
+
+    if settings is not None and plate_settings != settings:
+        print("Clean plate rejected: taken with other settings")
+        return None
+    if max_age is not None and time.time() - timestamp > max_age:
+        print("Clean plate rejected: too old")
+        return None
+    if image is not None:
+        difference = background_difference(background, image)
+        if difference is None or difference > max_difference:
+            print("Clean plate rejected: does not match the workplace")
+            return None
+    return background
@@ -1,5 +1,7 @@
 import cv2
 import numpy as np
+import BackgroundModels
+import BoxGeometry as geometry
 
 """
 Object Tracking and Detection Module V2
@@ -16,22 +18,42 @@ obstacles or by the hands of a technician operating the system.
 
 
 # Initialize the object capture system
-def initialize_bg_sub():
+def initialize_bg_sub(engine="mog2"):
     """
     Configure the background subtractor with default values.
 
+    Args:
+        engine (str): Background subtractor engine, one of
+            BackgroundModels.background_engines. MOG2 by default.
+
     Returns:
         The configured background subtractor object.
     """
     # Initialize the background subtractor with default values
-    fgbgMOG2 = cv2.createBackgroundSubtractorMOG2(
-        history=500, varThreshold=50, detectShadows=True
-    )
     # TODO: test values and explain their meaning
+    return BackgroundModels.create_subtractor(engine)
+
+
+def threshold_object(image):
+    """
+    Threshold the object contrasting with the green background.
 
-    # All default values were confirmed, as testing history and varThreshold
-    # did not alter much the final result
-    return fgbgMOG2
+    Args:
+        image: The preprocessed resized grayscaled image, single-channel.
+
+    Returns:
+        tuple: The dark mask, the light mask and their combination.
+    """
+    # If the object is darker than the green background, in grayscale
+    thresh_dark = cv2.threshold(image, 90, 255, cv2.THRESH_BINARY_INV)[1]
+
+    # If the object is lighter than the green background, in grayscale
+    thresh_light = cv2.threshold(image, 200, 255, cv2.THRESH_BINARY)[1]
+
+    # The final mask is the bitwise OR combination of the two masks. Hysteresis
+    # tries to avoid shadows on the green sheet.
+    thresh = cv2.bitwise_or(thresh_dark, thresh_light)
+    return thresh_dark, thresh_light, thresh
 
 
 def is_object_at_image(image, show_overlay=False):
@@ -39,7 +61,7 @@ def is_object_at_image(image, show_overlay=False):
     Check if there are contours of an object in the image.
 
     Args:
-        image: The preprocessed resized grayscaled image.
+        image: The preprocessed resized grayscaled image, single-channel.
         show_overlay (bool): Flag to show overlay images for debugging.
 
     Returns:
@@ -58,15 +80,7 @@ def is_object_at_image(image, show_overlay=False):
     # To overcome low light conditions
     # HSV Analysis?
 
-    # If the object is darker than the green background, in grayscale
-    thresh_dark = cv2.threshold(image, 90, 255, cv2.THRESH_BINARY_INV)[1]
-
-    # If the object is lighter than the green background, in grayscale
-    thresh_light = cv2.threshold(image, 200, 255, cv2.THRESH_BINARY)[1]
-
-    # The final mask is the bitwise OR combination of the two masks. Hysteresis
-    # tries to avoid shadows on the green sheet.
-    thresh = cv2.bitwise_or(thresh_dark, thresh_light)
+    thresh_dark, thresh_light, thresh = threshold_object(image)
 
     # If any contour is identified, return true
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL,
@@ -97,44 +111,146 @@ def is_object_at_image(image, show_overlay=False):
     # present in the image
 
 
-def image_rotation_compare(image1, image2):
-    gray1 = cv2.cvtColor(image1, cv2.COLOR_BGR2GRAY)
-    _, thresh1 = cv2.threshold(gray1, 50, 255, cv2.THRESH_BINARY)
-    contours1, _ = cv2.findContours(thresh1, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    gray2 = cv2.cvtColor(image2, cv2.COLOR_BGR2GRAY)
-    _, thresh2 = cv2.threshold(gray2, 50, 255, cv2.THRESH_BINARY)
-    contours2, _ = cv2.findContours(thresh2, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    if not (contours1 or contours2):
-        return None
+def to_grayscale(image):
+    """
+    Convert a BGR image to grayscale, keeping single-channel images as is.
 
-    largest_contour1 = max(contours1, key=cv2.contourArea)
-    moments1 = cv2.moments(largest_contour1)
+    Args:
+        image: A BGR image or an already grayscaled image.
+
+    Returns:
+        The single-channel image.
+    """
+    # Frames decoded with the reduced grayscale JPEG modes are already
+    # single-channel, and cvtColor would fail on them
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def orientation_descriptor(image):
+    """
+    Calculate the orientation of the largest contour in the image.
 
-    largest_contour2 = max(contours2, key=cv2.contourArea)
-    moments2 = cv2.moments(largest_contour2)
+    The orientation is the angle of the principal axis, from the central
+    moments of the contour. It is a compact descriptor, that can be kept
+    instead of the image to compare orientations later.
 
-    if moments1["mu20"] + moments1["mu02"] == 0:
+    Args:
+        image: BGR or single-channel image.
+
+    Returns:
+        The orientation in radians, or None if there is no contour or the
+        contour has no principal axis.
+    """
+    gray = to_grayscale(image)
+    _, thresh = cv2.threshold(gray, 50, 255, cv2.THRESH_BINARY)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL,
+                                   cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
         return None
-    
-    if moments2["mu20"] + moments2["mu02"] == 0:
+
+    largest_contour = max(contours, key=cv2.contourArea)
+    moments = cv2.moments(largest_contour)
+
+    if moments["mu20"] + moments["mu02"] == 0:
         return None
 
-    angle1 = 0.5 * np.arctan2(2 * moments1["mu11"], moments1["mu20"] - moments1["mu02"])
+    return 0.5 * np.arctan2(2 * moments["mu11"],
+                            moments["mu20"] - moments["mu02"])
+
 
-    angle2 = 0.5 * np.arctan2(2 * moments2["mu11"], moments2["mu20"] - moments2["mu02"])
+def compare_orientation(angle1, angle2):
+    """
+    Compare two orientations of orientation_descriptor.
 
+    Returns:
+        The absolute difference of the orientations, in degrees, or None
+        if any of them is None.
+    """
+    if angle1 is None or angle2 is None:
+        return None
     return np.degrees(abs(angle1 - angle2))  # Converter de radianos para graus
 
 
-def preprocess_image(image, show_overlay=False):
+def image_rotation_compare(image1, image2):
+    """
+    Compare the orientation of the largest contour of two images.
+
+    Args:
+        image1: BGR or single-channel image.
+        image2: BGR or single-channel image.
+
+    Returns:
+        The absolute difference of the orientations, in degrees, or None
+        if it can't be calculated.
+    """
+    return compare_orientation(orientation_descriptor(image1),
+                               orientation_descriptor(image2))
+
+
+# Denoise filters selectable in preprocess_image. All of them receive the
+# cropped and resized image, BGR or grayscale, and return the same type.
+def bilateral_filter(image):
+    # Original filter of the pipeline. Edge preserving, but by far the
+    # slowest operation per frame
+    return cv2.bilateralFilter(image, d=9, sigmaColor=75, sigmaSpace=125)
+
+
+def gaussian_filter(image):
+    return cv2.GaussianBlur(image, (9, 9), 0)
+
+
+def box_filter(image):
+    return cv2.blur(image, (9, 9))
+
+
+def median_filter(image):
+    # Removes salt and pepper scanning noise, keeping the object edges
+    return cv2.medianBlur(image, 5)
+
+
+def guided_filter(image):
+    # Fast edge preserving filter, using the image itself as guide.
+    # eps is the squared intensity variation treated as noise
+    return cv2.ximgproc.guidedFilter(guide=image, src=image, radius=8,
+                                     eps=400)
+
+
+def domain_transform_filter(image):
+    # Fast edge preserving filter, approximating the bilateral filter
+    # with the normalized convolution of the domain transform
+    return cv2.ximgproc.dtFilter(image, image, sigmaSpatial=10,
+                                 sigmaColor=30, mode=cv2.ximgproc.DTF_NC)
+
+
+denoise_filters = {
+    "bilateral": bilateral_filter,
+    "gaussian": gaussian_filter,
+    "box": box_filter,
+    "median": median_filter,
+}
+
+# The edge preserving filters come from the opencv-contrib package
+if hasattr(cv2, "ximgproc"):
+    denoise_filters["guided"] = guided_filter
+    denoise_filters["domain_transform"] = domain_transform_filter
+
+
+def preprocess_image(image, show_overlay=False, resize_factor=0.5,
+                     filter_engine="bilateral", grayscale_first=False):
     """
     Preprocess the image by filtering noise and resizing.
 
     Args:
-        image: The original input image.
+        image: The original input image, BGR or grayscale.
         show_overlay (bool): Flag to show overlay images for debugging.
+        resize_factor (float): Scale applied after cropping. Use 1.0 when
+            the image was already decoded at the analysis resolution.
+        filter_engine (str): Name of the denoise filter, a key of
+            denoise_filters.
+        grayscale_first (bool): Convert BGR images to grayscale right after
+            cropping, so that resizing and filtering work on one channel.
 
     Returns:
         The preprocessed grayscale image.
@@ -154,20 +270,30 @@ def preprocess_image(image, show_overlay=False):
     # Crop the base of the stand.
     frame = image[0:height, cropleft:cropright]
 
-    # Resize to speed up processing
-    reduced = cv2.resize(frame, None, fx=0.5, fy=0.5,
-                         interpolation=cv2.INTER_AREA)
+    # Single-channel processing. Filtering one channel costs about a third
+    # of filtering the three BGR channels
+    if grayscale_first:
+        frame = to_grayscale(frame)
+
+    # Resize to speed up processing. Frames decoded with a reduced JPEG
+    # mode are already at the analysis resolution.
+    if resize_factor != 1.0:
+        reduced = cv2.resize(frame, None, fx=resize_factor, fy=resize_factor,
+                             interpolation=cv2.INTER_AREA)
+    else:
+        reduced = frame
 
     # Filtering camera scanning noise
     # TODO: test values and explain their meaning
-    f_bilateral = cv2.bilateralFilter(reduced, d=9, sigmaColor=75,
-                                      sigmaSpace=125)
-    
-    # TODO: Create images of gaussian blur, median filter, and bilateral filter
-    # f_bilateral = cv2.GaussianBlur()
+    try:
+        denoise = denoise_filters[filter_engine]
+    except KeyError:
+        raise ValueError(f"Unknown filter engine '{filter_engine}'. "
+                         f"Available: {list(denoise_filters)}") from None
+    filtered = denoise(reduced)
 
     # Convert to grayscale
-    gray_frame = cv2.cvtColor(f_bilateral, cv2.COLOR_BGR2GRAY)
+    gray_frame = to_grayscale(filtered)
 
     # Debug - see the original image before filtering
     if show_overlay:
@@ -176,13 +302,106 @@ def preprocess_image(image, show_overlay=False):
     return gray_frame
 
 
-def find_foreground_object(fgbgMOG2, image, learning_rate=0.0001):
+# Four dilations with a 5x5 rectangle are a single dilation with a 17x17
+# rectangle. Built once, instead of at every frame
+dilation_radius = 8
+dilation_kernel = cv2.getStructuringElement(
+    cv2.MORPH_RECT, (2 * dilation_radius + 1, 2 * dilation_radius + 1))
+
+# Dilation kernels of the downsampled masks, by mask_scale
+scaled_dilation_kernels = {1: dilation_kernel}
+
+
+def reduce_mask(mask, factor):
+    """
+    Reduce a binary mask factor times, keeping any foreground pixel.
+
+    Each block of factor x factor pixels becomes one foreground pixel if
+    any of its pixels is set, like a max pooling. The mask is padded to a
+    multiple of the factor.
+    """
+    height, width = mask.shape
+    pad_bottom, pad_right = -height % factor, -width % factor
+    if pad_bottom or pad_right:
+        mask = cv2.copyMakeBorder(mask, 0, pad_bottom, 0, pad_right,
+                                  cv2.BORDER_CONSTANT, value=0)
+    # The average of each block is non-zero if any of its pixels is set.
+    # Halvings have a fast path in INTER_AREA, other factors do not
+    while factor > 1:
+        step = 2 if factor % 2 == 0 else factor
+        mask = cv2.resize(mask, None, fx=1 / step, fy=1 / step,
+                          interpolation=cv2.INTER_AREA)
+        mask = cv2.threshold(mask, 0, 255, cv2.THRESH_BINARY)[1]
+        factor //= step
+    return mask
+
+
+def dilate_mask(thresh_mask, mask_scale=1):
+    """
+    Dilate the thresholded foreground mask, joining the pieces of objects.
+
+    Args:
+        thresh_mask: The binary foreground mask.
+        mask_scale (int): With values above 1, the mask is first reduced
+            mask_scale times with reduce_mask, and dilated at the reduced
+            resolution.
+
+    Returns:
+        The dilated mask, at 1/mask_scale of the resolution.
+    """
+    if mask_scale == 1:
+        return cv2.dilate(thresh_mask, dilation_kernel)
+
+    small_mask = reduce_mask(thresh_mask, mask_scale)
+    kernel = scaled_dilation_kernels.get(mask_scale)
+    if kernel is None:
+        radius = -(-dilation_radius // mask_scale)  # rounded up
+        kernel = cv2.getStructuringElement(
+            cv2.MORPH_RECT, (2 * radius + 1, 2 * radius + 1))
+        scaled_dilation_kernels[mask_scale] = kernel
+    return cv2.dilate(small_mask, kernel)
+
+
+def scale_boxes(located, mask_scale, shape):
+    """
+    Scale the boxes found in a reduced mask back to the image resolution.
+
+    Args:
+        located (tuple): Valid boxes, border boxes and final object box,
+            as returned by identify_components.
+        mask_scale (int): Reduction factor of the mask.
+        shape (tuple): Shape of the full resolution image, to clip the
+            boxes of the padded blocks.
+
+    Returns:
+        tuple: The same triple, in image coordinates.
+    """
+    height, width = shape[:2]
+
+    def scale(box):
+        if not box:
+            return box
+        x, y, w, h = (value * mask_scale for value in box)
+        return (x, y, min(w, width - x), min(h, height - y))
+
+    valid_boxes, border_boxes, final_object_box = located
+    return ([scale(box) for box in valid_boxes],
+            [scale(box) for box in border_boxes],
+            scale(final_object_box))
+
+
+def find_foreground_object(fgbgMOG2, image, learning_rate=0.0001,
+                           mask_scale=1):
     """
     Identify objects moving relative to the background.
 
     Args:
-        image: The preprocessed image.
+        fgbgMOG2: The background subtractor, MOG2 or any engine of
+            BackgroundModels.
+        image: The preprocessed single-channel image.
         learning_rate (float): The learning rate for the background subtractor.
+        mask_scale (int): Reduction factor of the returned mask, see
+            dilate_mask.
 
     Returns:
         The cleaned binary mask of the foreground object.
@@ -195,8 +414,7 @@ def find_foreground_object(fgbgMOG2, image, learning_rate=0.0001):
     # is considered background after 10 seconds, at initialization.
     fgmaskMOG2 = fgbgMOG2.apply(image, learningRate=learning_rate)
     thresh_mask = cv2.threshold(fgmaskMOG2, 210, 255, cv2.THRESH_BINARY)[1]
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
-    clean_mask = cv2.dilate(thresh_mask, kernel, iterations=4)
+    clean_mask = dilate_mask(thresh_mask, mask_scale)
     return clean_mask
 
 
@@ -230,7 +448,6 @@ def identify_contours(object_found_binary_mask):
     # Make this border as a percentage, as 1% of the H or W dimension?
     valid_contours = []
     border_contours = []
-    final_object_box = ()
     # Detect contours in the calculated mask
     contours = cv2.findContours(
         object_found_binary_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
@@ -263,44 +480,371 @@ def identify_contours(object_found_binary_mask):
         else:
             border_contours.append((x, y, w, h))
 
-    # Create a bigger box around bounding boxes if there are valid contours
-    if len(valid_contours):
-        # Group nearby bounding boxes
-        x_min = min([x for (x, y, w_box, h_box) in valid_contours])
-        y_min = min([y for (x, y, w_box, h_box) in valid_contours])
-        x_max = max([x + w_box for (x, y, w_box, h_box) in valid_contours])
-        y_max = max([y + h_box for (x, y, w_box, h_box) in valid_contours])
+    # Create a bigger box around bounding boxes if there are valid contours.
+    # Final bounding box of the estimated object
+    final_object_box = geometry.enclosing_box(valid_contours)
+
+    return valid_contours, border_contours, final_object_box
+
+
+def components_in_holes(binary_mask, labels, boxes):
+    """
+    Find the connected components inside the holes of other components,
+    which the external contours of identify_contours don't include.
+
+    Only the components whose box is strictly inside the box of a
+    component of at least 3x3 pixels can be in a hole. For those, the
+    background is flooded from outside the boxes of their containers, and
+    a component is in a hole if none of its pixels touches the flooded
+    background. Masks without such nested boxes are not flooded.
+
+    Args:
+        binary_mask: The binary mask.
+        labels: Its 8-connected component labels.
+        boxes: The x, y, w, h of each component, label 1 first.
+
+    Returns:
+        Boolean array, True for the components inside holes.
+    """
+    x, y, w, h = boxes.T
+    in_holes = np.zeros(len(boxes), dtype=bool)
+    containers = np.flatnonzero((w > 2) & (h > 2))
+    if len(boxes) < 2 or not len(containers):
+        return in_holes
+    cx, cy, cw, ch = boxes[containers].T[:, :, None]
+    # Whether each component is inside each container box, (containers,
+    # components)
+    inside = ((x > cx) & (y > cy) & (x + w < cx + cw) & (y + h < cy + ch))
+    candidates = inside.any(axis=0)
+    if not candidates.any():
+        return in_holes
+
+    used = boxes[containers[inside.any(axis=1)]]
+    x_min, y_min = used[:, :2].min(axis=0)
+    x_max, y_max = (used[:, :2] + used[:, 2:]).max(axis=0)
+    padded = cv2.copyMakeBorder(binary_mask[y_min:y_max, x_min:x_max],
+                                1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    foreground = padded != 0
+    # 4-connected background, as the holes of findContours. Within the
+    # crop, what the flood from its zero border reaches is outside
+    cv2.floodFill(padded, None, (0, 0), 255, flags=4)
+    outside = (padded == 255) & ~foreground
+    touching = foreground[1:-1, 1:-1] & (
+        outside[:-2, 1:-1] | outside[2:, 1:-1]
+        | outside[1:-1, :-2] | outside[1:-1, 2:])
+    touches_outside = np.zeros(len(boxes) + 1, dtype=bool)
+    touches_outside[labels[y_min:y_max, x_min:x_max][touching]] = True
+    # Label 0 is the background
+    in_holes[candidates & ~touches_outside[1:]] = True
+    return in_holes
+
+
+def identify_components(object_found_binary_mask):
+    """
+    Locate the possible object in the binary mask by connected components.
+
+    Same classification of identify_contours, with the bounding boxes of
+    all the 8-connected components computed in a single pass by
+    connectedComponentsWithStats, and classified against the 1% margins
+    with array operations. The whole mask is labelled, which costs several
+    times more than findContours on clean masks, and about the same on
+    masks with hundreds of noise blobs. identify_contours stays the
+    default of locate_object, see box_finders.
+
+    As with the external contours, the components inside the holes of
+    other components are not reported, see components_in_holes.
+
+    Args:
+        object_found_binary_mask: The binary mask of the foreground object.
+
+    Returns:
+        tuple: A tuple containing lists of valid boxes, border boxes,
+        and the final object bounding box.
+    """
+    mask_height, mask_width = object_found_binary_mask.shape
+    if mask_height == 0 or mask_width == 0:
+        # connectedComponentsWithStats does not accept empty masks
+        return [], [], ()
+    size_border_factor = 0.01
+    margin_top_bot = int(mask_height * size_border_factor)
+    margin_left_right = int(mask_width * size_border_factor)
 
+    # 16 bit labels take a third of the time of the default 32 bit ones.
+    # Enough while the mask can't hold more 8-connected components than
+    # labels: no more than its foreground pixels, or its isolated pixels
+    max_components = min(cv2.countNonZero(object_found_binary_mask),
+                         ((mask_height + 1) // 2) * ((mask_width + 1) // 2))
+    label_type = cv2.CV_16U if max_components < 2 ** 16 - 1 else cv2.CV_32S
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(
+        object_found_binary_mask, connectivity=8, ltype=label_type)
+    # Label 0 is the background
+    boxes = stats[1:, :cv2.CC_STAT_AREA]
+    boxes = boxes[~components_in_holes(object_found_binary_mask, labels,
+                                       boxes)]
+    x, y, w, h = boxes.T
+    # Same test of the four corners of identify_contours
+    away_borders = ((x > margin_left_right) & (y > margin_top_bot)
+                    & (x + w < mask_width - margin_left_right)
+                    & (y + h < mask_height - margin_top_bot))
+
+    valid_boxes = [tuple(box) for box in boxes[away_borders].tolist()]
+    border_boxes = [tuple(box) for box in boxes[~away_borders].tolist()]
+    final_object_box = ()
+    if valid_boxes:
+        valid = boxes[away_borders]
+        x_min, y_min = valid[:, :2].min(axis=0).tolist()
+        x_max, y_max = (valid[:, :2] + valid[:, 2:]).max(axis=0).tolist()
         # Final bounding box of the estimated object
         final_object_box = (x_min, y_min, x_max - x_min, y_max - y_min)
 
-    return valid_contours, border_contours, final_object_box
+    return valid_boxes, border_boxes, final_object_box
+
+
+# Functions classifying the boxes of the foreground mask, by name
+box_finders = {
+    "contours": identify_contours,
+    "components": identify_components,
+}
 
 
-def locate_object(fgbgMOG2, image, learning_rate=0.0001):
+def locate_object(fgbgMOG2, image, learning_rate=0.0001, resize_factor=0.5,
+                  filter_engine="bilateral", grayscale_first=False,
+                  mask_scale=1, box_finder="contours"):
     """
     Locate the object in the preprocessed image.
 
     Args:
+        fgbgMOG2: The background subtractor, MOG2 or any engine of
+            BackgroundModels.
         image: The input image.
         learning_rate (float): The learning rate for the background subtractor.
+        resize_factor (float): Scale passed to preprocess_image.
+        filter_engine (str): Denoise filter passed to preprocess_image.
+        grayscale_first (bool): Grayscale mode passed to preprocess_image.
+        mask_scale (int): Reduction factor of the foreground mask. The
+            boxes are scaled back to the preprocessed image resolution.
+        box_finder (str): Classification of the mask boxes, one of
+            box_finders.
 
     Returns:
         tuple: A tuple containing lists of valid contours, border contours,
         and the final object bounding box.
     """
     # Receives preprocessed image, returns mask and bounding box of the object
-    preproc_image = preprocess_image(image)
+    preproc_image = preprocess_image(image, resize_factor=resize_factor,
+                                     filter_engine=filter_engine,
+                                     grayscale_first=grayscale_first)
 
-    clean_mask = find_foreground_object(fgbgMOG2, preproc_image, learning_rate)
+    clean_mask = find_foreground_object(fgbgMOG2, preproc_image, learning_rate,
+                                        mask_scale)
 
     (valid_boxes,
      border_boxes,
-     final_object_box) = identify_contours(clean_mask)
+     final_object_box) = box_finders[box_finder](clean_mask)
+    if mask_scale != 1:
+        (valid_boxes,
+         border_boxes,
+         final_object_box) = scale_boxes(
+            (valid_boxes, border_boxes, final_object_box), mask_scale,
+            preproc_image.shape)
 
     return valid_boxes, border_boxes, final_object_box
 
 
+class MotionGate(object):
+    """
+    Cheap motion detector on heavily downsampled frames.
+
+    Compares a tiny version of each frame with the tiny version of the
+    last frame that went through the full pipeline. Comparing with that
+    reference instead of the previous frame, slow movements accumulate
+    until they open the gate.
+
+    Attributes:
+        size (tuple): Width and height of the tiny frames.
+        pixel_threshold (int): Minimum gray level change of a changed pixel.
+        max_changed_fraction (float): Maximum fraction of changed pixels of
+            an idle frame. With 0, any changed pixel opens the gate, as an
+            instrument entering slowly by the border changes only a few
+            pixels at this resolution.
+        reference: Tiny version of the last fully analysed frame, or None.
+    """
+
+    def __init__(self, size=(80, 60), pixel_threshold=15,
+                 max_changed_fraction=0.0):
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.max_changed_fraction = max_changed_fraction
+        self.reference = None
+        self._tiny = None
+
+    def is_idle(self, image):
+        """
+        Check if the image shows no change relative to the reference.
+
+        Args:
+            image: The received frame, BGR or grayscale, at any resolution.
+
+        Returns:
+            bool: True if the frame can skip the full pipeline.
+        """
+        self._tiny = cv2.resize(to_grayscale(image), self.size,
+                                interpolation=cv2.INTER_AREA)
+        if self.reference is None:
+            return False
+        changed = cv2.threshold(cv2.absdiff(self._tiny, self.reference),
+                                self.pixel_threshold, 255,
+                                cv2.THRESH_BINARY)[1]
+        return (cv2.countNonZero(changed)
+                <= self.max_changed_fraction * changed.size)
+
+    def set_reference(self):
+        """
+        Use the last frame checked by is_idle as the reference.
+        """
+        self.reference = self._tiny
+
+    def reset(self):
+        self.reference = None
+        self._tiny = None
+
+
+class FrameAnalysis(object):
+    """
+    Per-frame analysis context, shared by the state callbacks.
+
+    Each intermediate result is computed on the first request and cached,
+    so it is computed at most once per frame, whichever states or helpers
+    ask for it.
+
+    Attributes:
+        frame: The received frame, BGR or grayscale.
+        resize_factor (float): Scale passed to preprocess_image.
+        filter_engine (str): Denoise filter passed to preprocess_image.
+        grayscale_first (bool): Grayscale mode passed to preprocess_image.
+        show_overlay (bool): Flag to show overlay images for debugging.
+        box_finder (str): Classification of the mask boxes, one of
+            box_finders.
+        learning_rate (float): Learning rate used for the foreground mask,
+            or None if the background model was not updated yet.
+    """
+
+    def __init__(self, frame, resize_factor=0.5, filter_engine="bilateral",
+                 grayscale_first=False, show_overlay=False,
+                 box_finder="contours"):
+        self.frame = frame
+        self.resize_factor = resize_factor
+        self.filter_engine = filter_engine
+        self.grayscale_first = grayscale_first
+        self.show_overlay = show_overlay
+        self.box_finder = box_finder
+        self.learning_rate = None
+
+        # Cached results
+        self._preprocessed = None
+        self._thresholds = None
+        self._object_contours = None
+        self._foreground_mask = None
+        self._located = None
+        self._orientation = None
+        self._orientation_done = False
+
+    @property
+    def preprocessed(self):
+        """
+        The preprocessed grayscale image.
+        """
+        if self._preprocessed is None:
+            self._preprocessed = preprocess_image(
+                self.frame, self.show_overlay, self.resize_factor,
+                self.filter_engine, self.grayscale_first)
+        return self._preprocessed
+
+    @property
+    def thresholds(self):
+        """
+        The dark, light and combined object masks of threshold_object.
+        """
+        if self._thresholds is None:
+            self._thresholds = threshold_object(self.preprocessed)
+        return self._thresholds
+
+    @property
+    def thresh_dark(self):
+        return self.thresholds[0]
+
+    @property
+    def thresh_light(self):
+        return self.thresholds[1]
+
+    @property
+    def thresh_object(self):
+        return self.thresholds[2]
+
+    @property
+    def object_contours(self):
+        """
+        The external contours of the thresholded object mask.
+        """
+        if self._object_contours is None:
+            self._object_contours = cv2.findContours(
+                self.thresh_object, cv2.RETR_EXTERNAL,
+                cv2.CHAIN_APPROX_SIMPLE)[0]
+        return self._object_contours
+
+    def is_object_present(self):
+        """
+        Check if there are contours of an object in the frame, like
+        is_object_at_image.
+        """
+        return len(self.object_contours) > 0
+
+    def foreground_mask(self, fgbgMOG2, learning_rate=0.0001):
+        """
+        The cleaned binary mask of find_foreground_object.
+
+        The background model is updated only on the first call for the
+        frame. Later calls return the same mask, whatever learning rate
+        they ask for.
+        """
+        if self._foreground_mask is None:
+            self._foreground_mask = find_foreground_object(
+                fgbgMOG2, self.preprocessed, learning_rate)
+            self.learning_rate = learning_rate
+        return self._foreground_mask
+
+    def foreground_fraction(self):
+        """
+        Fraction of foreground pixels in the foreground mask, or None if
+        the background model was not updated with this frame.
+        """
+        if self._foreground_mask is None:
+            return None
+        return (cv2.countNonZero(self._foreground_mask)
+                / self._foreground_mask.size)
+
+    def locate_object(self, fgbgMOG2, learning_rate=0.0001):
+        """
+        The valid contours, border contours and final object bounding box
+        of the foreground mask, like locate_object.
+        """
+        if self._located is None:
+            self._located = box_finders[self.box_finder](
+                self.foreground_mask(fgbgMOG2, learning_rate))
+        return self._located
+
+    @property
+    def orientation(self):
+        """
+        The orientation_descriptor of the preprocessed image.
+        """
+        # None is a valid result, so a flag marks it as calculated
+        if not self._orientation_done:
+            self._orientation = orientation_descriptor(self.preprocessed)
+            self._orientation_done = True
+        return self._orientation
+
+
 if __name__ == "__main__":
 
     # Original videos recorded in 4k. Reduce resolution for the copy used
@@ -411,12 +955,6 @@ if __name__ == "__main__":
         # Thus, when a final_object_box is found, pass
         # to contour identification in the original image
         if valid_boxes and not border_boxes:
-            mask_MOG2 = np.zeros_like(clean_mask)
-            x, y, w, h = final_object_box
-            cv2.rectangle(mask_MOG2, (x, y), (x + w, y + h), 255,
-                          thickness=cv2.FILLED)
-            # cv2.imshow("maskMOG2", mask_MOG2)
-            mask_object = np.zeros_like(clean_mask)
             # using [1] to get the contours
             instant_contours = is_object_at_image(preproc_image)[1]
             # Receives the contours output
@@ -425,19 +963,13 @@ if __name__ == "__main__":
                 # contour identified in the original image
                 # The rest of the process only exists if there are
                 # both masks
-                x, y, w, h = cv2.boundingRect(np.vstack(instant_contours))
-                cv2.rectangle(
-                    mask_object, (x, y), (x + w, y + h), 255,
-                    thickness=cv2.FILLED)
-                # cv2.imshow("objectContour", mask_object)
-                intersection = cv2.bitwise_and(mask_MOG2, mask_object)
-                union = cv2.bitwise_or(mask_MOG2, mask_object)
-
-                intersection_area = np.sum(intersection > 0)
-                union_area = np.sum(union > 0)
-
-                iou = intersection_area / union_area
-                # Calculate the Jaccard index (IoU)
+                object_box = cv2.boundingRect(np.vstack(instant_contours))
+                # Calculate the Jaccard index (IoU) of the boxes, from their
+                # coordinates instead of drawing them in full frame masks
+                iou = geometry.box_iou(
+                    geometry.filled_rectangle(final_object_box,
+                                              clean_mask.shape),
+                    geometry.filled_rectangle(object_box, clean_mask.shape))
                 # Set a threshold to consider a good match
                 threshold = 0.8
                 print(iou)
@@ -0,0 +1,222 @@
+"""
+Batch analysis of recorded sessions
+
+For auditing and tuning, recordings are replayed through the state
+machine. analyse_session replays a whole sequence of frames and returns
+its timeline as compact NumPy arrays, one entry per frame, instead of
+the caller collecting the result of every object_tracking call.
+
+The frames are processed in chunks. The stages that don't depend on the
+state, decoding, preprocessing and thresholding, run for a whole chunk on
+a thread pool, with prepare_frame, while the state machine, whose background model
+must see the frames in order, runs over the previous chunk. OpenCV
+releases the GIL in these stages, so they run in parallel on several
+cores.
+
+Usage:
+    python BatchAnalysis.py "video/videosMock/Objeto3segs.mp4"
+"""
+
+import argparse
+import collections
+import contextlib
+import io
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from statemachineV2 import SurgicalInstrumentTrackDetect
+
+
+# Per-frame timeline of a session:
+# - states: index in state_names of the state after each frame.
+# - triggers: index in trigger_names of the transition fired by each
+#   frame, -1 for frames skipped by the processing budget (frame_strides)
+#   or received after the state machine stopped.
+# - changed: whether the frame changed the state.
+# - captures: whether the frame produced a captured image.
+# - times: milliseconds spent by the state machine on each frame, without
+#   the prepared stages.
+# - images: dict of the captured images, by frame index, if kept.
+SessionTimeline = collections.namedtuple(
+    "SessionTimeline", ["states", "triggers", "changed", "captures", "times",
+                        "images", "state_names", "trigger_names"])
+
+
+def trigger_names():
+    """
+    Names of the transitions of the state machine, in definition order.
+    """
+    names = []
+    for transition in SurgicalInstrumentTrackDetect.transitions:
+        trigger = (transition[0] if isinstance(transition, (list, tuple))
+                   else transition["trigger"])
+        if trigger not in names:
+            names.append(trigger)
+    return names
+
+
+def prepare_frame(supervisor, picture):
+    """
+    The stages of a frame that don't depend on the state: decoding,
+    preprocessing and the threshold masks.
+
+    Returns:
+        The bgsub.FrameAnalysis of the picture, or None if it can't be
+        decoded.
+    """
+    analysis = supervisor.prepare_frame(picture)
+    if analysis is not None:
+        analysis.thresholds  # computed and cached
+    return analysis
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class TimelineRecorder(object):
+    """
+    Runs the state machine over prepared frames, recording the timeline.
+    """
+
+    def __init__(self, supervisor, keep_images=False):
+        self.supervisor = supervisor
+        self.state_names = tuple(supervisor.machine.get_nested_state_names())
+        self.trigger_names = tuple(trigger_names())
+        self._state_codes = {name: code
+                             for code, name in enumerate(self.state_names)}
+        self._trigger_codes = {name: code
+                               for code, name in enumerate(self.trigger_names)}
+        self.keep_images = keep_images
+        # The supervisor may have run before the session
+        self.initial_state = self._state_codes[supervisor.state]
+        self.states, self.triggers, self.captures, self.times = [], [], [], []
+        self.images = {}
+
+    def run(self, chunk, analyses):
+        """
+        Run the state machine over a chunk of frames, in order.
+
+        Args:
+            chunk (list): The pictures.
+            analyses (list): Future of the prepare_frame result of each
+                picture, or None to prepare it in object_tracking.
+        """
+        supervisor = self.supervisor
+        for picture, analysis in zip(chunk, analyses):
+            if analysis is not None:
+                analysis = analysis.result()
+            trigger = ("trigger_initialize" if supervisor.state == "start"
+                       else supervisor.nxt_transition)
+            previous = supervisor.analysis
+            start = time.perf_counter()
+            output = supervisor.object_tracking(picture, analysis=analysis)
+            self.times.append(1000 * (time.perf_counter() - start))
+            flag, image = output if output is not None else (False, None)
+            # A processed frame gets a new analysis, a skipped one does not
+            processed = supervisor.analysis is not previous
+            self.triggers.append(self._trigger_codes.get(trigger, -1)
+                                 if processed else -1)
+            self.states.append(self._state_codes[supervisor.state])
+            self.captures.append(bool(flag))
+            if flag and self.keep_images:
+                self.images[len(self.states) - 1] = image
+
+    def timeline(self):
+        states = np.array(self.states, dtype=np.int8)
+        changed = np.zeros(len(states), dtype=bool)
+        changed[1:] = states[1:] != states[:-1]
+        if len(states):
+            changed[0] = states[0] != self.initial_state
+        return SessionTimeline(states, np.array(self.triggers, dtype=np.int8),
+                               changed, np.array(self.captures, dtype=bool),
+                               np.array(self.times, dtype=np.float32),
+                               self.images, self.state_names,
+                               self.trigger_names)
+
+
+def analyse_session(pictures, chunk_size=32, workers=None,
+                    keep_images=False, supervisor=None, **fsm_options):
+    """
+    Replay a recorded session through the state machine.
+
+    Args:
+        pictures: Sequence or iterator of the frames, in any input
+            accepted by object_tracking: JPEG pictures or pixels.
+        chunk_size (int): Frames prepared at a time.
+        workers (int): Threads preparing the frames, the number of CPUs
+            if None. 0 prepares nothing ahead, as object_tracking alone,
+            which avoids preparing the frames that frame_strides or the
+            motion gate will skip.
+        keep_images (bool): Keep the captured images in the timeline.
+        supervisor: The state machine to run, a new one with fsm_options
+            if None.
+        **fsm_options: Keyword arguments for SurgicalInstrumentTrackDetect.
+
+    Returns:
+        The SessionTimeline of the frames.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
+    if supervisor is None:
+        supervisor = SurgicalInstrumentTrackDetect(**fsm_options)
+    recorder = TimelineRecorder(supervisor, keep_images)
+    if workers == 0:
+        for chunk in chunks(pictures, chunk_size):
+            recorder.run(chunk, [None] * len(chunk))
+        return recorder.timeline()
+
+    with ThreadPoolExecutor(workers or os.cpu_count() or 1) as executor:
+        pending = None  # chunk prepared ahead, and its futures
+        for chunk in chunks(pictures, chunk_size):
+            futures = [executor.submit(prepare_frame, supervisor, picture)
+                       for picture in chunk]
+            # The next chunk is prepared while this one runs
+            if pending is not None:
+                recorder.run(*pending)
+            pending = (chunk, futures)
+        if pending is not None:
+            recorder.run(*pending)
+    return recorder.timeline()
+
+
+def summarize(timeline):
+    """
+    The state changes of a timeline, as (frame, state) pairs.
+    """
+    frames = np.flatnonzero(timeline.changed)
+    return [(int(frame), timeline.state_names[timeline.states[frame]])
+            for frame in frames]
+
+
+if __name__ == "__main__":
+    import benchmark_utils as bench
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("video", help="Recorded session")
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Maximum number of frames")
+    parser.add_argument("--chunk-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    frames = bench.read_frames(args.video, args.frames)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        timeline = analyse_session(frames, args.chunk_size, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"{len(frames)} frames in {elapsed:.1f} s, "
+          f"{1000 * elapsed / max(len(frames), 1):.1f} ms/frame, "
+          f"{int(timeline.captures.sum())} captures at frames "
+          f"{np.flatnonzero(timeline.captures).tolist()}")
+    for frame, state in summarize(timeline):
+        print(f"{frame:6d}  {state}")
@@ -0,0 +1,180 @@
+"""
+Geometry of bounding boxes
+
+Bounding boxes are (x, y, w, h) tuples, as returned by cv2.boundingRect
+and by the locate_object functions, covering the pixels from x to x + w - 1
+and from y to y + h - 1. The empty box is ().
+
+The areas, intersections and unions of boxes are computed from their
+coordinates, without drawing them in full frame masks. Mask operations
+are reserved for truly pixel-shaped regions, as the foreground masks.
+
+"""
+
+
+def box_area(box):
+    """
+    Area of a box in pixels, 0 for the empty box.
+    """
+    if not box:
+        return 0
+    return max(box[2], 0) * max(box[3], 0)
+
+
+def clip_box(box, shape):
+    """
+    Clip a box to the image limits.
+
+    Args:
+        box (tuple): The (x, y, w, h) box.
+        shape (tuple): Shape of the image, height first.
+
+    Returns:
+        tuple: The part of the box inside the image, or () if none.
+    """
+    return intersection(box, (0, 0, shape[1], shape[0]))
+
+
+def filled_rectangle(box, shape):
+    """
+    Pixels painted by a filled cv2.rectangle from (x, y) to (x + w, y + h).
+
+    cv2.rectangle includes both corners, one pixel more in each direction
+    than the box. Used to reproduce the areas of the boxes drawn in masks.
+
+    Args:
+        box (tuple): The (x, y, w, h) box.
+        shape (tuple): Shape of the image the rectangle is drawn in.
+
+    Returns:
+        tuple: The (x, y, w, h) box of the painted pixels.
+    """
+    x, y, w, h = box
+    return clip_box((x, y, w + 1, h + 1), shape)
+
+
+def intersection(box1, box2):
+    """
+    Intersection of two boxes.
+
+    Returns:
+        tuple: The (x, y, w, h) intersection box, or () if they do not
+        overlap.
+    """
+    if not box1 or not box2:
+        return ()
+    x_min = max(box1[0], box2[0])
+    y_min = max(box1[1], box2[1])
+    x_max = min(box1[0] + box1[2], box2[0] + box2[2])
+    y_max = min(box1[1] + box1[3], box2[1] + box2[3])
+    if x_max <= x_min or y_max <= y_min:
+        return ()
+    return (x_min, y_min, x_max - x_min, y_max - y_min)
+
+
+def enclosing_box(boxes):
+    """
+    Smallest box containing all the boxes, as the final object box of
+    identify_contours.
+
+    Returns:
+        tuple: The (x, y, w, h) enclosing box, or () if there are no boxes.
+    """
+    boxes = [box for box in boxes if box]
+    if not boxes:
+        return ()
+    x_min = min(x for x, _, _, _ in boxes)
+    y_min = min(y for _, y, _, _ in boxes)
+    x_max = max(x + w for x, _, w, _ in boxes)
+    y_max = max(y + h for _, y, _, h in boxes)
+    return (x_min, y_min, x_max - x_min, y_max - y_min)
+
+
+def union_area(boxes):
+    """
+    Area covered by a group of possibly overlapping boxes.
+
+    Sweeps the vertical slabs between the x coordinates of the boxes,
+    adding the length covered by the boxes in each slab. Independent of
+    the image size, and fast for the few boxes of a frame.
+    """
+    boxes = [box for box in boxes if box_area(box)]
+    if len(boxes) < 2:
+        return sum(box_area(box) for box in boxes)
+    xs = sorted({x for x, _, _, _ in boxes} | {x + w for x, _, w, _ in boxes})
+    area = 0
+    for x_min, x_max in zip(xs, xs[1:]):
+        # Vertical intervals of the boxes crossing this slab, merged
+        intervals = sorted((y, y + h) for x, y, w, h in boxes
+                           if x <= x_min and x_max <= x + w)
+        covered = 0
+        end = None
+        for y_min, y_max in intervals:
+            if end is None or y_min > end:
+                covered += y_max - y_min
+                end = y_max
+            elif y_max > end:
+                covered += y_max - end
+                end = y_max
+        area += covered * (x_max - x_min)
+    return area
+
+
+def box_iou(box1, box2):
+    """
+    Intersection over union of two boxes.
+
+    Returns:
+        float: The IoU, 0 if both boxes are empty.
+    """
+    intersection_area = box_area(intersection(box1, box2))
+    union = box_area(box1) + box_area(box2) - intersection_area
+    if union == 0:
+        return 0.0
+    return intersection_area / union
+
+
+def boxes_iou(boxes1, boxes2):
+    """
+    Intersection over union of the regions covered by two groups of boxes.
+
+    Same result of drawing each group as filled boxes in a mask and
+    comparing the masks.
+
+    Returns:
+        float: The IoU, 0 if both regions are empty.
+    """
+    intersection_area = union_area(
+        [intersection(box1, box2) for box1 in boxes1 for box2 in boxes2])
+    union = union_area(boxes1) + union_area(boxes2) - intersection_area
+    if union == 0:
+        return 0.0
+    return intersection_area / union
+
+
+def contains(outer, inner):
+    """
+    Check if the inner box is completely inside the outer box.
+    """
+    if not outer or not inner:
+        return False
+    return (outer[0] <= inner[0] and outer[1] <= inner[1]
+            and inner[0] + inner[2] <= outer[0] + outer[2]
+            and inner[1] + inner[3] <= outer[1] + outer[3])
+
+
+def margin_distance(box, shape):
+    """
+    Distance in pixels from a box to the nearest image border.
+
+    Args:
+        box (tuple): The (x, y, w, h) box.
+        shape (tuple): Shape of the image, height first.
+
+    Returns:
+        int: The smallest of the distances to the four borders, negative
+        if the box crosses a border.
+    """
+    height, width = shape[:2]
+    x, y, w, h = box
+    return min(x, y, width - (x + w), height - (y + h))
@@ -0,0 +1,296 @@
+"""
+Pool of worker processes hosting the state machines of many cameras
+
+Each camera needs its own SurgicalInstrumentTrackDetect, with its own
+background model. In a single process, the state machines of all the
+cameras share one interpreter, and the Python parts of their analysis do
+not run in parallel. CameraPool hosts them in a pool of worker processes:
+
+- Camera IDs are sharded across the workers by a stable hash, so each
+  camera always goes to the same worker, which owns its state machine.
+- Each worker reads a single FIFO queue, so the frames of a camera are
+  processed in the order they were submitted.
+- The results of all the workers come back through one queue, read by a
+  collector thread that keeps per-camera statistics.
+
+"""
+
+import collections
+import contextlib
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+
+
+# Result of a processed frame. latency is the time in seconds from submit
+# to the result arriving at the pool, processing_time the time spent in
+# object_tracking by the worker
+CameraResult = collections.namedtuple(
+    "CameraResult", ["camera_id", "frame_id", "flag", "image", "state",
+                     "latency", "processing_time"])
+
+
+def camera_worker(frame_queue, result_queue, fsm_options, quiet):
+    """
+    Worker process loop. Runs one state machine per camera.
+
+    Args:
+        frame_queue: Queue of (camera_id, frame_id, submit_time, picture)
+            items, None to stop.
+        result_queue: Queue for the CameraResult of each frame.
+        fsm_options (dict): Keyword arguments for the state machines.
+        quiet (bool): Discard the prints of the state machines.
+    """
+    # Imported in the worker, that owns the state machines
+    from statemachineV2 import SurgicalInstrumentTrackDetect
+
+    supervisors = {}
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            devnull = stack.enter_context(open(os.devnull, "w"))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        while True:
+            item = frame_queue.get()
+            if item is None:
+                break
+            camera_id, frame_id, submit_time, picture = item
+            supervisor = supervisors.get(camera_id)
+            if supervisor is None:
+                supervisor = SurgicalInstrumentTrackDetect(**fsm_options)
+                supervisors[camera_id] = supervisor
+            start = time.perf_counter()
+            try:
+                output = supervisor.object_tracking(picture)
+            except Exception as e:
+                print(f"Erro na camera {camera_id}, frame {frame_id}:\n{e}")
+                output = None
+            flag, image = output if output is not None else (False, None)
+            result_queue.put(CameraResult(
+                camera_id, frame_id, flag, image, supervisor.state,
+                submit_time, time.perf_counter() - start))
+
+
+class CameraStats(object):
+    """
+    Counters of a camera, kept by the pool.
+
+    Attributes:
+        submitted (int): Frames submitted.
+        processed (int): Frames processed by the worker.
+        rejected (int): Frames refused because the queue was full.
+        captures (int): Captured images.
+        processing_time (float): Total time in object_tracking, seconds.
+        first_submit (float): perf_counter of the first submitted frame.
+        state (str): State after the last processed frame.
+    """
+
+    def __init__(self):
+        self.submitted = 0
+        self.processed = 0
+        self.rejected = 0
+        self.captures = 0
+        self.processing_time = 0.0
+        self.first_submit = None
+        self.state = None
+
+    @property
+    def queue_depth(self):
+        """
+        Frames submitted and not yet processed.
+        """
+        return self.submitted - self.processed
+
+    def throughput(self, now=None):
+        """
+        Processed frames per second since the first submitted frame.
+        """
+        if self.first_submit is None:
+            return 0.0
+        elapsed = (now or time.perf_counter()) - self.first_submit
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+
+class CameraPool(object):
+    """
+    Shards the state machines of many cameras across worker processes.
+
+    Attributes:
+        workers (int): Number of worker processes.
+        max_queue_depth (int): Maximum frames waiting per camera. Further
+            frames are rejected by submit. None for no limit.
+        callback: Function called with each CameraResult, from the
+            collector thread, or None.
+        stats (dict): CameraStats of each camera ID.
+    """
+
+    def __init__(self, workers=None, max_queue_depth=None, callback=None,
+                 max_results=1024, quiet=True, **fsm_options):
+        """
+        Start the worker processes.
+
+        Args:
+            workers (int): Number of worker processes, the number of CPUs
+                if None.
+            max_queue_depth (int): Maximum frames waiting per camera.
+            callback: Function called with each CameraResult. The results
+                are then not kept for poll.
+            max_results (int): Results kept for poll, the oldest are
+                dropped when they are not taken in time.
+            quiet (bool): Discard the prints of the state machines.
+            **fsm_options: Keyword arguments for the state machines of
+                every camera.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue_depth = max_queue_depth
+        self.callback = callback
+        self.stats = {}
+
+        self._lock = threading.Lock()
+        self._results = collections.deque(maxlen=max_results)
+        self._result_queue = multiprocessing.Queue()
+        self._frame_queues = []
+        self._processes = []
+        for index in range(self.workers):
+            frame_queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=camera_worker, name=f"camera-worker-{index}",
+                args=(frame_queue, self._result_queue, fsm_options, quiet),
+                daemon=True)
+            process.start()
+            self._frame_queues.append(frame_queue)
+            self._processes.append(process)
+
+        self._collector = threading.Thread(target=self._collect,
+                                           name="camera-pool-collector",
+                                           daemon=True)
+        self._collector.start()
+
+    def worker_of(self, camera_id):
+        """
+        Index of the worker hosting a camera. Stable across runs.
+        """
+        return zlib.crc32(str(camera_id).encode()) % self.workers
+
+    def submit(self, camera_id, picture):
+        """
+        Submit a JPEG picture of a camera. Never blocks.
+
+        Returns:
+            The frame_id of the picture in its camera, or None if it was
+            rejected because the camera queue is full.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            stats = self.stats.setdefault(camera_id, CameraStats())
+            if stats.first_submit is None:
+                stats.first_submit = now
+            if (self.max_queue_depth is not None and
+                    stats.queue_depth >= self.max_queue_depth):
+                stats.rejected += 1
+                return None
+            frame_id = stats.submitted
+            stats.submitted += 1
+        self._frame_queues[self.worker_of(camera_id)].put(
+            (camera_id, frame_id, now, picture))
+        return frame_id
+
+    def poll(self):
+        """
+        Take the oldest result not yet taken, without blocking. Results
+        are only kept for poll when there is no callback.
+
+        Returns:
+            The CameraResult, or None if there are no results.
+        """
+        with self._lock:
+            return self._results.popleft() if self._results else None
+
+    def report(self):
+        """
+        Per-camera statistics.
+
+        Returns:
+            dict: For each camera ID, a dict with the throughput in frames
+            per second, the queue depth, the processed, rejected and
+            captured frames, the mean processing time in ms and the state.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            return {camera_id: {
+                        "fps": stats.throughput(now),
+                        "queue_depth": stats.queue_depth,
+                        "processed": stats.processed,
+                        "rejected": stats.rejected,
+                        "captures": stats.captures,
+                        "processing_ms": (1000 * stats.processing_time
+                                          / max(stats.processed, 1)),
+                        "state": stats.state}
+                    for camera_id, stats in self.stats.items()}
+
+    def wait(self, timeout=None):
+        """
+        Wait until every submitted frame is processed.
+
+        Returns:
+            bool: True if all the frames were processed before the timeout,
+            False on timeout or if a worker process died, as its frames
+            will never be processed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if all(stats.queue_depth == 0
+                       for stats in self.stats.values()):
+                    return True
+            if not all(process.is_alive() for process in self._processes):
+                return False
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+
+    def close(self):
+        """
+        Stop the workers after the frames already submitted.
+        """
+        for frame_queue, process in zip(self._frame_queues, self._processes):
+            if process.is_alive():
+                frame_queue.put(None)
+            else:
+                # Nobody reads the frames left, don't wait for them at exit
+                frame_queue.cancel_join_thread()
+        for process in self._processes:
+            process.join()
+        self._result_queue.put(None)
+        self._collector.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _collect(self):
+        while True:
+            result = self._result_queue.get()
+            if result is None:
+                break
+            # The worker sends the submit time, turned here into latency
+            result = result._replace(
+                latency=time.perf_counter() - result.latency)
+            with self._lock:
+                stats = self.stats[result.camera_id]
+                stats.processed += 1
+                stats.captures += bool(result.flag)
+                stats.processing_time += result.processing_time
+                stats.state = result.state
+                if self.callback is None:
+                    self._results.append(result)
+            if self.callback is not None:
+                try:
+                    self.callback(result)
+                except Exception as e:
+                    # The collector must keep the stats of every camera
+                    print(f"Erro no callback da camera {result.camera_id}, "
+                          f"frame {result.frame_id}:\n{e}")
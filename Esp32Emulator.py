@@ -0,0 +1,439 @@
+"""
+Emulator of the ESP32 OV2640 camera web server
+
+Serves the endpoints used by index_ov2640_mod.html, so the ingestion and
+scaling code can be exercised without the boards:
+
+- Port 80: / (the page), /capture (one JPEG), /status (JSON settings),
+  /control?var=<name>&val=<value> for framesize and quality, and
+  /xclk?xclk=<MHz>.
+- Port 81: /stream, the multipart/x-mixed-replace MJPEG stream, with the
+  same boundary, part headers and chunked encoding as the firmware.
+
+The frames come from a video, such as the video/videosMock clips, played
+in a loop, or from a synthetic scene with a moving object. Each frame is
+resized to the framesize and encoded with the quality set through
+/control. The frame rate is nominal_fps at 20 MHz XCLK, proportional to
+the XCLK. An optional bandwidth limit, shared by all the connections as
+the WiFi link of the board, throttles the bytes sent.
+
+Usage:
+    python Esp32Emulator.py --video "video/videosMock/Objeto3segs.mp4"
+    python Esp32Emulator.py --synthetic --bandwidth 1000
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+
+# Resolutions of the esp32-camera framesize_t values up to the OV2640
+# maximum. The page offers 15, 13, 11, 10, 8 and 6
+framesizes = {0: (96, 96), 1: (160, 120), 2: (128, 128), 3: (176, 144),
+              4: (240, 176), 5: (240, 240), 6: (320, 240), 8: (400, 296),
+              9: (480, 320), 10: (640, 480), 11: (800, 600),
+              12: (1024, 768), 13: (1280, 720), 14: (1280, 1024),
+              15: (1600, 1200)}
+
+# Same boundary as the firmware
+part_boundary = "123456789000000000000987654321"
+
+page_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "index_ov2640_mod.html")
+
+
+def jpeg_quality(quality):
+    """
+    OpenCV JPEG quality for an OV2640 quality, 0 to 63, lower is better.
+    """
+    return int(round(100 - 95 * min(max(quality, 0), 63) / 63))
+
+
+class VideoSource(object):
+    """
+    Frames of a video file, played in a loop.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            raise ValueError(f"Can't open the video {path}")
+        self._lock = threading.Lock()
+
+    def read(self):
+        with self._lock:
+            ret, frame = self._capture.read()
+            if not ret:
+                # End of the video, play it again
+                self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame = self._capture.read()
+            if not ret:
+                raise ValueError(f"Can't read the video {self.path}")
+            return frame
+
+
+class SyntheticSource(object):
+    """
+    Synthetic scene: a dark object crossing a noisy light background,
+    then resting at the centre.
+
+    Attributes:
+        size (tuple): Frame size, (width, height).
+        period (int): Frames of a crossing and rest cycle.
+    """
+
+    def __init__(self, size=(1600, 1200), period=150, seed=0):
+        self.size = size
+        self.period = period
+        self._rng = np.random.default_rng(seed)
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def read(self):
+        with self._lock:
+            index = self._index
+            self._index += 1
+            noise = self._rng.integers(0, 8, (self.size[1], self.size[0], 1),
+                                       dtype=np.uint8)
+        width, height = self.size
+        frame = np.full((height, width, 3), 200, dtype=np.uint8)
+        frame -= noise
+        # Empty for the first third of the cycle, entering in the second,
+        # resting at the centre in the last
+        phase = (index % self.period) / self.period
+        if phase >= 1 / 3:
+            progress = min(1.0, (phase - 1 / 3) * 3)
+            x = int(progress * (width // 2))
+            y = height // 2
+            cv2.rectangle(frame, (x - width // 10, y - height // 20),
+                          (x + width // 10, y + height // 20),
+                          (60, 60, 60), -1)
+        return frame
+
+
+class TokenBucket(object):
+    """
+    Bandwidth limit in bytes per second, shared by its users.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate / 10
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, count):
+        """
+        Wait until count bytes can be sent.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= count
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class EmulatedCamera(object):
+    """
+    Camera settings and JPEG capture.
+
+    Attributes:
+        source: Frame source, with a read method returning BGR frames.
+        framesize (int): esp32-camera framesize value.
+        quality (int): OV2640 JPEG quality, 0 to 63, lower is better.
+        xclk (int): XCLK in MHz.
+        nominal_fps (float): Frame rate at 20 MHz XCLK.
+    """
+
+    def __init__(self, source, framesize=6, quality=10, xclk=20,
+                 nominal_fps=25):
+        self.source = source
+        self.framesize = framesize
+        self.quality = quality
+        self.xclk = xclk
+        self.nominal_fps = nominal_fps
+        self._next_frame = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def frame_interval(self):
+        return 20 / (self.xclk * self.nominal_fps)
+
+    def set_control(self, name, value):
+        """
+        Change a setting, as /control.
+
+        Raises:
+            ValueError: Unknown setting or value out of range.
+        """
+        if name == "framesize":
+            if value not in framesizes:
+                raise ValueError(f"Unsupported framesize {value}")
+            self.framesize = value
+        elif name == "quality":
+            if not 0 <= value <= 63:
+                raise ValueError(f"Quality {value} outside 0 to 63")
+            self.quality = value
+        else:
+            raise ValueError(f"Unknown control {name}")
+
+    def set_xclk(self, xclk):
+        if not 1 <= xclk <= 40:
+            raise ValueError(f"XCLK {xclk} MHz outside 1 to 40")
+        self.xclk = xclk
+
+    def status(self):
+        return {"framesize": self.framesize, "quality": self.quality,
+                "xclk": self.xclk}
+
+    def capture(self):
+        """
+        Wait for the next frame time and capture a JPEG picture.
+
+        Returns:
+            bytes: The JPEG picture.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_frame - now
+            self._next_frame = max(now, self._next_frame) + self.frame_interval
+        if wait > 0:
+            time.sleep(wait)
+        frame = self.source.read()
+        size = framesizes[self.framesize]
+        if (frame.shape[1], frame.shape[0]) != size:
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode(
+            ".jpg", frame,
+            [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality(self.quality)])
+        if not ret:
+            raise ValueError("JPEG encoding failed")
+        return buffer.tobytes()
+
+
+class Esp32RequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the control and stream endpoints of the board.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        camera = self.server.camera
+        route = (self.server.stream_routes if self.server.is_stream
+                 else self.server.control_routes).get(url.path)
+        if route is None:
+            self.send_body(404, b"Not Found", "text/plain")
+            return
+        try:
+            getattr(self, route)(camera, query)
+        except ValueError as e:
+            # The firmware answers 500 to failed settings
+            self.send_body(500, str(e).encode(), "text/plain")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client left the stream
+            self.close_connection = True
+
+    def index(self, camera, query):
+        with open(page_file, "rb") as page:
+            self.send_body(200, page.read(), "text/html")
+
+    def capture(self, camera, query):
+        picture = camera.capture()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Disposition",
+                         "inline; filename=capture.jpg")
+        self.send_header("Content-Length", str(len(picture)))
+        self.end_headers()
+        self.write(picture)
+
+    def status(self, camera, query):
+        self.send_body(200, json.dumps(camera.status()).encode(),
+                       "application/json")
+
+    def control(self, camera, query):
+        if "var" not in query or "val" not in query:
+            self.send_body(404, b"Missing var or val", "text/plain")
+            return
+        camera.set_control(query["var"], int(query["val"]))
+        self.send_body(200, b"", "text/plain")
+
+    def xclk(self, camera, query):
+        if "xclk" not in query:
+            self.send_body(404, b"Missing xclk", "text/plain")
+            return
+        camera.set_xclk(int(query["xclk"]))
+        self.send_body(200, b"OK", "text/plain")
+
+    def stream(self, camera, query):
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/x-mixed-replace;"
+                         f"boundary={part_boundary}")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        delimiter = f"\r\n--{part_boundary}\r\n".encode()
+        while not self.server.stopping.is_set():
+            picture = camera.capture()
+            timestamp = time.time()
+            headers = (f"Content-Type: image/jpeg\r\n"
+                       f"Content-Length: {len(picture)}\r\n"
+                       f"X-Timestamp: {int(timestamp)}."
+                       f"{int(timestamp % 1 * 1e6):06d}\r\n\r\n").encode()
+            # Delimiter, headers and picture as separate chunks, as the
+            # firmware sends them
+            for data in (delimiter, headers, picture):
+                self.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.write(b"0\r\n\r\n")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.write(body)
+
+    def write(self, data):
+        # Throttled in slices, so the limit holds within a frame
+        bucket = self.server.bandwidth
+        if bucket is None:
+            self.wfile.write(data)
+            return
+        view = memoryview(data)
+        for start in range(0, len(view), 4096):
+            piece = view[start:start + 4096]
+            bucket.consume(len(piece))
+            self.wfile.write(piece)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class Esp32Server(ThreadingHTTPServer):
+    """
+    One of the two HTTP servers of the board.
+    """
+
+    daemon_threads = True
+    control_routes = {"/": "index", "/capture": "capture",
+                      "/status": "status", "/control": "control",
+                      "/xclk": "xclk"}
+    stream_routes = {"/stream": "stream"}
+
+    def __init__(self, address, camera, is_stream, bandwidth, stopping,
+                 verbose):
+        super().__init__(address, Esp32RequestHandler)
+        self.camera = camera
+        self.is_stream = is_stream
+        self.bandwidth = bandwidth
+        self.stopping = stopping
+        self.verbose = verbose
+
+
+class Esp32Emulator(object):
+    """
+    Emulated board, with the control server and the stream server.
+
+    Attributes:
+        camera: The EmulatedCamera.
+        control_url (str): Base URL of the control server.
+        stream_url (str): URL of the MJPEG stream.
+    """
+
+    def __init__(self, source, host="127.0.0.1", control_port=80,
+                 stream_port=81, bandwidth=None, verbose=False,
+                 **camera_options):
+        """
+        Start the servers.
+
+        Args:
+            source: Frame source, VideoSource or SyntheticSource.
+            host (str): Address to listen on.
+            control_port (int): Port of the control server, 0 for any.
+            stream_port (int): Port of the stream server, 0 for any.
+            bandwidth (float): Bandwidth limit in bytes per second, None
+                for no limit.
+            verbose (bool): Log the requests.
+            **camera_options: Keyword arguments for EmulatedCamera.
+        """
+        self.camera = EmulatedCamera(source, **camera_options)
+        bucket = TokenBucket(bandwidth) if bandwidth else None
+        self._stopping = threading.Event()
+        self._servers = [
+            Esp32Server((host, port), self.camera, is_stream, bucket,
+                        self._stopping, verbose)
+            for port, is_stream in ((control_port, False),
+                                    (stream_port, True))]
+        self._threads = [threading.Thread(target=server.serve_forever,
+                                          daemon=True)
+                         for server in self._servers]
+        for thread in self._threads:
+            thread.start()
+        control_port = self._servers[0].server_address[1]
+        stream_port = self._servers[1].server_address[1]
+        self.control_url = f"http://{host}:{control_port}"
+        self.stream_url = f"http://{host}:{stream_port}/stream"
+
+    def close(self):
+        self._stopping.set()
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--video", default=None,
+                        help="Video played in a loop as the camera")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="Synthetic scene instead of a video")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=80,
+                        help="Control port, the stream is on port + 1")
+    parser.add_argument("--framesize", type=int, default=6)
+    parser.add_argument("--quality", type=int, default=10)
+    parser.add_argument("--fps", type=float, default=25,
+                        help="Frame rate at 20 MHz XCLK")
+    parser.add_argument("--bandwidth", type=float, default=None,
+                        help="Bandwidth limit in kB/s")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.synthetic or args.video is None:
+        source = SyntheticSource()
+    else:
+        source = VideoSource(args.video)
+    emulator = Esp32Emulator(
+        source, args.host, args.port, args.port + 1,
+        bandwidth=args.bandwidth and 1000 * args.bandwidth,
+        verbose=args.verbose, framesize=args.framesize,
+        quality=args.quality, nominal_fps=args.fps)
+    print(f"Control: {emulator.control_url}\nStream: {emulator.stream_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.close()
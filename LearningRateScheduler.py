@@ -0,0 +1,108 @@
+"""
+Learning rate scheduler for the background model
+
+The background model learning rate decides how fast changes in the scene
+become background. Originally two fixed values were used: 0.1 in the
+error state, to forget the shadow of a removed object in approximately
+10 frames, and 0.0001 everywhere else, to preserve stopped instruments.
+
+The scheduler starts from the same values, and adapts them with the
+state machine state and the fraction of foreground pixels measured in
+the previous frame:
+
+- In the error state, while the foreground persists (the shadow of a
+  removed object), the rate ramps up to absorb it in fewer frames.
+- In the free workplace, small persistent foreground fractions (lighting
+  drift, shadows) ramp the rate up slowly. Any larger foreground, an
+  object entering the scene, brings the rate back to the base value.
+- While tracking an object, the base rate preserves the stopped object.
+
+"""
+
+
+class LearningRateScheduler(object):
+    """
+    Learning rate driven by the FSM state and the foreground fraction.
+
+    Attributes:
+        base_rate (float): Rate of the monitoring states.
+        error_rate (float): Initial rate of the error state.
+        max_error_rate (float): Upper limit of the error state rate.
+        idle_max_rate (float): Upper limit of the free workplace rate.
+        ramp_up (float): Rate multiplier per frame with foreground.
+        ramp_down (float): Rate multiplier per frame without foreground.
+        shadow_fraction (float): Foreground fraction below which the
+            foreground is considered noise.
+        object_fraction (float): Foreground fraction above which the free
+            workplace is considered to have an object entering it.
+        rate (float): The current learning rate.
+    """
+
+    def __init__(self, base_rate=0.0001, error_rate=0.1, max_error_rate=0.5,
+                 idle_max_rate=0.005, ramp_up=1.5, ramp_down=0.5,
+                 shadow_fraction=0.001, object_fraction=0.01):
+        self.base_rate = base_rate
+        self.error_rate = error_rate
+        self.max_error_rate = max_error_rate
+        self.idle_max_rate = idle_max_rate
+        self.ramp_up = ramp_up
+        self.ramp_down = ramp_down
+        self.shadow_fraction = shadow_fraction
+        self.object_fraction = object_fraction
+
+        self.state = None
+        self.rate = base_rate
+
+    def get_rate(self, state):
+        """
+        Learning rate for the current frame.
+
+        Args:
+            state (str): Current state of the state machine.
+
+        Returns:
+            float: The learning rate.
+        """
+        if state != self.state:
+            # Every state starts from its own base value
+            self.state = state
+            if state == "operational_error":
+                self.rate = self.error_rate
+            else:
+                self.rate = self.base_rate
+        return self.rate
+
+    def update(self, state, foreground_fraction):
+        """
+        Adapt the learning rate with the foreground of the current frame.
+
+        Args:
+            state (str): Current state of the state machine.
+            foreground_fraction (float): Fraction of foreground pixels in
+                the mask of the current frame, or None if the background
+                model was not updated.
+        """
+        if foreground_fraction is None or state != self.state:
+            return
+
+        if state == "operational_error":
+            if foreground_fraction > self.shadow_fraction:
+                # Remaining shadow, absorb it faster
+                self.rate = min(self.rate * self.ramp_up,
+                                self.max_error_rate)
+            else:
+                self.rate = max(self.rate * self.ramp_down, self.error_rate)
+
+        elif state == "operational_monitoring_workplaceFree":
+            if foreground_fraction > self.object_fraction:
+                # Something entered the workplace. Preserve it
+                self.rate = self.base_rate
+            elif foreground_fraction > self.shadow_fraction:
+                # Slow drift of the background
+                self.rate = min(self.rate * self.ramp_up, self.idle_max_rate)
+            else:
+                self.rate = max(self.rate * self.ramp_down, self.base_rate)
+
+        else:
+            # Tracking and centering keep the stopped object in the mask
+            self.rate = self.base_rate
@@ -0,0 +1,180 @@
+"""
+History of the last foreground masks, for stillness detection
+
+The tracking state decides that an object stopped when its foreground
+mask stays the same for some frames. Instead of comparing each mask with
+the previous one, MaskHistory keeps a ring buffer of the last N masks and
+their bounding boxes, and measures them against their median:
+
+- The median mask has the pixels set in more than half of the masks. The
+  per-pixel counts are kept bit-sliced over the packed words, one bit
+  plane per bit of the count, and updated incrementally as masks enter
+  and leave the buffer.
+- The IoU of every mask against the median mask, from popcounts.
+- The drift of the boxes: the largest distance of a box corner to the
+  median box corner.
+
+A single jittery mask moves the median little, so it does not restart
+the stillness count as a failed comparison of consecutive masks did.
+
+"""
+
+import numpy as np
+
+from PackedMask import popcount
+
+
+class MaskHistory(object):
+    """
+    Ring buffer of the last packed masks and their bounding boxes.
+
+    Attributes:
+        size (int): Maximum number of masks kept.
+        shape (tuple): Shape of the masks, set by the first mask.
+        words: Packed words of the masks, one row per buffer slot.
+        counts: Number of set pixels of each mask.
+        boxes: Box of each mask, as (x_min, y_min, x_max, y_max).
+        frames: Received frames represented by each mask.
+        planes (list): Bit planes of the per-pixel counts, least
+            significant first.
+    """
+
+    def __init__(self, size=4):
+        if size < 2:
+            raise ValueError("The mask history needs at least 2 masks")
+        self.size = size
+        self.shape = None
+        self.words = None
+        self.planes = None
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.boxes = np.zeros((size, 4), dtype=np.int64)
+        self.frames = np.zeros(size, dtype=np.int64)
+        self.length = 0
+        self.next_slot = 0
+
+    def __len__(self):
+        return self.length
+
+    def clear(self):
+        """
+        Forget all the masks.
+        """
+        self.words = None
+        self.planes = None
+        self.counts[:] = 0
+        self.boxes[:] = 0
+        self.frames[:] = 0
+        self.length = 0
+        self.next_slot = 0
+
+    @property
+    def covered_frames(self):
+        """
+        Number of received frames represented by the masks in the buffer.
+        """
+        return int(self.frames.sum())
+
+    def append(self, mask, box, frames=1):
+        """
+        Add a mask to the history, replacing the oldest one if full.
+
+        Args:
+            mask: The PackedMask of the frame.
+            box (tuple): Bounding box of the mask, (x, y, w, h).
+            frames (int): Received frames represented by this mask.
+        """
+        if self.words is None or mask.shape != self.shape:
+            # First mask, or a new resolution after a reconfiguration
+            self.clear()
+            self.shape = mask.shape
+            self.words = np.zeros((self.size, mask.words.size),
+                                  dtype=np.uint64)
+            self.planes = [np.zeros(mask.words.size, dtype=np.uint64)
+                           for _ in range(self.size.bit_length())]
+
+        slot = self.next_slot
+        if self.length == self.size:
+            self._subtract(self.words[slot])
+        else:
+            self.length += 1
+        self.words[slot] = mask.words
+        self._add(mask.words)
+        self.counts[slot] = mask.count
+        x, y, w, h = box
+        self.boxes[slot] = (x, y, x + w, y + h)
+        self.frames[slot] = frames
+        self.next_slot = (slot + 1) % self.size
+
+    def latest_count(self):
+        """
+        Number of set pixels of the last mask, or None if empty.
+        """
+        if self.length == 0:
+            return None
+        return int(self.counts[(self.next_slot - 1) % self.size])
+
+    def _add(self, words):
+        # Ripple carry addition of a 1 bit count to every pixel counter
+        carry = words
+        for plane in self.planes:
+            next_carry = plane & carry
+            plane ^= carry
+            carry = next_carry
+
+    def _subtract(self, words):
+        borrow = words
+        for plane in self.planes:
+            next_borrow = ~plane & borrow
+            plane ^= borrow
+            borrow = next_borrow
+
+    def median_words(self):
+        """
+        Packed words of the median mask, the pixels set in more than half
+        of the masks.
+        """
+        threshold = self.length // 2
+        greater = np.zeros_like(self.planes[0])
+        equal = ~greater
+        # Bitwise comparison of the counters with the threshold, from the
+        # most significant bit
+        for bit in reversed(range(len(self.planes))):
+            plane = self.planes[bit]
+            if (threshold >> bit) & 1:
+                equal &= plane
+            else:
+                greater |= equal & plane
+                equal &= ~plane
+        return greater
+
+    def median_iou(self):
+        """
+        Smallest IoU of the masks in the buffer against the median mask.
+
+        Returns:
+            float: The IoU, 1 if all masks are empty, or None if there are
+            no masks.
+        """
+        if self.length == 0:
+            return None
+        median = self.median_words()
+        median_count = popcount(median)
+        intersections = popcount(self.words[:self.length] & median,
+                                 rows=True)
+        unions = self.counts[:self.length] + median_count - intersections
+        ious = np.where(unions > 0,
+                        intersections / np.maximum(unions, 1), 1.0)
+        return float(ious.min())
+
+    def box_drift(self):
+        """
+        Largest distance, in pixels, of a box corner to the corner of the
+        median box.
+
+        Returns:
+            float: The drift, or None if there are no masks.
+        """
+        if self.length == 0:
+            return None
+        boxes = self.boxes[:self.length]
+        return float(np.abs(boxes - np.median(boxes, axis=0)).max())
@@ -0,0 +1,310 @@
+"""
+MJPEG stream client for the ESP32 OV2640 camera
+
+The ESP32 firmware (index_ov2640_mod.html) serves the camera on port 81
+at /stream, as a multipart/x-mixed-replace response: an endless sequence
+of JPEG parts, each with its own Content-Type and Content-Length headers,
+separated by a boundary. One persistent connection delivers every frame,
+where /capture pays a full HTTP request per frame.
+
+- MultipartReader parses the parts incrementally from the response. When
+  a part declares its Content-Length, the payload is read straight into a
+  new bytearray of that size, without searching it for the boundary or
+  concatenating chunks, and handed out as a memoryview. Each payload has
+  its own buffer, so the state machine may keep it.
+- MjpegStream connects, iterates over the frames, reconnects with an
+  exponential backoff when the connection fails, and measures the
+  intervals between frame arrivals.
+
+Usage:
+    python MjpegStream.py --url http://192.168.4.1:81/stream
+"""
+
+import argparse
+import collections
+import http.client
+import re
+import time
+import urllib.parse
+
+import numpy as np
+
+
+# Frame received from the stream. payload is a memoryview of the JPEG
+# bytes, arrival the perf_counter when it was complete, headers the part
+# headers with lowercase names
+StreamFrame = collections.namedtuple("StreamFrame",
+                                     ["payload", "arrival", "headers"])
+
+
+def parse_boundary(content_type):
+    """
+    Boundary of a multipart Content-Type header.
+
+    Raises:
+        ValueError: The content type has no boundary.
+    """
+    match = re.search(r'boundary="?([^";]+)"?', content_type or "")
+    if match is None:
+        raise ValueError(f"No multipart boundary in {content_type!r}")
+    return match.group(1).strip()
+
+
+class MultipartReader(object):
+    """
+    Incremental parser of a multipart stream.
+
+    Attributes:
+        stream: File-like object with read1 and readinto, as an
+            http.client.HTTPResponse.
+        boundary (bytes): The part delimiter, with its leading "--".
+        chunk_size (int): Bytes read at a time while searching for the
+            delimiter and the headers.
+    """
+
+    def __init__(self, stream, boundary, chunk_size=16384):
+        self.stream = stream
+        if isinstance(boundary, str):
+            boundary = boundary.encode("ascii")
+        if not boundary.startswith(b"--"):
+            boundary = b"--" + boundary
+        self.boundary = boundary
+        self.chunk_size = chunk_size
+        self._buffer = bytearray()
+
+    def _fill(self):
+        data = self.stream.read1(self.chunk_size)
+        if not data:
+            raise EOFError("The stream ended")
+        self._buffer += data
+
+    def _read_until(self, marker, start=0):
+        # Position of marker in the buffer, reading more as needed
+        while True:
+            position = self._buffer.find(marker, start)
+            if position >= 0:
+                return position
+            # The marker may start in the last bytes already searched
+            start = max(0, len(self._buffer) - len(marker) + 1)
+            self._fill()
+
+    def read_part(self):
+        """
+        Read the next part of the stream.
+
+        Returns:
+            tuple: The payload as a memoryview and the headers, a dict
+            with lowercase names.
+
+        Raises:
+            EOFError: The stream ended.
+            http.client.HTTPException: The part declares an invalid
+                Content-Length.
+        """
+        position = self._read_until(self.boundary)
+        headers_start = self._read_until(b"\r\n", position) + 2
+        headers_end = self._read_until(b"\r\n\r\n", headers_start - 2)
+        headers = {}
+        for line in bytes(self._buffer[headers_start:headers_end]).split(
+                b"\r\n"):
+            name, _, value = line.decode("latin-1").partition(":")
+            if name:
+                headers[name.strip().lower()] = value.strip()
+        del self._buffer[:headers_end + 4]
+
+        length = headers.get("content-length")
+        if length is not None:
+            try:
+                length = int(length)
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                raise http.client.HTTPException(
+                    f"Invalid Content-Length of a part: {length!r}")
+            payload = bytearray(length)
+            view = memoryview(payload)
+            # Bytes of the payload already buffered, then the rest read
+            # straight into the payload
+            buffered = min(len(self._buffer), len(payload))
+            view[:buffered] = self._buffer[:buffered]
+            del self._buffer[:buffered]
+            received = buffered
+            while received < len(payload):
+                count = self.stream.readinto(view[received:])
+                if not count:
+                    raise EOFError("The stream ended inside a part")
+                received += count
+        else:
+            # No length declared, the payload ends at the next delimiter
+            end = self._read_until(b"\r\n" + self.boundary)
+            payload = self._buffer[:end]
+            del self._buffer[:end]
+            view = memoryview(payload)
+        return view, headers
+
+
+class ArrivalStats(object):
+    """
+    Intervals between frame arrivals.
+
+    Attributes:
+        frames (int): Frames received.
+        intervals: The last intervals, in seconds.
+    """
+
+    def __init__(self, window=1000):
+        self.frames = 0
+        self.intervals = collections.deque(maxlen=window)
+        self._last_arrival = None
+
+    def add(self, arrival):
+        if self._last_arrival is not None:
+            self.intervals.append(arrival - self._last_arrival)
+        self._last_arrival = arrival
+        self.frames += 1
+
+    def restart(self):
+        """
+        Forget the last arrival, so a reconnection gap is not counted.
+        """
+        self._last_arrival = None
+
+    def summary(self):
+        """
+        Statistics of the intervals in the window.
+
+        Returns:
+            dict: Frames per second, mean interval, jitter (standard
+            deviation of the intervals) and largest interval, in ms.
+        """
+        if not self.intervals:
+            return {"fps": 0.0, "interval_ms": 0.0, "jitter_ms": 0.0,
+                    "max_gap_ms": 0.0}
+        intervals_ms = 1000 * np.asarray(self.intervals)
+        mean = float(intervals_ms.mean())
+        return {"fps": 1000 / mean if mean > 0 else 0.0,
+                "interval_ms": mean,
+                "jitter_ms": float(intervals_ms.std()),
+                "max_gap_ms": float(intervals_ms.max())}
+
+
+class MjpegStream(object):
+    """
+    Frames of an MJPEG stream, over a persistent connection.
+
+    Iterating yields StreamFrame tuples. Failed connections are retried
+    with a delay that doubles up to max_reconnect_delay, and back to
+    reconnect_delay after a frame is received.
+
+    Attributes:
+        url (str): URL of the stream.
+        timeout (float): Socket timeout in seconds.
+        reconnect_delay (float): First delay before reconnecting.
+        max_reconnect_delay (float): Largest delay before reconnecting.
+        max_reconnects (int): Consecutive failures before giving up, None
+            to retry forever.
+        reconnects (int): Number of reconnections.
+        arrivals: ArrivalStats of the received frames.
+    """
+
+    def __init__(self, url, timeout=5.0, reconnect_delay=0.5,
+                 max_reconnect_delay=8.0, max_reconnects=None):
+        self.url = url
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.max_reconnects = max_reconnects
+        self.reconnects = 0
+        self.arrivals = ArrivalStats()
+        self._connection = None
+
+    def connect(self):
+        """
+        Open the stream.
+
+        Returns:
+            The MultipartReader of the response.
+
+        Raises:
+            ConnectionError: The server did not answer a multipart stream.
+        """
+        url = urllib.parse.urlsplit(self.url)
+        self._connection = http.client.HTTPConnection(
+            url.hostname, url.port or 80, timeout=self.timeout)
+        path = url.path or "/"
+        if url.query:
+            path += "?" + url.query
+        self._connection.request("GET", path)
+        response = self._connection.getresponse()
+        if response.status != 200:
+            raise ConnectionError(f"Stream answered {response.status} "
+                                  f"{response.reason}")
+        try:
+            boundary = parse_boundary(response.getheader("Content-Type"))
+        except ValueError as e:
+            raise ConnectionError(str(e))
+        return MultipartReader(response, boundary)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __iter__(self):
+        failures = 0
+        delay = self.reconnect_delay
+        while True:
+            try:
+                reader = self.connect()
+                while True:
+                    payload, headers = reader.read_part()
+                    arrival = time.perf_counter()
+                    self.arrivals.add(arrival)
+                    failures = 0
+                    delay = self.reconnect_delay
+                    yield StreamFrame(payload, arrival, headers)
+            except (OSError, EOFError, http.client.HTTPException) as e:
+                self.close()
+                failures += 1
+                if (self.max_reconnects is not None and
+                        failures > self.max_reconnects):
+                    raise ConnectionError(
+                        f"Stream failed {failures} times: {e}")
+                print(f"Stream interrompido ({e}), reconectando em "
+                      f"{delay:.1f} s")
+                time.sleep(delay)
+                delay = min(2 * delay, self.max_reconnect_delay)
+                self.reconnects += 1
+                self.arrivals.restart()
+            finally:
+                self.close()
+
+
+if __name__ == "__main__":
+    from statemachineV2 import SurgicalInstrumentTrackDetect
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://192.168.4.1:81/stream",
+                        help="URL of the ESP32 /stream endpoint")
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Stop after this number of frames")
+    parser.add_argument("--report", type=int, default=100,
+                        help="Report the arrival jitter every N frames")
+    args = parser.parse_args()
+
+    stream = MjpegStream(args.url)
+    supervisor = SurgicalInstrumentTrackDetect()
+    for frame in stream:
+        output = supervisor.object_tracking(frame.payload)
+        if output is None or supervisor.terminate_flag:
+            break
+        count = stream.arrivals.frames
+        if count % args.report == 0:
+            summary = stream.arrivals.summary()
+            print(f"{count} frames, {summary['fps']:.1f} fps, interval "
+                  f"{summary['interval_ms']:.1f} ms, jitter "
+                  f"{summary['jitter_ms']:.1f} ms, max gap "
+                  f"{summary['max_gap_ms']:.1f} ms, "
+                  f"{stream.reconnects} reconnects")
+        if args.frames is not None and count >= args.frames:
+            break
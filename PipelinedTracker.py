@@ -0,0 +1,230 @@
+"""
+Pipelined execution of the object tracking state machine
+
+object_tracking decodes, analyses and runs the state machine on the
+caller's thread. When the analysis takes longer than the interval between
+frames, the frames queue up and the latency keeps growing.
+
+PipelinedTracker splits the work in two threads:
+
+- The decode thread decodes the submitted JPEG pictures.
+- The analysis thread runs the state machine on the decoded frames.
+
+Between the caller and each thread there is a single slot holding the
+latest item. A new item replaces the one not yet taken, so stale frames
+are dropped and the state machine always works on the newest frame.
+OpenCV releases the GIL in imdecode, the filters and the background
+subtractors, so decoding and analysis overlap.
+
+The results are read without blocking with poll, or received by a
+callback, called from the analysis thread.
+
+"""
+
+import collections
+import threading
+import time
+
+from statemachineV2 import SurgicalInstrumentTrackDetect
+
+
+# Result of a processed frame. frame_id is the number of the submitted
+# picture, starting at 0. latency is the time in seconds from submit to
+# the end of the state machine step
+TrackingResult = collections.namedtuple(
+    "TrackingResult", ["frame_id", "flag", "image", "state", "latency"])
+
+
+class LatestSlot(object):
+    """
+    Single-slot queue where a new item replaces the one not yet taken.
+
+    Attributes:
+        dropped (int): Number of items replaced before being taken.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self._has_item = False
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._condition:
+            if self._has_item:
+                self.dropped += 1
+            self._item = item
+            self._has_item = True
+            self._condition.notify()
+
+    def get(self):
+        """
+        Wait for an item and take it.
+
+        Returns:
+            The item, or None if the slot was closed.
+        """
+        with self._condition:
+            while not self._has_item and not self._closed:
+                self._condition.wait()
+            if not self._has_item:
+                return None
+            item = self._item
+            self._item = None
+            self._has_item = False
+            return item
+
+    def close(self):
+        """
+        Wake up the waiting consumer. Items still in the slot are taken
+        before get returns None.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class PipelinedTracker(object):
+    """
+    Object tracking state machine fed through decode and analysis threads.
+
+    The frame strides and the motion gate of the state machine act inside
+    object_tracking only. Here, frames dropped by the slots are counted as
+    skipped frames of the state machine instead.
+
+    Attributes:
+        supervisor: The SurgicalInstrumentTrackDetect state machine.
+        callback: Function called with each TrackingResult, or None.
+        submitted (int): Number of submitted pictures.
+        processed (int): Number of frames processed by the state machine.
+    """
+
+    def __init__(self, supervisor=None, callback=None, **fsm_options):
+        """
+        Start the decode and analysis threads.
+
+        Args:
+            supervisor: The state machine to run. If None, one is created
+                with fsm_options.
+            callback: Function called from the analysis thread with the
+                TrackingResult of each processed frame.
+            **fsm_options: Keyword arguments for SurgicalInstrumentTrackDetect.
+        """
+        if supervisor is None:
+            supervisor = SurgicalInstrumentTrackDetect(**fsm_options)
+        self.supervisor = supervisor
+        self.callback = callback
+
+        self.submitted = 0
+        self.processed = 0
+
+        self._pictures = LatestSlot()  # submitted, waiting for decoding
+        self._frames = LatestSlot()  # decoded, waiting for analysis
+        self._lock = threading.Lock()
+        self._latest = None  # last result not yet polled
+        self._captures = collections.deque()  # captures not yet polled
+        self._last_frame_id = -1
+
+        self._decode_thread = threading.Thread(
+            target=self._decode_loop, name="tracker-decode", daemon=True)
+        self._analysis_thread = threading.Thread(
+            target=self._analysis_loop, name="tracker-analysis", daemon=True)
+        self._decode_thread.start()
+        self._analysis_thread.start()
+
+    @property
+    def dropped(self):
+        """
+        Number of frames dropped, before decoding or before analysis.
+        """
+        return self._pictures.dropped + self._frames.dropped
+
+    def submit(self, picture):
+        """
+        Submit a JPEG picture for tracking. Never blocks.
+
+        Returns:
+            int: The frame_id of the picture.
+        """
+        frame_id = self.submitted
+        self.submitted += 1
+        self._pictures.put((frame_id, time.perf_counter(), picture))
+        return frame_id
+
+    def poll(self):
+        """
+        Take the newest result, without blocking.
+
+        Captured images are never overwritten: while there are captures
+        not yet polled, they are returned first, in order.
+
+        Returns:
+            The TrackingResult, or None if there is no new result.
+        """
+        with self._lock:
+            if self._captures:
+                result = self._captures.popleft()
+                if self._latest is result:
+                    self._latest = None
+                return result
+            result = self._latest
+            self._latest = None
+            return result
+
+    def close(self, timeout=None):
+        """
+        Stop the threads, after the frames already submitted and not
+        dropped are processed.
+        """
+        self._pictures.close()
+        self._decode_thread.join(timeout)
+        self._analysis_thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _decode_loop(self):
+        while True:
+            item = self._pictures.get()
+            if item is None:
+                break
+            frame_id, submit_time, picture = item
+            frame = self.supervisor.decode_picture(picture)
+            self._frames.put((frame_id, submit_time, picture, frame))
+        self._frames.close()
+
+    def _analysis_loop(self):
+        while True:
+            item = self._frames.get()
+            if item is None:
+                break
+            frame_id, submit_time, picture, frame = item
+            frames = frame_id - self._last_frame_id
+            self._last_frame_id = frame_id
+            try:
+                output = self.supervisor.process_frame(frame, picture, frames)
+            except Exception as e:
+                print(f"Erro no processamento do frame {frame_id}:\n{e}")
+                continue
+            if output is None:
+                # The state machine terminated
+                continue
+            flag, image = output
+            result = TrackingResult(frame_id, flag, image,
+                                    self.supervisor.state,
+                                    time.perf_counter() - submit_time)
+            self.processed += 1
+            with self._lock:
+                if flag:
+                    self._captures.append(result)
+                self._latest = result
+            if self.callback is not None:
+                try:
+                    self.callback(result)
+                except Exception as e:
+                    # The analysis thread must go on with the next frames
+                    print(f"Erro no callback do frame {frame_id}:\n{e}")
@@ -0,0 +1,446 @@
+"""
+Shared memory ring buffer of frames between processes
+
+With capture and analysis in separate processes, sending each 4K frame
+through a pipe pickles and copies 25 MB twice, which costs more than the
+analysis itself. SharedFrameRing keeps a fixed number of frame slots in a
+multiprocessing.shared_memory block. The producer writes the frames into
+the slots, and the consumers read them in place, as NumPy views that can
+be passed straight to object_tracking.
+
+There are no locks. Each slot has a sequence number, used as a seqlock:
+
+- The producer of frame n sets the sequence of its slot to 2n - 1, odd
+  while it writes, then to 2n when the frame is complete, and then
+  publishes n as the head of the ring.
+- A consumer takes frame n only if the sequence of its slot is 2n. After
+  using the view, the sequence tells if the slot was overwritten
+  meanwhile: is_current(n). With several slots, the producer has to lap
+  the whole ring for that to happen.
+
+Everything computed from a view, including the copies made of it, is
+valid only if is_current is still True after its use. Otherwise the view
+mixed two frames, and the results must be discarded. The state machine
+can't discard a step: a torn frame would already have updated the
+background model, and maybe captured an image. RingReader.track copies
+the frame out of the ring and checks it before object_tracking sees it.
+
+There is a single producer per ring. Python has no memory fences, so
+the protocol relies on the stores of the producer being seen in order,
+as on x86. On weakly ordered CPUs a consumer may see a new sequence
+before all the pixels, and is_current after use is the safeguard.
+
+Usage:
+    python SharedFrameRing.py --video "video/videosMock/Objeto3segs.mp4"
+"""
+
+import argparse
+import collections
+import multiprocessing
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# Frame read from the ring. number counts the frames written, from 1,
+# pixels is a read-only view into the slot and timestamp the time.time
+# of the write
+SharedFrame = collections.namedtuple("SharedFrame",
+                                     ["number", "pixels", "timestamp"])
+
+ring_magic = 0x52494e47  # "RING"
+
+# Header words: magic, slots, height, width, channels, head
+header_words = 8
+
+# The frames start at a cache line boundary
+slot_alignment = 64
+
+
+def attach_shared_memory(name):
+    """
+    Attach to an existing shared memory block, leaving its lifetime to
+    the process that created it.
+
+    Before Python 3.13 attaching also registers the block with the
+    resource tracker, which unlinks it when its processes exit. The
+    processes attaching must then be started with multiprocessing by the
+    creator of the ring, so that they share its resource tracker.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+class SharedFrameRing(object):
+    """
+    Ring of frame slots in shared memory, with a seqlock per slot.
+
+    Attributes:
+        name (str): Name of the shared memory block, to attach from other
+            processes.
+        slots (int): Number of frame slots.
+        shape (tuple): Shape of the frames, (height, width, channels).
+        frames: Array of the slots, shape (slots,) + shape.
+        sequences: Sequence number of each slot.
+        timestamps: Write time of each slot.
+    """
+
+    def __init__(self, name=None, shape=None, slots=8):
+        """
+        Create a ring, or attach to an existing one.
+
+        Args:
+            name (str): Name of the ring to attach to. None creates a new
+                ring, with shape and slots.
+            shape (tuple): Shape of the frames of a new ring, (height,
+                width) or (height, width, channels), uint8.
+            slots (int): Number of slots of a new ring.
+
+        Raises:
+            ValueError: Invalid shape or slots, or name is not a ring.
+        """
+        self.owner = name is None
+        if self.owner:
+            if shape is None or len(shape) not in (2, 3):
+                raise ValueError("A new ring needs the frame shape, "
+                                 "(height, width) or (height, width, "
+                                 "channels)")
+            if slots < 2:
+                raise ValueError("The ring needs at least 2 slots")
+            shape = tuple(int(value) for value in shape)
+            if len(shape) == 2:
+                shape += (1,)
+            self.block = shared_memory.SharedMemory(
+                create=True, size=self._layout(slots, shape)[-1])
+        else:
+            self.block = attach_shared_memory(name)
+            header = np.ndarray(header_words, dtype=np.uint64,
+                                buffer=self.block.buf)
+            if int(header[0]) != ring_magic:
+                self.block.close()
+                raise ValueError(f"{name} is not a frame ring")
+            slots = int(header[1])
+            shape = tuple(int(value) for value in header[2:5])
+        self.name = self.block.name
+        self.slots = slots
+        self.shape = shape
+
+        sequences_at, timestamps_at, frames_at, _ = self._layout(slots,
+                                                                  shape)
+        buffer = self.block.buf
+        self._header = np.ndarray(header_words, dtype=np.uint64,
+                                  buffer=buffer)
+        self.sequences = np.ndarray(slots, dtype=np.uint64, buffer=buffer,
+                                    offset=sequences_at)
+        self.timestamps = np.ndarray(slots, dtype=np.float64, buffer=buffer,
+                                     offset=timestamps_at)
+        self.frames = np.ndarray((slots,) + shape, dtype=np.uint8,
+                                 buffer=buffer, offset=frames_at)
+        if self.owner:
+            self._header[:] = 0
+            self.sequences[:] = 0
+            self._header[1] = slots
+            self._header[2:5] = shape
+            self._header[0] = ring_magic
+
+    @staticmethod
+    def _layout(slots, shape):
+        # Offsets of the sequences, timestamps and frames, and total size
+        sequences_at = 8 * header_words
+        timestamps_at = sequences_at + 8 * slots
+        frames_at = -(-(timestamps_at + 8 * slots) // slot_alignment) * \
+            slot_alignment
+        return (sequences_at, timestamps_at, frames_at,
+                frames_at + slots * int(np.prod(shape)))
+
+    @property
+    def head(self):
+        """
+        Number of the last complete frame, 0 if none was written.
+        """
+        return int(self._header[5])
+
+    def _pixels(self, view):
+        # Frames of a single channel are handed out as 2D images
+        return view[:, :, 0] if self.shape[2] == 1 else view
+
+    def begin_write(self):
+        """
+        Start writing the next frame, in place.
+
+        Returns:
+            tuple: The number of the frame and the writable view of its
+            slot, to fill and then commit, for example with
+            cv2.VideoCapture.read(image=view).
+        """
+        number = self.head + 1
+        slot = number % self.slots
+        self.sequences[slot] = 2 * number - 1
+        return number, self._pixels(self.frames[slot])
+
+    def commit(self, number):
+        """
+        Publish the frame started by begin_write.
+        """
+        slot = number % self.slots
+        self.timestamps[slot] = time.time()
+        self.sequences[slot] = 2 * number
+        self._header[5] = number
+
+    def write(self, frame):
+        """
+        Copy a frame into the next slot and publish it.
+
+        Returns:
+            int: The number of the frame.
+
+        Raises:
+            ValueError: The frame does not have the shape of the ring.
+        """
+        frame = np.asarray(frame, dtype=np.uint8)
+        if frame.ndim == 2:
+            frame = frame[:, :, None]
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame of shape {frame.shape} in a ring of "
+                             f"{self.shape}")
+        number, _ = self.begin_write()
+        self.frames[number % self.slots][...] = frame
+        self.commit(number)
+        return number
+
+    def read(self, number):
+        """
+        Frame number, if it is still in the ring.
+
+        Returns:
+            The SharedFrame, with a read-only view of the slot, or None if
+            the frame is being written or was overwritten.
+        """
+        if number < 1:
+            return None
+        slot = number % self.slots
+        if int(self.sequences[slot]) != 2 * number:
+            return None
+        timestamp = float(self.timestamps[slot])
+        view = self._pixels(self.frames[slot])
+        view.flags.writeable = False
+        return SharedFrame(number, view, timestamp)
+
+    def latest(self):
+        """
+        The last complete frame, or None if there is none yet.
+        """
+        while True:
+            number = self.head
+            if number == 0:
+                return None
+            frame = self.read(number)
+            if frame is not None:
+                return frame
+            # Overwritten between reading the head and the slot
+
+    def is_current(self, number):
+        """
+        Whether the slot of frame number still holds it. Checked after
+        using a view, to know that it was not overwritten meanwhile.
+        """
+        return int(self.sequences[number % self.slots]) == 2 * number
+
+    def close(self):
+        """
+        Detach from the ring. The views of its frames become invalid.
+        """
+        self._header = self.sequences = self.timestamps = None
+        self.frames = None
+        self.block.close()
+
+    def unlink(self):
+        """
+        Remove the ring, by its creator, once every process closed it.
+        """
+        self.block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        if self.owner:
+            self.unlink()
+
+
+class RingReader(object):
+    """
+    Consumer of a ring, taking the frames in order.
+
+    When the consumer falls behind by more than the ring, it skips to the
+    latest frame, and the frames lost are counted.
+
+    Attributes:
+        ring: The SharedFrameRing.
+        last_number (int): Number of the last frame taken.
+        dropped (int): Frames overwritten before being taken.
+        torn (int): Frames overwritten while in use, see done.
+    """
+
+    def __init__(self, ring, poll_interval=0.0005):
+        self.ring = ring
+        self.poll_interval = poll_interval
+        self.last_number = ring.head
+        self.dropped = 0
+        self.torn = 0
+        self._buffer = None
+
+    def next(self, timeout=None, latest=False):
+        """
+        Wait for the next frame.
+
+        Args:
+            timeout (float): Seconds to wait, None to wait forever.
+            latest (bool): Take the latest frame, skipping the frames not
+                taken yet, as dropped.
+
+        Returns:
+            The SharedFrame, or None on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            head = self.ring.head
+            if head > self.last_number:
+                number = head if latest else self.last_number + 1
+                if head - number >= self.ring.slots - 1:
+                    # Fell behind, the producer is overwriting this slot
+                    number = head
+                frame = self.ring.read(number)
+                if frame is not None:
+                    self.dropped += number - self.last_number - 1
+                    self.last_number = number
+                    return frame
+                continue
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def done(self, frame):
+        """
+        Check that the frame was not overwritten while in use. Called after
+        the last use of the view.
+
+        Returns:
+            bool: True if the results computed from the view are valid.
+            If False, they must be discarded, as well as any copy of the
+            view, which may mix two frames. Consumers that keep state,
+            as the state machine, must work on a checked copy instead,
+            see copy.
+        """
+        if self.ring.is_current(frame.number):
+            return True
+        self.torn += 1
+        return False
+
+    def copy(self, frame):
+        """
+        Copy the pixels of a frame out of the ring, checking that the frame
+        was not overwritten during the copy.
+
+        The copy goes to a buffer of the reader, reused by the next call.
+
+        Returns:
+            The copied pixels, or None if the frame was torn.
+        """
+        if self._buffer is None or self._buffer.shape != frame.pixels.shape:
+            self._buffer = np.empty_like(frame.pixels)
+        np.copyto(self._buffer, frame.pixels)
+        if not self.done(frame):
+            return None
+        return self._buffer
+
+    def track(self, supervisor, frame):
+        """
+        Run object_tracking on a copy of the frame, if it was not torn.
+
+        The frame is checked before the state machine sees it, as a step
+        of the state machine can't be undone. The copy costs little next
+        to the analysis, and the captured images are copies of their own.
+
+        Args:
+            supervisor: The SurgicalInstrumentTrackDetect.
+            frame: The SharedFrame, from next.
+
+        Returns:
+            The output of object_tracking, or None if the frame was torn
+            and skipped, as when the state machine is terminated.
+        """
+        pixels = self.copy(frame)
+        if pixels is None:
+            return None
+        return supervisor.object_tracking(pixels)
+
+
+def capture_process(ring_name, video, frames, fps):
+    """
+    Producer process: decode a video straight into the ring slots.
+    """
+    import cv2
+
+    ring = SharedFrameRing(ring_name)
+    camera = cv2.VideoCapture(video)
+    start = time.perf_counter()
+    for index in range(frames):
+        number, view = ring.begin_write()
+        ret, _ = camera.read(image=view)
+        if not ret:
+            break
+        ring.commit(number)
+        delay = start + (index + 1) / fps - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    camera.release()
+    ring.close()
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+
+    import cv2
+
+    from statemachineV2 import SurgicalInstrumentTrackDetect
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--video", required=True,
+                        help="Video decoded by the capture process")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--slots", type=int, default=8)
+    args = parser.parse_args()
+
+    camera = cv2.VideoCapture(args.video)
+    shape = (int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+             int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+    camera.release()
+
+    with SharedFrameRing(shape=shape, slots=args.slots) as ring:
+        producer = multiprocessing.Process(
+            target=capture_process,
+            args=(ring.name, args.video, args.frames, args.fps))
+        producer.start()
+        reader = RingReader(ring)
+        supervisor = SurgicalInstrumentTrackDetect()
+        processed = captures = 0
+        while True:
+            frame = reader.next(timeout=1.0, latest=True)
+            if frame is None:
+                break
+            with contextlib.redirect_stdout(io.StringIO()):
+                output = reader.track(supervisor, frame)
+            flag, image = output if output is not None else (False, None)
+            processed += 1
+            captures += bool(flag)
+        producer.join()
+        print(f"{processed} frames processed, {reader.dropped} dropped, "
+              f"{reader.torn} torn, {captures} captures, state "
+              f"{supervisor.state}")
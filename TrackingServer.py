@@ -0,0 +1,229 @@
+"""
+Local HTTP ingestion service for the object tracking state machine
+
+Each workstation POSTs its JPEG frames to the service, which runs the
+station's SurgicalInstrumentTrackDetect and answers with the result of
+object_tracking. The connections are HTTP/1.1 keep-alive, so a station
+sends all its frames over one connection without a handshake per frame.
+
+Endpoints:
+
+- POST /stations/<station_id>/frames, with the JPEG picture as body.
+  Answers a JSON object with the station, the flag, the state after the
+  frame and the captured image as a base64 JPEG, or null. A body that
+  is not a valid image is answered with 400 and never reaches the state
+  machine, which would stop as on a camera failure.
+- GET /stations: JSON object with the frames, captures, mean analysis
+  time in ms and state of each station.
+
+The server runs a thread per connection. The frames of a station are
+serialized by a lock of the station, so it can also send from several
+connections.
+
+Usage:
+    python TrackingServer.py --port 8000
+"""
+
+import argparse
+import base64
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+from statemachineV2 import SurgicalInstrumentTrackDetect
+
+
+class Station(object):
+    """
+    State machine of a workstation and its counters.
+
+    Attributes:
+        supervisor: The SurgicalInstrumentTrackDetect of the station.
+        lock: Serializes the frames of the station.
+        frames (int): Frames processed.
+        captures (int): Captured images.
+        analysis_time (float): Total time in object_tracking, seconds.
+    """
+
+    def __init__(self, fsm_options):
+        self.supervisor = SurgicalInstrumentTrackDetect(**fsm_options)
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.captures = 0
+        self.analysis_time = 0.0
+
+    def prepare(self, picture):
+        """
+        Decode and preprocess the picture, without touching the state
+        machine.
+
+        Returns:
+            The bgsub.FrameAnalysis of the picture, or None if it is not
+            a valid image.
+        """
+        return self.supervisor.prepare_frame(picture)
+
+    def track(self, picture, analysis=None):
+        """
+        Run object_tracking on the picture.
+
+        Args:
+            picture: The JPEG picture.
+            analysis: Its bgsub.FrameAnalysis from prepare, so that it is
+                not decoded again.
+
+        Returns:
+            tuple: flag, captured image or None, and state.
+        """
+        with self.lock:
+            start = time.perf_counter()
+            output = self.supervisor.object_tracking(picture,
+                                                     analysis=analysis)
+            self.analysis_time += time.perf_counter() - start
+            # None when the state machine was terminated
+            flag, image = output if output is not None else (False, None)
+            self.frames += 1
+            self.captures += bool(flag)
+            return flag, image, self.supervisor.state
+
+    def summary(self):
+        return {"frames": self.frames,
+                "captures": self.captures,
+                "analysis_ms": 1000 * self.analysis_time / max(self.frames, 1),
+                "state": self.supervisor.state}
+
+
+class TrackingRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the station requests, over keep-alive connections.
+    """
+
+    protocol_version = "HTTP/1.1"
+    frames_path = re.compile(r"^/stations/([\w.-]+)/frames/?$")
+
+    def do_POST(self):
+        match = self.frames_path.match(self.path)
+        if match is None:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.send_json(411, {"error": "Content-Length required"})
+            return
+        try:
+            length = int(length)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            # The end of the body is unknown, the connection can't be reused
+            self.close_connection = True
+            self.send_json(400, {"error": "Invalid Content-Length"})
+            return
+        picture = self.rfile.read(length)
+        if not picture:
+            self.send_json(400, {"error": "Empty picture"})
+            return
+
+        station_id = match.group(1)
+        station = self.server.station(station_id)
+        # An undecodable picture would take the state machine to stop, as
+        # a camera failure. It is refused before reaching it
+        analysis = station.prepare(picture)
+        if analysis is None:
+            self.send_json(400, {"error": "The body is not a valid image"})
+            return
+        try:
+            flag, image, state = station.track(picture, analysis)
+        except Exception as e:
+            print(f"Erro na estação {station_id}:\n{e}")
+            self.send_json(500, {"error": f"Tracking failed: {e}"})
+            return
+        encoded = None
+        if image is not None:
+            ret, buffer = cv2.imencode(".jpg", image)
+            if ret:
+                encoded = base64.b64encode(buffer).decode("ascii")
+        self.send_json(200, {"station": station_id, "flag": bool(flag),
+                             "state": state, "image": encoded})
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/stations":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        self.send_json(200, self.server.summary())
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class TrackingServer(ThreadingHTTPServer):
+    """
+    HTTP server holding a state machine per station.
+
+    Attributes:
+        fsm_options (dict): Keyword arguments for the state machines.
+        stations (dict): Station of each station ID, created by the first
+            frame of the station.
+        verbose (bool): Log every request.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, verbose=False, **fsm_options):
+        super().__init__(address, TrackingRequestHandler)
+        self.fsm_options = fsm_options
+        self.stations = {}
+        self.verbose = verbose
+        self._stations_lock = threading.Lock()
+
+    def station(self, station_id):
+        with self._stations_lock:
+            station = self.stations.get(station_id)
+            if station is None:
+                station = Station(self.fsm_options)
+                self.stations[station_id] = station
+            return station
+
+    def summary(self):
+        with self._stations_lock:
+            stations = dict(self.stations)
+        return {station_id: station.summary()
+                for station_id, station in stations.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--verbose", action="store_true",
+                        help="Log the requests and the state machines")
+    args = parser.parse_args()
+
+    server = TrackingServer((args.host, args.port), verbose=args.verbose)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    if not args.verbose:
+        # The state machines print every transition
+        sys.stdout = open(os.devnull, "w")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,105 @@
+"""
+Benchmark of the asyncio entry point with many stations on one loop.
+
+Runs several stations as coroutines on one event loop, each replaying a
+mock video, together with a heartbeat coroutine that wakes up every few
+milliseconds. Compares calling object_tracking directly from the
+coroutines, which blocks the loop, with AsyncTracker. Reports the total
+time, the heartbeat lag, how late the loop answered, and the captures of
+each station, which must be the same in both modes.
+
+Usage:
+    python benchmark_async.py --stations 4
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+import numpy as np
+
+import benchmark_utils as bench
+from AsyncTracker import AsyncTracker
+from statemachineV2 import SurgicalInstrumentTrackDetect
+
+
+async def heartbeat(lags, interval, stop):
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - expected)
+
+
+async def blocking_station(pictures):
+    supervisor = SurgicalInstrumentTrackDetect()
+    captures = 0
+    for picture in pictures:
+        flag, _ = supervisor.object_tracking(picture)
+        captures += bool(flag)
+        await asyncio.sleep(0)
+    return captures
+
+
+async def async_station(pictures):
+    tracker = AsyncTracker()
+    captures = 0
+    for picture in pictures:
+        flag, _ = await tracker.object_tracking(picture)
+        captures += bool(flag)
+    return captures
+
+
+async def run(station, streams, interval):
+    """
+    Run every stream with the station coroutine and the heartbeat.
+
+    Returns:
+        tuple: Elapsed seconds, heartbeat lags and captures per station.
+    """
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, interval, stop))
+    start = time.perf_counter()
+    captures = await asyncio.gather(*(station(pictures)
+                                      for pictures in streams))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+    return elapsed, lags, captures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Maximum number of frames per video")
+    parser.add_argument("--stations", type=int, default=4,
+                        help="Number of stations on the loop")
+    parser.add_argument("--interval", type=float, default=0.005,
+                        help="Heartbeat interval in seconds")
+    args = parser.parse_args()
+
+    videos = bench.list_mock_videos()
+    if not videos:
+        print(f"No videos found at {bench.MOCK_FOLDER}")
+        raise SystemExit(1)
+
+    clips = [bench.encode_jpeg(bench.read_frames(video, args.frames))
+             for video in videos]
+    streams = [clips[index % len(clips)] for index in range(args.stations)]
+    print(f"{args.stations} stations, "
+          f"{sum(len(pictures) for pictures in streams)} frames")
+
+    print(f"\n{'mode':>9} {'seconds':>8} {'lag p50':>8} {'lag p99':>8} "
+          f"{'lag max':>8}  captures")
+    for name, station in (("blocking", blocking_station),
+                          ("async", async_station)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, lags, captures = asyncio.run(
+                run(station, streams, args.interval))
+        lags_ms = 1000 * np.asarray(lags or [0.0])
+        print(f"{name:>9} {elapsed:8.2f} "
+              f"{np.percentile(lags_ms, 50):8.1f} "
+              f"{np.percentile(lags_ms, 99):8.1f} {lags_ms.max():8.1f}  "
+              f"{captures}")
@@ -0,0 +1,102 @@
+"""
+Benchmark of the background subtractor engines.
+
+For each engine of BackgroundModels, reports the throughput of apply on
+the preprocessed frames of the mock videos, the memory taken by the
+model, and the state machine behaviour. The accuracy is the per frame
+state agreement with the original MOG2 engine.
+
+Usage:
+    python benchmark_bg_engines.py --frames 300
+"""
+
+import argparse
+import concurrent.futures
+import os
+import time
+
+import BackgroundModels as bgmodels
+import BackgroundSubtractionV2 as bgsub
+import benchmark_utils as bench
+
+
+def process_memory():
+    """
+    Resident memory of this process in bytes, or None if unknown.
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        # Linux fallback, without psutil
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def benchmark_engine(engine, preprocessed, learning_rate=0.0001):
+    """
+    Feed the preprocessed frames to a new engine.
+
+    Run it in a fresh process, so that the memory growth is not hidden by
+    memory freed by previous engines.
+
+    Returns:
+        tuple: The frames per second of apply and the memory growth, in
+        MiB, after creating the model and processing the frames.
+    """
+    memory_before = process_memory()
+    subtractor = bgmodels.create_subtractor(engine)
+    start = time.perf_counter()
+    for image in preprocessed:
+        subtractor.apply(image, learningRate=learning_rate)
+    elapsed = time.perf_counter() - start
+    memory_after = process_memory()
+    if memory_before is None or memory_after is None:
+        memory_mib = float("nan")
+    else:
+        memory_mib = (memory_after - memory_before) / 2 ** 20
+    return len(preprocessed) / elapsed, memory_mib
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Maximum number of frames per video")
+    parser.add_argument("--engines", nargs="+",
+                        default=list(bgmodels.background_engines),
+                        help="Background engines to compare")
+    args = parser.parse_args()
+
+    videos = bench.list_mock_videos()
+    if not videos:
+        print(f"No videos found at {bench.MOCK_FOLDER}")
+
+    for video in videos:
+        frames = bench.read_frames(video, args.frames)
+        preprocessed = [bgsub.preprocess_image(frame) for frame in frames]
+        pictures = bench.encode_jpeg(frames)
+        print(f"\n{os.path.basename(video)} - {len(frames)} frames, "
+              f"analysis at {preprocessed[0].shape[1]}x"
+              f"{preprocessed[0].shape[0]}")
+        print(f"{'engine':>16} {'apply fps':>10} {'RSS+ MiB':>10} "
+              f"{'FSM ms':>8} {'transitions':>12} {'captures':>9} "
+              f"{'agreement':>10}")
+
+        reference_states = None
+        for engine in ["mog2"] + [name for name in args.engines
+                                  if name != "mog2"]:
+            with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                fps, memory_mib = executor.submit(
+                    benchmark_engine, engine, preprocessed).result()
+            states, captures, fsm_ms = bench.run_state_machine(
+                pictures, bg_engine=engine)
+            if reference_states is None:
+                reference_states = states
+            agreement = bench.state_agreement(states, reference_states)
+            print(f"{engine:>16} {fps:10.1f} {memory_mib:10.1f} "
+                  f"{fsm_ms:8.2f} {bench.count_transitions(states):12d} "
+                  f"{captures:9d} {agreement:10.1%}")
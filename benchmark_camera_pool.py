@@ -0,0 +1,87 @@
+"""
+Benchmark of the multi-camera process pool.
+
+Emulates several cameras, each replaying a mock video, and submits all
+their frames at once to a CameraPool with 1 to N worker processes.
+Reports the aggregate throughput in frames per second, the speedup over
+one worker, and per camera the throughput, the captures and the final
+state, which must not depend on the number of workers.
+
+Usage:
+    python benchmark_camera_pool.py --cameras 8 --workers 1 2 4
+"""
+
+import argparse
+import os
+import time
+
+import benchmark_utils as bench
+from CameraPool import CameraPool
+
+
+def run_pool(streams, workers):
+    """
+    Submit the frames of every camera, interleaved, and wait for them.
+
+    Args:
+        streams (dict): JPEG pictures of each camera ID.
+        workers (int): Number of worker processes.
+
+    Returns:
+        tuple: Elapsed seconds and the per-camera report of the pool.
+    """
+    with CameraPool(workers=workers) as pool:
+        # Let the workers import OpenCV before timing
+        time.sleep(1)
+        start = time.perf_counter()
+        longest = max(len(pictures) for pictures in streams.values())
+        for index in range(longest):
+            for camera_id, pictures in streams.items():
+                if index < len(pictures):
+                    pool.submit(camera_id, pictures[index])
+        pool.wait()
+        elapsed = time.perf_counter() - start
+        report = pool.report()
+    return elapsed, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Maximum number of frames per video")
+    parser.add_argument("--cameras", type=int, default=8,
+                        help="Number of emulated cameras")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=[1, 2, 4],
+                        help="Numbers of worker processes to compare")
+    args = parser.parse_args()
+
+    videos = bench.list_mock_videos()
+    if not videos:
+        print(f"No videos found at {bench.MOCK_FOLDER}")
+        raise SystemExit(1)
+
+    clips = [bench.encode_jpeg(bench.read_frames(video, args.frames))
+             for video in videos]
+    streams = {f"cam{index:02d}": clips[index % len(clips)]
+               for index in range(args.cameras)}
+    total = sum(len(pictures) for pictures in streams.values())
+    print(f"{args.cameras} cameras, {total} frames, {os.cpu_count()} CPUs")
+
+    print(f"\n{'workers':>8} {'seconds':>8} {'fps':>8} {'speedup':>8}")
+    reports = {}
+    baseline = None
+    for workers in args.workers:
+        elapsed, reports[workers] = run_pool(streams, workers)
+        baseline = baseline or elapsed
+        print(f"{workers:8d} {elapsed:8.2f} {total / elapsed:8.1f} "
+              f"{baseline / elapsed:8.2f}")
+
+    print(f"\n{'camera':>8} {'workers':>8} {'fps':>8} {'ms/frame':>9} "
+          f"{'captures':>9}  state")
+    for camera_id in streams:
+        for workers, report in reports.items():
+            stats = report[camera_id]
+            print(f"{camera_id:>8} {workers:8d} {stats['fps']:8.1f} "
+                  f"{stats['processing_ms']:9.1f} {stats['captures']:9d}  "
+                  f"{stats['state']}")
@@ -0,0 +1,94 @@
+"""
+Benchmark of the box classification of the foreground masks.
+
+Compares identify_contours (findContours and a Python loop per contour)
+with identify_components (connectedComponentsWithStats and array
+operations) on the foreground masks of the mock videos, and on the same
+masks with salt noise, that adds hundreds of small blobs. Reports the
+time per mask and the fraction of masks where both return the same
+final object box and the same sets of valid and border boxes.
+
+Usage:
+    python benchmark_contours.py --noise 0.002
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+import BackgroundSubtractionV2 as bgsub
+import benchmark_utils as bench
+
+
+def foreground_masks(frames, learning_rate=0.0001):
+    """
+    Foreground masks of the frames, as computed by locate_object.
+    """
+    subtractor = bgsub.initialize_bg_sub()
+    return [bgsub.find_foreground_object(
+                subtractor, bgsub.preprocess_image(frame), learning_rate)
+            for frame in frames]
+
+
+def add_noise(masks, fraction, seed=0):
+    """
+    Copies of the masks with a fraction of random pixels set to 255.
+    """
+    rng = np.random.default_rng(seed)
+    noisy = []
+    for mask in masks:
+        mask = mask.copy()
+        mask[rng.random(mask.shape) < fraction] = 255
+        noisy.append(mask)
+    return noisy
+
+
+def same_result(result, reference):
+    valid, border, box = result
+    ref_valid, ref_border, ref_box = reference
+    return (box == ref_box and set(valid) == set(ref_valid)
+            and set(border) == set(ref_border))
+
+
+def time_function(function, masks):
+    """
+    Results of the function on the masks and the mean time in ms.
+    """
+    start = time.perf_counter()
+    results = [function(mask) for mask in masks]
+    elapsed = time.perf_counter() - start
+    return results, 1000 * elapsed / max(len(masks), 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Maximum number of frames per video")
+    parser.add_argument("--noise", type=float, default=0.002,
+                        help="Fraction of noisy pixels added to the masks")
+    args = parser.parse_args()
+
+    videos = bench.list_mock_videos()
+    if not videos:
+        print(f"No videos found at {bench.MOCK_FOLDER}")
+
+    for video in videos:
+        masks = foreground_masks(bench.read_frames(video, args.frames))
+        print(f"\n{os.path.basename(video)} - {len(masks)} masks")
+        print(f"{'masks':>8} {'contours ms':>12} {'components ms':>14} "
+              f"{'same boxes':>11} {'same final':>11}")
+        for label, mask_set in (("clean", masks),
+                                ("noisy", add_noise(masks, args.noise))):
+            reference, contours_ms = time_function(bgsub.identify_contours,
+                                                   mask_set)
+            results, components_ms = time_function(bgsub.identify_components,
+                                                   mask_set)
+            same = sum(same_result(result, ref)
+                       for result, ref in zip(results, reference))
+            same_final = sum(result[2] == ref[2]
+                             for result, ref in zip(results, reference))
+            total = max(len(mask_set), 1)
+            print(f"{label:>8} {contours_ms:12.3f} {components_ms:14.3f} "
+                  f"{same / total:11.1%} {same_final / total:11.1%}")
@@ -0,0 +1,76 @@
+"""
+Benchmark of the denoise filter engines of preprocess_image.
+
+For each filter engine, reports the preprocessing time per frame and the
+state machine behaviour on the mock videos. As there are no labelled
+state sequences for the videos, the accuracy is the per frame agreement
+with the states reached using the original bilateral filter.
+
+Usage:
+    python benchmark_filters.py --frames 300 [--grayscale]
+"""
+
+import argparse
+import os
+import time
+
+import BackgroundSubtractionV2 as bgsub
+import benchmark_utils as bench
+
+
+def time_preprocessing(frames, filter_engine, grayscale=False):
+    """
+    Mean preprocess_image time, in milliseconds per frame.
+    """
+    start = time.perf_counter()
+    for frame in frames:
+        bgsub.preprocess_image(frame, filter_engine=filter_engine,
+                               grayscale_first=grayscale)
+    return 1000 * (time.perf_counter() - start) / max(len(frames), 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Maximum number of frames per video")
+    parser.add_argument("--filters", nargs="+",
+                        default=list(bgsub.denoise_filters),
+                        help="Filter engines to compare")
+    parser.add_argument("--grayscale", action="store_true",
+                        help="Use the single-channel pipeline")
+    args = parser.parse_args()
+
+    videos = bench.list_mock_videos()
+    if not videos:
+        print(f"No videos found at {bench.MOCK_FOLDER}")
+
+    # Budget of a 30 fps camera
+    frame_budget_ms = 1000 / 30
+
+    for video in videos:
+        frames = bench.read_frames(video, args.frames)
+        if not frames:
+            print(f"\n{os.path.basename(video)} - no frames, skipped")
+            continue
+        pictures = bench.encode_jpeg(frames)
+        print(f"\n{os.path.basename(video)} - {len(frames)} frames "
+              f"{frames[0].shape[1]}x{frames[0].shape[0]}")
+        print(f"{'filter':>18} {'ms/frame':>9} {'FSM ms':>8} "
+              f"{'30 fps':>7} {'transitions':>12} {'captures':>9} "
+              f"{'agreement':>10}")
+
+        reference_states = None
+        for filter_engine in ["bilateral"] + [name for name in args.filters
+                                              if name != "bilateral"]:
+            filter_ms = time_preprocessing(frames, filter_engine,
+                                           args.grayscale)
+            states, captures, fsm_ms = bench.run_state_machine(
+                pictures, filter_engine=filter_engine,
+                grayscale=args.grayscale)
+            if reference_states is None:
+                reference_states = states
+            agreement = bench.state_agreement(states, reference_states)
+            keeps_up = "yes" if fsm_ms < frame_budget_ms else "no"
+            print(f"{filter_engine:>18} {filter_ms:9.2f} {fsm_ms:8.2f} "
+                  f"{keeps_up:>7} {bench.count_transitions(states):12d} "
+                  f"{captures:9d} {agreement:10.1%}")
@@ -0,0 +1,83 @@
+"""
+Benchmark of the adaptive learning rate of the background model.
+
+Replays each mock video through the state machine with the fixed learning
+rates and with the LearningRateScheduler, and reports the frames spent in
+the error state, the frames to recover from each error episode and the
+number of timeouts. As the videos end with the object still in the scene,
+the opening frames of each video (empty workplace) are replayed after it,
+so that the recovery from the last error can be measured.
+
+Usage:
+    python benchmark_learning_rate.py --replay 90
+"""
+
+import argparse
+import os
+
+import benchmark_utils as bench
+
+
+def error_episodes(states):
+    """
+    Lengths of the error episodes, in frames.
+
+    Returns:
+        tuple: The lengths of the episodes that ended, and the length of
+        the last episode if the sequence ended in error, else 0.
+    """
+    recovered = []
+    length = 0
+    for state in states:
+        if state == "operational_error":
+            length += 1
+        elif length:
+            recovered.append(length)
+            length = 0
+    return recovered, length
+
+
+def count_timeouts(states):
+    """
+    Count the transitions from the monitoring states to the error state.
+    """
+    return sum(1 for old, new in zip(states, states[1:])
+               if old.startswith("operational_monitoring")
+               and new == "operational_error")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Maximum number of frames per video")
+    parser.add_argument("--replay", type=int, default=90,
+                        help="Opening frames replayed after each video")
+    args = parser.parse_args()
+
+    videos = bench.list_mock_videos()
+    if not videos:
+        print(f"No videos found at {bench.MOCK_FOLDER}")
+
+    for video in videos:
+        frames = bench.read_frames(video, args.frames)
+        pictures = bench.encode_jpeg(frames)
+        pictures += pictures[:args.replay]
+        print(f"\n{os.path.basename(video)} - {len(pictures)} frames "
+              f"({args.replay} replayed)")
+        print(f"{'learning rate':>14} {'error frames':>13} {'episodes':>9} "
+              f"{'mean recover':>13} {'max recover':>12} "
+              f"{'unrecovered':>12} {'timeouts':>9} {'captures':>9}")
+
+        for label, adaptive in (("fixed", False), ("adaptive", True)):
+            states, captures, _ = bench.run_state_machine(
+                pictures, adaptive_learning_rate=adaptive)
+            recovered, unrecovered = error_episodes(states)
+            error_frames = sum(recovered) + unrecovered
+            episodes = len(recovered) + bool(unrecovered)
+            mean_recover = (sum(recovered) / len(recovered)
+                            if recovered else float("nan"))
+            max_recover = max(recovered) if recovered else 0
+            print(f"{label:>14} {error_frames:13d} {episodes:9d} "
+                  f"{mean_recover:13.1f} {max_recover:12d} "
+                  f"{unrecovered:12d} {count_timeouts(states):9d} "
+                  f"{captures:9d}")
@@ -0,0 +1,109 @@
+"""
+Benchmark of the morphology stage of find_foreground_object.
+
+Compares the original dilation (a 5x5 kernel built at every call, with 4
+iterations) with dilate_mask: one dilation with the cached 17x17 kernel,
+and the dilation of masks downsampled by mask_scale. The single dilation
+must give the same mask as the original one on every frame. For the
+downsampled masks, the boxes found are scaled back and compared with the
+original ones: the presence of valid and border boxes, and the IoU of the
+final object box.
+
+Usage:
+    python benchmark_morphology.py --scales 2 4 --resize-factor 0.5
+"""
+
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+import BackgroundSubtractionV2 as bgsub
+import BoxGeometry as geometry
+import benchmark_utils as bench
+
+
+def original_dilation(thresh_mask):
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+    return cv2.dilate(thresh_mask, kernel, iterations=4)
+
+
+def threshold_masks(frames, resize_factor, learning_rate=0.0001):
+    """
+    Thresholded foreground masks of the frames, before the dilation.
+    """
+    subtractor = bgsub.initialize_bg_sub()
+    masks = []
+    for frame in frames:
+        image = bgsub.preprocess_image(frame, resize_factor=resize_factor)
+        foreground = subtractor.apply(image, learningRate=learning_rate)
+        masks.append(cv2.threshold(foreground, 210, 255,
+                                   cv2.THRESH_BINARY)[1])
+    return masks
+
+
+def time_per_mask(function, masks, repeat=5):
+    """
+    Results of the function on the masks and the mean time in ms.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [function(mask) for mask in masks]
+    elapsed = time.perf_counter() - start
+    return results, 1000 * elapsed / max(len(masks) * repeat, 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Maximum number of frames per video")
+    parser.add_argument("--scales", type=int, nargs="+", default=[2, 4],
+                        help="Mask reduction factors to compare")
+    parser.add_argument("--resize-factor", type=float, default=0.5,
+                        help="Resize factor of preprocess_image")
+    args = parser.parse_args()
+
+    videos = bench.list_mock_videos()
+    if not videos:
+        print(f"No videos found at {bench.MOCK_FOLDER}")
+
+    for video in videos:
+        masks = threshold_masks(bench.read_frames(video, args.frames),
+                                args.resize_factor)
+        height, width = masks[0].shape
+        print(f"\n{os.path.basename(video)} - {len(masks)} masks of "
+              f"{width}x{height}")
+        print(f"{'dilation':>12} {'ms/frame':>9} {'boxes ms':>9} "
+              f"{'same mask':>10} {'same kind':>10} {'final IoU':>10}")
+
+        reference, original_ms = time_per_mask(original_dilation, masks)
+        reference_boxes, reference_boxes_ms = time_per_mask(
+            bgsub.identify_components, reference)
+        print(f"{'original':>12} {original_ms:9.3f} "
+              f"{reference_boxes_ms:9.3f}")
+
+        dilated, single_ms = time_per_mask(bgsub.dilate_mask, masks)
+        same = sum(np.array_equal(mask, ref)
+                   for mask, ref in zip(dilated, reference))
+        print(f"{'17x17':>12} {single_ms:9.3f} {'':>9} "
+              f"{same / len(masks):10.1%}")
+
+        for scale in args.scales:
+            dilated, scaled_ms = time_per_mask(
+                lambda mask: bgsub.dilate_mask(mask, scale), masks)
+            located, boxes_ms = time_per_mask(
+                lambda mask: bgsub.scale_boxes(
+                    bgsub.identify_components(mask), scale, (height, width)),
+                dilated)
+            same_kind = sum(
+                (bool(valid), bool(border)) == (bool(ref[0]), bool(ref[1]))
+                for (valid, border, _), ref in zip(located, reference_boxes))
+            # Frames without object boxes in both agree completely
+            ious = [geometry.box_iou(result[2], ref[2])
+                    if result[2] or ref[2] else 1.0
+                    for result, ref in zip(located, reference_boxes)]
+            print(f"{f'1/{scale}':>12} {scaled_ms:9.3f} {boxes_ms:9.3f} "
+                  f"{'':>10} {same_kind / len(masks):10.1%} "
+                  f"{sum(ious) / len(ious):10.3f}")
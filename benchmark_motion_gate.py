@@ -0,0 +1,89 @@
+"""
+Benchmark of the motion gate of the free workplace state.
+
+Replays each mock video through the state machine with and without the
+motion gate, and reports the mean processing time of the frames handled
+in the free workplace state, the time of all frames, and the per frame
+state agreement of the gated run with the ungated one. The opening frames
+of each video (empty workplace) are played back and forth before it, to
+emulate a longer idle period.
+
+Usage:
+    python benchmark_motion_gate.py --idle 300
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import benchmark_utils as bench
+
+
+def time_frames(pictures, **fsm_options):
+    """
+    Replay the pictures, timing each call to object_tracking.
+
+    Returns:
+        tuple: The state after each frame, the number of captured images
+        and the time of each frame in milliseconds.
+    """
+    from statemachineV2 import SurgicalInstrumentTrackDetect
+
+    supervisor = SurgicalInstrumentTrackDetect(**fsm_options)
+    states, times = [], []
+    captures = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for picture in pictures:
+            start = time.perf_counter()
+            flag, _ = supervisor.object_tracking(picture)
+            times.append(1000 * (time.perf_counter() - start))
+            captures += bool(flag)
+            states.append(supervisor.state)
+    return states, captures, times
+
+
+def mean(values):
+    return sum(values) / len(values) if values else float("nan")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Maximum number of frames per video")
+    parser.add_argument("--idle", type=int, default=300,
+                        help="Number of empty workplace frames prepended")
+    parser.add_argument("--opening", type=int, default=30,
+                        help="Opening frames repeated as idle frames")
+    args = parser.parse_args()
+
+    videos = bench.list_mock_videos()
+    if not videos:
+        print(f"No videos found at {bench.MOCK_FOLDER}")
+
+    for video in videos:
+        frames = bench.read_frames(video, args.frames)
+        pictures = bench.encode_jpeg(frames)
+        # Back and forth, without jumps between the last and first frames
+        opening = pictures[:args.opening]
+        opening += opening[-2:0:-1]
+        idle = [opening[i % len(opening)] for i in range(args.idle)]
+        pictures = idle + pictures
+        print(f"\n{os.path.basename(video)} - {len(pictures)} frames "
+              f"({args.idle} idle)")
+        print(f"{'motion gate':>12} {'idle ms':>8} {'frame ms':>9} "
+              f"{'captures':>9} {'agreement':>10}")
+
+        reference_states = None
+        for gate in (False, True):
+            states, captures, times = time_frames(pictures, motion_gate=gate)
+            if reference_states is None:
+                reference_states = states
+            # Frames handled by the free workplace callback
+            idle_times = [t for state, t in zip(states, times)
+                          if state == "operational_monitoring_workplaceFree"]
+            agreement = bench.state_agreement(states, reference_states)
+            label = "on" if gate else "off"
+            print(f"{label:>12} {mean(idle_times):8.2f} {mean(times):9.2f} "
+                  f"{captures:9d} {agreement:10.1%}")
@@ -0,0 +1,109 @@
+"""
+Benchmark of the pipelined state machine under real-time load.
+
+Plays each mock video as a camera at a fixed frame rate, and feeds it to
+the state machine synchronously, with object_tracking on the camera
+thread, and through PipelinedTracker. The synchronous mode processes
+every frame in order, so when the analysis is slower than the frame
+interval the frames queue up. The pipelined mode drops stale frames.
+Reports the end-to-end latency, from the frame arrival to the end of its
+state machine step, the processed and dropped frames and the captures.
+
+Usage:
+    python benchmark_pipeline.py --fps 30
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+
+import benchmark_utils as bench
+from PipelinedTracker import PipelinedTracker
+from statemachineV2 import SurgicalInstrumentTrackDetect
+
+
+def run_synchronous(pictures, fps):
+    """
+    Process every picture with object_tracking, as they arrive.
+
+    Returns:
+        tuple: Latencies in seconds, processed frames and captures.
+    """
+    supervisor = SurgicalInstrumentTrackDetect()
+    latencies = []
+    captures = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index, picture in enumerate(pictures):
+            arrival = start + index / fps
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            flag, _ = supervisor.object_tracking(picture)
+            captures += bool(flag)
+            latencies.append(time.perf_counter() - arrival)
+    return latencies, len(pictures), captures
+
+
+def run_pipelined(pictures, fps):
+    """
+    Submit the pictures to a PipelinedTracker, as they arrive.
+
+    Returns:
+        tuple: Latencies in seconds, processed frames, dropped frames and
+        captures.
+    """
+    results = []
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with PipelinedTracker(callback=results.append) as tracker:
+            for index, picture in enumerate(pictures):
+                delay = start + index / fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                tracker.submit(picture)
+    captures = sum(bool(result.flag) for result in results)
+    return ([result.latency for result in results], tracker.processed,
+            tracker.dropped, captures)
+
+
+def latency_summary(latencies):
+    latencies_ms = 1000 * np.asarray(latencies)
+    return (latencies_ms.mean(), np.percentile(latencies_ms, 50),
+            np.percentile(latencies_ms, 95), latencies_ms.max())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Maximum number of frames per video")
+    parser.add_argument("--fps", type=float, default=30,
+                        help="Frame rate of the emulated camera")
+    args = parser.parse_args()
+
+    videos = bench.list_mock_videos()
+    if not videos:
+        print(f"No videos found at {bench.MOCK_FOLDER}")
+
+    for video in videos:
+        pictures = bench.encode_jpeg(bench.read_frames(video, args.frames))
+        print(f"\n{os.path.basename(video)} - {len(pictures)} frames at "
+              f"{args.fps:g} fps")
+        print(f"{'mode':>10} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'max ms':>8} {'processed':>10} {'dropped':>8} "
+              f"{'captures':>9}")
+
+        latencies, processed, captures = run_synchronous(pictures, args.fps)
+        print(f"{'sync':>10} " + " ".join(
+            f"{value:8.1f}" for value in latency_summary(latencies)) +
+            f" {processed:10d} {0:8d} {captures:9d}")
+
+        latencies, processed, dropped, captures = run_pipelined(pictures,
+                                                                args.fps)
+        print(f"{'pipelined':>10} " + " ".join(
+            f"{value:8.1f}" for value in latency_summary(latencies)) +
+            f" {processed:10d} {dropped:8d} {captures:9d}")
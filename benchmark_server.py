@@ -0,0 +1,131 @@
+"""
+Load generator for the HTTP ingestion service.
+
+Simulates many stations, each replaying a mock video over one keep-alive
+connection: a thread per station POSTs its frames one after the other,
+each as soon as the previous answer arrives. Reports the requests per
+second of all the stations together, the p50 and p99 latency, and the
+captures and final state of each station.
+
+Without --url, a TrackingServer is started in this process on a free
+port. To measure the service alone, start TrackingServer.py separately
+and pass its URL.
+
+Usage:
+    python benchmark_server.py --stations 8
+    python benchmark_server.py --url http://127.0.0.1:8000 --stations 8
+"""
+
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+import benchmark_utils as bench
+from TrackingServer import TrackingServer
+
+
+def replay_station(host, port, station_id, pictures, latencies, answers):
+    """
+    POST the pictures of a station over one connection.
+
+    Args:
+        latencies (list): Receives the latency in seconds of each request.
+        answers (list): Receives the decoded JSON answer of each request.
+    """
+    connection = http.client.HTTPConnection(host, port)
+    try:
+        for picture in pictures:
+            start = time.perf_counter()
+            connection.request("POST", f"/stations/{station_id}/frames",
+                               body=picture,
+                               headers={"Content-Type": "image/jpeg"})
+            response = connection.getresponse()
+            body = response.read()
+            latencies.append(time.perf_counter() - start)
+            answers.append(json.loads(body))
+    finally:
+        connection.close()
+
+
+def run_load(host, port, streams):
+    """
+    Replay every stream from its own thread.
+
+    Returns:
+        tuple: Elapsed seconds, latencies of all the requests, and the
+        answers of each station.
+    """
+    latencies = {station_id: [] for station_id in streams}
+    answers = {station_id: [] for station_id in streams}
+    threads = [threading.Thread(target=replay_station,
+                                args=(host, port, station_id, pictures,
+                                      latencies[station_id],
+                                      answers[station_id]))
+               for station_id, pictures in streams.items()]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return (elapsed, [value for values in latencies.values()
+                      for value in values], answers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default=None,
+                        help="URL of a running TrackingServer")
+    parser.add_argument("--frames", type=int, default=None,
+                        help="Maximum number of frames per video")
+    parser.add_argument("--stations", type=int, default=4,
+                        help="Number of simulated stations")
+    args = parser.parse_args()
+
+    videos = bench.list_mock_videos()
+    if not videos:
+        print(f"No videos found at {bench.MOCK_FOLDER}")
+        raise SystemExit(1)
+
+    clips = [bench.encode_jpeg(bench.read_frames(video, args.frames))
+             for video in videos]
+    streams = {f"station{index:02d}": clips[index % len(clips)]
+               for index in range(args.stations)}
+    total = sum(len(pictures) for pictures in streams.values())
+    print(f"{args.stations} stations, {total} frames")
+
+    server = None
+    if args.url is None:
+        server = TrackingServer(("127.0.0.1", 0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+    else:
+        url = urllib.parse.urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+
+    # The in-process state machines print every transition
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed, latencies, answers = run_load(host, port, streams)
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+    latencies_ms = 1000 * np.asarray(latencies)
+    print(f"\n{'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    print(f"{len(latencies) / elapsed:8.1f} "
+          f"{np.percentile(latencies_ms, 50):8.1f} "
+          f"{np.percentile(latencies_ms, 99):8.1f} {latencies_ms.max():8.1f}")
+
+    print(f"\n{'station':>10} {'frames':>7} {'captures':>9}  state")
+    for station_id, station_answers in answers.items():
+        captures = sum(answer["flag"] for answer in station_answers)
+        state = station_answers[-1]["state"] if station_answers else None
+        print(f"{station_id:>10} {len(station_answers):7d} {captures:9d}  "
+              f"{state}")
@@ -0,0 +1,127 @@
+"""
+Benchmark of the frame transport between a capture and an analysis
+process.
+
+A producer process sends frames of the given shape to a consumer
+process, through a multiprocessing.Queue, which pickles every frame, or
+through a SharedFrameRing, where the consumer reads the slots in place.
+The consumer touches every frame, as the first analysis step would.
+Reports the frames received per second, the mean latency from the write
+to the read of a frame, and the frames dropped by the ring. With --fps
+the producer is paced as a camera, else it runs as fast as it can.
+
+Usage:
+    python benchmark_shared_memory.py --shape 2160 3840 3 --frames 200
+"""
+
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from SharedFrameRing import RingReader, SharedFrameRing
+
+
+def make_frames(shape, count=4):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, shape, dtype=np.uint8)
+            for _ in range(count)]
+
+
+def pace(start, index, fps):
+    if fps:
+        delay = start + index / fps - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def queue_producer(queue, shape, frames, fps):
+    sources = make_frames(shape)
+    start = time.perf_counter()
+    for index in range(frames):
+        pace(start, index, fps)
+        queue.put((time.time(), sources[index % len(sources)]))
+    queue.put(None)
+
+
+def ring_producer(ring_name, frames, fps):
+    ring = SharedFrameRing(ring_name)
+    sources = make_frames(ring.shape)
+    start = time.perf_counter()
+    for index in range(frames):
+        pace(start, index, fps)
+        # The capture would decode straight into the slot
+        number, view = ring.begin_write()
+        view[...] = sources[index % len(sources)].reshape(view.shape)
+        ring.commit(number)
+    ring.close()
+
+
+def touch(pixels):
+    # Sparse read of the frame, as the first analysis step
+    return int(pixels[::64, ::64].sum())
+
+
+def run_queue(shape, frames, fps):
+    queue = multiprocessing.Queue(maxsize=2)
+    producer = multiprocessing.Process(target=queue_producer,
+                                       args=(queue, shape, frames, fps))
+    producer.start()
+    latencies = []
+    start = time.perf_counter()
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        timestamp, pixels = item
+        touch(pixels)
+        latencies.append(time.time() - timestamp)
+    elapsed = time.perf_counter() - start
+    producer.join()
+    return elapsed, latencies, 0
+
+
+def run_ring(shape, frames, fps, slots):
+    with SharedFrameRing(shape=shape, slots=slots) as ring:
+        producer = multiprocessing.Process(target=ring_producer,
+                                           args=(ring.name, frames, fps))
+        producer.start()
+        reader = RingReader(ring)
+        latencies = []
+        start = time.perf_counter()
+        while reader.last_number < frames:
+            frame = reader.next(timeout=5.0)
+            if frame is None:
+                break
+            touch(frame.pixels)
+            latencies.append(time.time() - frame.timestamp)
+            reader.done(frame)
+        elapsed = time.perf_counter() - start
+        producer.join()
+    return elapsed, latencies, reader.dropped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shape", type=int, nargs="+",
+                        default=[2160, 3840, 3],
+                        help="Frame shape, height width [channels]")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--fps", type=float, default=None,
+                        help="Frame rate of the producer, None for maximum")
+    parser.add_argument("--slots", type=int, default=8)
+    args = parser.parse_args()
+
+    shape = tuple(args.shape)
+    print(f"{args.frames} frames of {shape}, "
+          f"{np.prod(shape) / 1e6:.1f} MB each")
+    print(f"\n{'transport':>9} {'fps':>7} {'latency ms':>11} "
+          f"{'dropped':>8}")
+    for name, run in (("queue", lambda: run_queue(shape, args.frames,
+                                                  args.fps)),
+                      ("ring", lambda: run_ring(shape, args.frames,
+                                                args.fps, args.slots))):
+        elapsed, latencies, dropped = run()
+        print(f"{name:>9} {len(latencies) / elapsed:7.1f} "
+              f"{1000 * np.mean(latencies):11.1f} {dropped:8d}")
@@ -0,0 +1,136 @@
+"""
+Benchmark of the camera ingestion against the ESP32 emulator.
+
+Starts an Esp32Emulator playing a mock video, or a synthetic scene, and
+for each framesize receives frames with /capture requests, one per frame
+over a keep-alive connection, and with the MJPEG stream of MjpegStream.
+Reports the frames per second, the mean size of the frames and the
+arrival jitter. With --track, every frame also goes through
+object_tracking, and the captures are reported.
+
+Usage:
+    python benchmark_stream.py --framesizes 6 10 13 --bandwidth 2000
+"""
+
+import argparse
+import contextlib
+import http.client
+import io
+import time
+import urllib.parse
+
+import benchmark_utils as bench
+from Esp32Emulator import Esp32Emulator, SyntheticSource, VideoSource
+from MjpegStream import ArrivalStats, MjpegStream
+from statemachineV2 import SurgicalInstrumentTrackDetect
+
+
+def set_control(control_url, name, value):
+    url = urllib.parse.urlsplit(control_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port)
+    connection.request("GET", f"/control?var={name}&val={value}")
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    if response.status != 200:
+        raise ValueError(f"/control {name}={value} answered "
+                         f"{response.status}")
+
+
+def receive_captures(control_url, frames, supervisor):
+    """
+    Request the frames one at a time from /capture.
+
+    Returns:
+        tuple: Elapsed seconds, total bytes, ArrivalStats and captures.
+    """
+    url = urllib.parse.urlsplit(control_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port)
+    arrivals = ArrivalStats()
+    total = captures = 0
+    start = time.perf_counter()
+    for _ in range(frames):
+        connection.request("GET", "/capture")
+        picture = connection.getresponse().read()
+        arrivals.add(time.perf_counter())
+        total += len(picture)
+        if supervisor is not None:
+            flag, _ = supervisor.object_tracking(picture)
+            captures += bool(flag)
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return elapsed, total, arrivals, captures
+
+
+def receive_stream(stream_url, frames, supervisor):
+    """
+    Receive the frames from the MJPEG stream.
+
+    Returns:
+        tuple: Elapsed seconds, total bytes, ArrivalStats and captures.
+    """
+    stream = MjpegStream(stream_url, max_reconnects=0)
+    total = captures = received = 0
+    start = time.perf_counter()
+    for frame in stream:
+        total += len(frame.payload)
+        if supervisor is not None:
+            flag, _ = supervisor.object_tracking(frame.payload)
+            captures += bool(flag)
+        received += 1
+        if received == frames:
+            break
+    elapsed = time.perf_counter() - start
+    return elapsed, total, stream.arrivals, captures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=100,
+                        help="Frames received per mode and framesize")
+    parser.add_argument("--framesizes", type=int, nargs="+",
+                        default=[6, 10, 13, 15],
+                        help="esp32-camera framesize values to compare")
+    parser.add_argument("--quality", type=int, default=10)
+    parser.add_argument("--fps", type=float, default=25,
+                        help="Frame rate of the emulated camera")
+    parser.add_argument("--bandwidth", type=float, default=None,
+                        help="Bandwidth limit in kB/s")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="Synthetic scene instead of a mock video")
+    parser.add_argument("--track", action="store_true",
+                        help="Run object_tracking on every frame")
+    args = parser.parse_args()
+
+    videos = bench.list_mock_videos()
+    if args.synthetic or not videos:
+        source = SyntheticSource()
+    else:
+        source = VideoSource(videos[0])
+
+    with Esp32Emulator(source, control_port=0, stream_port=0,
+                       bandwidth=args.bandwidth and 1000 * args.bandwidth,
+                       quality=args.quality,
+                       nominal_fps=args.fps) as emulator:
+        print(f"{args.frames} frames per run, camera at {args.fps:g} fps"
+              + (f", {args.bandwidth:g} kB/s" if args.bandwidth else ""))
+        print(f"\n{'framesize':>9} {'mode':>8} {'fps':>7} {'kB/frame':>9} "
+              f"{'jitter ms':>10} {'max gap':>8} {'captures':>9}")
+        for framesize in args.framesizes:
+            set_control(emulator.control_url, "framesize", framesize)
+            for mode in ("capture", "stream"):
+                supervisor = (SurgicalInstrumentTrackDetect() if args.track
+                              else None)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if mode == "capture":
+                        elapsed, total, arrivals, captures = receive_captures(
+                            emulator.control_url, args.frames, supervisor)
+                    else:
+                        elapsed, total, arrivals, captures = receive_stream(
+                            emulator.stream_url, args.frames, supervisor)
+                summary = arrivals.summary()
+                print(f"{framesize:9d} {mode:>8} {args.frames / elapsed:7.1f} "
+                      f"{total / args.frames / 1000:9.1f} "
+                      f"{summary['jitter_ms']:10.1f} "
+                      f"{summary['max_gap_ms']:8.1f} "
+                      f"{captures if supervisor else '-':>9}")
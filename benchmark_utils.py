@@ -0,0 +1,112 @@
+"""
+Helpers shared by the benchmark scripts.
+
+The benchmarks replay the mock videos of the video/videosMock folder
+through the BackgroundSubtractionV2 functions and through the
+statemachineV2 FSM, without any debugging windows.
+
+"""
+
+import contextlib
+import io
+import os
+import time
+
+import cv2
+
+
+MOCK_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "video", "videosMock")
+
+
+def list_mock_videos(folder=MOCK_FOLDER):
+    """
+    List the mock videos available for benchmarking.
+
+    Args:
+        folder (str): Directory with the .mp4 mock videos.
+
+    Returns:
+        list: Sorted paths of the videos found.
+    """
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if name.lower().endswith(".mp4"))
+
+
+def read_frames(path, max_frames=None):
+    """
+    Read the frames of a video file.
+
+    Args:
+        path (str): Path of the video.
+        max_frames (int): Maximum number of frames to read, or None for all.
+
+    Returns:
+        list: The BGR frames.
+    """
+    camera = cv2.VideoCapture(path)
+    frames = []
+    while max_frames is None or len(frames) < max_frames:
+        ret, frame = camera.read()
+        if not ret:
+            break
+        frames.append(frame)
+    camera.release()
+    return frames
+
+
+def encode_jpeg(frames):
+    """
+    Encode frames as JPEG bytes, as sent by the CME_VISION_API.
+    """
+    return [cv2.imencode(".jpg", frame)[1].tobytes() for frame in frames]
+
+
+def run_state_machine(pictures, **fsm_options):
+    """
+    Replay a sequence of pictures through a new state machine.
+
+    Args:
+        pictures: Inputs accepted by object_tracking, in order.
+        **fsm_options: Keyword arguments for SurgicalInstrumentTrackDetect.
+
+    Returns:
+        tuple: The state after each frame, the number of captured images
+        and the mean processing time in milliseconds per frame.
+    """
+    # Imported here, so that benchmarks of the functions alone do not
+    # require the transitions package
+    from statemachineV2 import SurgicalInstrumentTrackDetect
+
+    supervisor = SurgicalInstrumentTrackDetect(**fsm_options)
+    states = []
+    captures = 0
+    start = time.perf_counter()
+    # The FSM reports its progress with prints
+    with contextlib.redirect_stdout(io.StringIO()):
+        for picture in pictures:
+            flag, _ = supervisor.object_tracking(picture)
+            captures += bool(flag)
+            states.append(supervisor.state)
+    elapsed = time.perf_counter() - start
+    return states, captures, 1000 * elapsed / max(len(states), 1)
+
+
+def count_transitions(states):
+    """
+    Count the state changes in a sequence of states.
+    """
+    return sum(1 for old, new in zip(states, states[1:]) if old != new)
+
+
+def state_agreement(states, reference_states):
+    """
+    Fraction of frames where two runs were in the same state.
+    """
+    total = min(len(states), len(reference_states))
+    if total == 0:
+        return 0.0
+    same = sum(1 for a, b in zip(states, reference_states) if a == b)
+    return same / total
@@ -9,6 +9,7 @@ from transitions import Machine
 import cv2
 import numpy as np
 import BackgroundSubtraction as bgsub
+import BoxGeometry as geometry
 
 
 class ObjectTracking(object):
@@ -467,19 +468,13 @@ class ObjectTracking(object):
                 # in the code, because it is testing the recent end of a
                 # movement detected by the Background Subtractor.
 
-                # Define the size of the mask, as a cropped frame, for the
-                # objects moving in the workplace.
-                mask_MOG2 = np.zeros_like(bgsub.preprocess_image(frame))
-
-                # Mask for the objects in the frame. If moving, the blur will
-                # diminish the size of the object comparing to the MOG2 mask.
-                mask_object = np.zeros_like(bgsub.preprocess_image(frame))
+                # The cropped frame limits the boxes of the objects moving
+                # in the workplace.
+                preproc_image = bgsub.preprocess_image(frame)
 
                 # Find the contours of the objects in the frame, 2nd position
                 # of the return tuple
-                instant_contours = bgsub.is_object_at_image(
-                                        bgsub.preprocess_image(frame)
-                                   )[1]
+                instant_contours = bgsub.is_object_at_image(preproc_image)[1]
 
                 # Compare the position of all combined boxes in the scene
                 # from the locate_object() and the mask_object. If the
@@ -488,29 +483,14 @@ class ObjectTracking(object):
 
                 if instant_contours:
                     x, y, w, h = cv2.boundingRect(np.vstack(instant_contours))
-                    cv2.rectangle(mask_object, (x, y), (x + w, y + h), 255,
-                                  thickness=cv2.FILLED)
-
-                    for box in past_all_boxes:
-                        cv2.rectangle(mask_MOG2, (box[0], box[1]),
-                                      (box[0] + box[2], box[1] + box[3]),
-                                      255, thickness=cv2.FILLED)
-
-                    intersect = cv2.bitwise_and(mask_MOG2, mask_object)
-                    union = cv2.bitwise_or(mask_MOG2, mask_object)
-
-                    intersection_area = np.sum(intersect > 0)
-                    union_area = np.sum(union > 0)
-                    iou = intersection_area / union_area
-
-                    # mask_MOG2_3ch = cv2.cvtColor(mask_MOG2,
-                    # cv2.COLOR_GRAY2BGR)
-                    # mask_object_3ch = cv2.cvtColor(mask_object,
-                    # cv2.COLOR_GRAY2BGR)
 
-                    # cv2.imshow("MOG2 mask", mask_MOG2_3ch)
-                    # cv2.imshow("Object mask", mask_object_3ch)
-                    #  cv2.waitKey(0)
+                    # Compare the regions covered by the boxes from their
+                    # coordinates, instead of drawing them in full masks
+                    iou = geometry.boxes_iou(
+                        [geometry.filled_rectangle(box, preproc_image.shape)
+                         for box in past_all_boxes],
+                        [geometry.filled_rectangle((x, y, w, h),
+                                                   preproc_image.shape)])
 
                     past_all_boxes = valid_boxes + border_boxes
 
@@ -1,6 +1,10 @@
 import cv2
 import numpy as np
 import BackgroundSubtractionV2 as bgsub
+import BackgroundModels as bgmodels
+from LearningRateScheduler import LearningRateScheduler
+from MaskHistory import MaskHistory
+from PackedMask import PackedMask
 from transitions.extensions import HierarchicalMachine
 
 class SurgicalInstrumentTrackDetect(object):
@@ -12,8 +16,40 @@ class SurgicalInstrumentTrackDetect(object):
         subtractor_bg: The background subtractor object.
         nxt_transition (str): The next transition trigger.
         terminate_flag (bool): Flag to terminate the state machine.
-        counter(int): Generic counter for counting frames in states
+        mask_history: MaskHistory of the last foreground masks of the
+            tracking state, for detecting a stopped object.
         output_image: The current image selected by the state machine.
+        reference_orientation: Orientation descriptor of the last captured
+            image, or None.
+        received_image: The last input frame, at the analysis resolution.
+        analysis: The bgsub.FrameAnalysis of received_image, shared by
+            the state callbacks.
+        received_picture: The last input JPEG, kept for the lazy full
+            resolution decode, or the last input pixels if they were
+            received already decoded.
+        reduced_decode (int or None): JPEG reduction factor (2, 4 or 8) used
+            to decode analysis frames directly in grayscale, or None to
+            decode them at full resolution in color.
+        filter_engine (str): Denoise filter used by preprocess_image.
+        bg_engine (str): Background subtractor engine.
+        warm_restart (bool): Flag to restore the last background snapshot
+            when re-entering configuration, instead of learning the
+            background again.
+        bg_snapshot: Background learned from the free workplace, or None.
+        clean_plate_path (str): File of the persisted background of the
+            empty workplace, or None.
+        lr_scheduler: LearningRateScheduler adapting the background model
+            learning rate, or None for the fixed rates.
+        motion_gate: bgsub.MotionGate skipping the full pipeline on idle
+            frames of the workplaceFree state, or None.
+        skipped_updates (int): Frames since the last update of the
+            background model.
+        frame_strides (dict): Processing budget, one frame processed every
+            stride frames, of the states kept by reflexive transitions.
+        frame_step (int): Received frames represented by the frame being
+            processed, 1 plus the frames skipped before it.
+        grayscale (bool): Flag for the single-channel pipeline. Frames are
+            decoded in grayscale and only captures are decoded in color.
         # previous_output_image: The backup image selected by the state machine.
         image_available_flag (bool): Flag indicating if an image is available.
         workspace_activity (bool): Flag indicating movement in the workspace.
@@ -127,36 +163,197 @@ class SurgicalInstrumentTrackDetect(object):
          'operational_takeImage'],
     ]
 
-    def __init__(self, show_debug=False):
+    # imdecode flags for decoding JPEG frames directly at a reduced
+    # resolution. libjpeg scales the DCT blocks while decoding, so the
+    # full resolution image is never built.
+    reduced_decode_flags = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                            4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                            8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+    # Pixel formats of the already decoded pictures
+    pixel_formats = ("bgr", "rgb", "gray")
+
+    # Frames of free workplace between background snapshots
+    snapshot_interval = 30
+
+    # Maximum mean gray level difference between a background snapshot
+    # and the current frame for reusing the snapshot. Larger differences
+    # mean changes in lighting or in the camera position.
+    max_background_difference = 20
+
+    # Fixed learning rates. The error state needs to quickly forget the
+    # shadow of the removed object, aprox. 10 frames to clear the background
+    # model. Elsewhere, a very small rate preserves stopped objects.
+    error_learning_rate = 0.1
+    default_learning_rate = 0.0001
+
+    # With the motion gate, idle frames still update the background model
+    # once every idle_feed_interval frames, one second at 30 fps
+    idle_feed_interval = 30
+
+    # Maximum age of a clean plate, in seconds
+    clean_plate_max_age = 8 * 3600
+
+    # Transition that keeps each state, fired while nothing happens
+    reflexive_transitions = {
+        "operational_error": "reflexive_error",
+        "operational_monitoring_workplaceFree": "reflexive_workplaceFree",
+        "operational_monitoring_tracking": "reflexive_tracking",
+    }
+
+    # Processing budget for frame_strides: every 4th frame while waiting
+    # for movement or for the removal of an object, every frame elsewhere
+    idle_frame_strides = {
+        "operational_error": 4,
+        "operational_monitoring_workplaceFree": 4,
+    }
+
+    def __init__(self, show_debug=False, reduced_decode=None,
+                 filter_engine="bilateral", grayscale=False,
+                 bg_engine="mog2", warm_restart=False,
+                 clean_plate_path=None, adaptive_learning_rate=False,
+                 motion_gate=False, frame_strides=None, stillness_window=4,
+                 stillness_iou=0.9, stillness_drift=0.02,
+                 box_finder="contours"):
         """
         Initialize the ObjectTracking state machine. Define attributes and
         state transitions
 
         Args:
             show_debug (bool): Flag to show debugging images.
+            reduced_decode (int or None): Decode analysis frames at 1/2, 1/4
+                or 1/8 of the resolution, in grayscale. The full resolution
+                image is decoded only when an image is captured.
+            filter_engine (str): Denoise filter, one of
+                bgsub.denoise_filters.
+            grayscale (bool): Decode and analyse frames in a single channel.
+                Implied by reduced_decode.
+            bg_engine (str): Background subtractor engine, one of
+                BackgroundModels.background_engines.
+            warm_restart (bool): Reuse the background learned in monitoring
+                when the configuration state is re-entered.
+            clean_plate_path (str): Clean plate file, saved with
+                save_clean_plate. If it is fresh, it is preloaded in the
+                background model at the first configuration.
+            adaptive_learning_rate (bool): Adapt the background model
+                learning rate to the state and to the measured foreground,
+                instead of using the fixed rates.
+            motion_gate (bool): In the workplaceFree state, skip the full
+                pipeline on frames without change at a tiny resolution.
+            frame_strides (dict): Process one frame every stride frames
+                in the given states, as in idle_frame_strides, while they
+                are kept by reflexive transitions. None processes every
+                frame.
+            stillness_window (int): Number of foreground masks, and of
+                received frames at least, compared to detect a stopped
+                object in tracking.
+            stillness_iou (float): Minimum IoU of every mask in the window
+                against their median mask for a stopped object.
+            stillness_drift (float): Maximum drift of the mask boxes from
+                their median box for a stopped object, as a fraction of
+                the mask width.
+            box_finder (str): Classification of the foreground mask
+                boxes, one of bgsub.box_finders. "components" labels the
+                whole mask, and is slower than "contours" on the clean
+                masks of the mock clips.
         """
+        if (reduced_decode is not None and
+                reduced_decode not in self.reduced_decode_flags):
+            raise ValueError(f"reduced_decode must be one of "
+                             f"{sorted(self.reduced_decode_flags)} or None")
+        if filter_engine not in bgsub.denoise_filters:
+            raise ValueError(f"Unknown filter engine '{filter_engine}'. "
+                             f"Available: {list(bgsub.denoise_filters)}")
+        if box_finder not in bgsub.box_finders:
+            raise ValueError(f"Unknown box finder '{box_finder}'. "
+                             f"Available: {list(bgsub.box_finders)}")
+        if bg_engine not in bgmodels.background_engines:
+            raise ValueError(
+                f"Unknown background engine '{bg_engine}'. Available: "
+                f"{list(bgmodels.background_engines)}")
+        for state, stride in (frame_strides or {}).items():
+            if state not in self.reflexive_transitions:
+                raise ValueError(
+                    f"No frame stride for state '{state}'. Available: "
+                    f"{list(self.reflexive_transitions)}")
+            if int(stride) < 1:
+                raise ValueError("Frame strides must be positive integers")
 
         self.show_debug = show_debug  # Flag bool to turn on all debugging figures
 
         self.subtractor_bg = None  # Handler for BackgroundSubtractor
 
+        self.bg_engine = bg_engine  # name of the background subtractor engine
+
+        self.warm_restart = warm_restart  # Flag for reusing the background
+
+        self.bg_snapshot = None  # background learned with a free workplace
+
+        self.frames_since_snapshot = 0  # free workplace frames counter
+
+        self.clean_plate_path = clean_plate_path  # persisted empty background
+
+        # Adaptive learning rate of the background model
+        self.lr_scheduler = (LearningRateScheduler(
+            self.default_learning_rate, self.error_learning_rate)
+            if adaptive_learning_rate else None)
+
+        self.motion_gate = bgsub.MotionGate() if motion_gate else None
+
+        self.idle_frames = 0  # idle frames counter of the motion gate
+
+        self.idle_frame = False  # current frame skipped by the motion gate
+
+        self.skipped_updates = 0  # frames not fed to the background model
+
+        self.frame_strides = dict(frame_strides or {})  # processing budget
+
+        self.frame_step = 1  # received frames represented by this frame
+
         self.nxt_transition = None # placeholder for transition name
 
         self.terminate_flag = False  # Flag to terminate the execution of
         # this state machine
 
-        self.old_mask = None  # Placeholder to the binary mask for detecting movement
-
-        self.counter = 0  # Generic counter for counting frames in states
+        # Last foreground masks of the tracking state, and the thresholds
+        # of their stability statistics
+        self.mask_history = MaskHistory(stillness_window)
+        self.stillness_iou = stillness_iou
+        self.stillness_drift = stillness_drift
 
         self.output_image = None  # selected image output by the state machine
 
+        # Orientation of the object in the last captured image, kept
+        # instead of the image itself
+        self.reference_orientation = None
+
         self.received_image = None  # last image input for analysis
 
+        self.analysis = None  # cached per-frame analysis of received_image
+
+        self.received_picture = None  # last JPEG input, for lazy decoding
+
+        self.full_frame = None  # full resolution decode of received_picture
+
+        self.reduced_decode = reduced_decode  # JPEG reduction factor or None
+
+        # preprocess_image halves the frame. A reduced decode already
+        # delivers frames at (or below) the analysis resolution.
+        self.resize_factor = 0.5 if reduced_decode is None else 1.0
+
+        self.filter_engine = filter_engine  # denoise filter for preprocessing
+
+        self.box_finder = box_finder  # classification of the mask boxes
+
+        # Single-channel pipeline. The reduced decode modes are grayscale
+        self.grayscale = bool(grayscale or reduced_decode is not None)
+
         self.image_available_flag = False  # Flag for image availability
 
         self.workplace_activity = False  # Flag for movement in the workplace
 
+        self.blocking_object = False  # Flag for an object in the workplace
+
         # Initialize the state machine with a 'start' pseudo-state.
         # Convention will be transitions will have the trigger_ prefix,
         # states will not have 
@@ -178,6 +375,213 @@ class SurgicalInstrumentTrackDetect(object):
         return False
     
 
+    def get_full_frame(self):
+        """
+        Return the received frame at full resolution, in color.
+
+        Pixels received already decoded are copied, so the caller may
+        reuse their buffer after the capture. With reduced or grayscale
+        decoding, the JPEG is decoded again at
+        full resolution, in color, only on the first call for each
+        received picture.
+
+        Returns:
+            The full resolution BGR frame, or None if it can't be decoded.
+        """
+        if isinstance(self.received_picture, np.ndarray):
+            if self.full_frame is None:
+                pixels = self.received_picture
+                self.full_frame = (cv2.cvtColor(pixels, cv2.COLOR_GRAY2BGR)
+                                   if pixels.ndim == 2 else pixels.copy())
+            return self.full_frame
+        if not self.grayscale:
+            return self.received_image
+        if self.full_frame is None and self.received_picture is not None:
+            image_data = np.frombuffer(self.received_picture, dtype=np.uint8)
+            self.full_frame = cv2.imdecode(image_data, cv2.IMREAD_COLOR)
+        return self.full_frame
+
+    def check_motion_gate(self, image_data):
+        """
+        Check if the received picture can skip the full pipeline.
+
+        Only frames handled by the free workplace state are gated. They are
+        first decoded at 1/8 of the resolution, in grayscale, which costs a
+        fraction of the full decode. Idle frames still go through the full
+        pipeline once every idle_feed_interval frames, to keep the
+        background model learning.
+
+        Args:
+            image_data: The JPEG bytes of the received picture, or its
+                pixels if it was received already decoded.
+
+        Returns:
+            The tiny frame if the picture is skipped, else None.
+        """
+        if self.motion_gate is None:
+            return None
+        if (self.state != "operational_monitoring_workplaceFree"
+                or self.nxt_transition != "reflexive_workplaceFree"):
+            # The reference must come from the current stay in the state
+            self.motion_gate.reset()
+            self.idle_frames = 0
+            return None
+        if image_data.ndim == 1:
+            frame = cv2.imdecode(image_data, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        else:
+            # Every 8th pixel, close to the 1/8 decode and without a copy
+            frame = image_data[::8, ::8]
+        if frame is None:
+            return None
+        if self.motion_gate.is_idle(frame):
+            self.idle_frames += 1
+            if self.idle_frames % self.idle_feed_interval:
+                return frame
+        else:
+            self.idle_frames = 0
+        # This frame goes through the full pipeline
+        self.motion_gate.set_reference()
+        return None
+
+    def skip_frame(self):
+        """
+        Check if the received picture is skipped by the processing budget.
+
+        Only frames that would keep the current state, by its reflexive
+        transition, are skipped. The frames skipped are counted in
+        frame_step, so that frame counters keep their meaning in received
+        frames, and in skipped_updates, for the learning rate.
+
+        Returns:
+            bool: True if the picture must not be processed.
+        """
+        stride = self.frame_strides.get(self.state, 1)
+        if (stride > 1 and self.frame_step < stride and
+                self.nxt_transition == self.reflexive_transitions[self.state]):
+            self.frame_step += 1
+            self.skipped_updates += 1
+            return True
+        return False
+
+    def analyse_frame(self, frame):
+        """
+        Create the per-frame analysis context of a received frame, with
+        the preprocessing settings of this instance.
+        """
+        return bgsub.FrameAnalysis(frame, self.resize_factor,
+                                   self.filter_engine, self.grayscale,
+                                   self.show_debug, self.box_finder)
+
+    def get_learning_rate(self):
+        """
+        Learning rate of the background model for the current frame.
+
+        If frames were not fed to the model, the rate is raised to learn
+        as much as with all the frames, 1 - (1 - rate) ** frames.
+        """
+        if self.lr_scheduler is not None:
+            learning_rate = self.lr_scheduler.get_rate(self.state)
+        elif self.state == "operational_error":
+            learning_rate = self.error_learning_rate
+        else:
+            learning_rate = self.default_learning_rate
+        frames = 1 + self.skipped_updates
+        self.skipped_updates = 0
+        return 1 - (1 - learning_rate) ** frames
+
+    def locate(self):
+        """
+        Locate the object in the received frame, updating the background
+        model once per frame.
+        """
+        return self.analysis.locate_object(self.subtractor_bg,
+                                           self.get_learning_rate())
+
+    def preprocessing_settings(self):
+        """
+        Settings that change the preprocessed images, stored with the
+        clean plates.
+        """
+        return {"reduced_decode": self.reduced_decode,
+                "filter_engine": self.filter_engine,
+                "grayscale": self.grayscale}
+
+    def save_clean_plate(self, path=None):
+        """
+        Save the current frame as the clean plate of the empty workplace.
+
+        Call after object_tracking, when the configuration state found the
+        workplace free.
+
+        Args:
+            path (str): Destination file, clean_plate_path by default.
+        """
+        path = path or self.clean_plate_path
+        if path is None:
+            raise ValueError("No clean plate path")
+        if (self.state != "operational_configuration" or
+                self.blocking_object):
+            raise RuntimeError("The clean plate can only be taken in the "
+                               "configuration state with a free workplace")
+        bgmodels.save_clean_plate(path, self.analysis.preprocessed,
+                                  self.bg_engine,
+                                  self.preprocessing_settings())
+
+    def reset_background_model(self):
+        """
+        Create the background subtractor for a new configuration.
+
+        At the first configuration, the clean plate is loaded if it is
+        fresh. With warm restart, the subtractor is seeded with the last
+        snapshot of the free workplace (or the clean plate), if it still
+        matches the current frame, so that the model does not need to
+        learn the background again.
+        """
+        if self.subtractor_bg is None and self.clean_plate_path is not None:
+            # Cold start. The match with the current frame is checked below
+            self.bg_snapshot = bgmodels.load_clean_plate(
+                self.clean_plate_path, self.preprocessing_settings(),
+                self.clean_plate_max_age)
+
+        if ((self.warm_restart or self.subtractor_bg is None) and
+                self.bg_snapshot is not None):
+            difference = bgmodels.background_difference(
+                self.bg_snapshot, self.analysis.preprocessed)
+            if (difference is not None and
+                    difference < self.max_background_difference):
+                self.subtractor_bg = bgmodels.restore_subtractor(
+                    self.bg_engine, self.bg_snapshot)
+                return
+            # Stale snapshot, from other lighting conditions
+            self.bg_snapshot = None
+        self.subtractor_bg = bgsub.initialize_bg_sub(self.bg_engine)
+
+    def update_background_snapshot(self):
+        """
+        Take a snapshot of the background model every snapshot_interval
+        frames of free workplace.
+        """
+        self.frames_since_snapshot += 1
+        if self.frames_since_snapshot >= self.snapshot_interval:
+            self.bg_snapshot = bgmodels.snapshot_subtractor(self.subtractor_bg)
+            self.frames_since_snapshot = 0
+
+    def is_object_still(self):
+        """
+        Check if the masks in the history show a stopped object.
+
+        The history must cover stillness_window received frames, with two
+        masks at least, every mask must match the median mask with an IoU
+        above stillness_iou, and the boxes must stay within
+        stillness_drift of the median box.
+        """
+        history = self.mask_history
+        if len(history) < 2 or history.covered_frames < history.size:
+            return False
+        max_drift = self.stillness_drift * history.shape[1]
+        return (history.median_iou() > self.stillness_iou
+                and history.box_drift() <= max_drift)
+
     def show_debug_frame(self, frame):
         if self.show_debug is True:
             debugframe = cv2.resize(frame, None, fx=0.3, fy=0.3,
@@ -199,8 +603,8 @@ class SurgicalInstrumentTrackDetect(object):
         Callback for entering the configuration state.
         Initializes resources.
         """
-        # Initialize image capture for background subtraction 
-        self.subtractor_bg = bgsub.initialize_bg_sub()
+        # A reconfigured workplace has no previously captured object
+        self.reference_orientation = None
 
         # The Configuration state detects if there is an object in the
         # workspace before starting monitoring.
@@ -210,12 +614,17 @@ class SurgicalInstrumentTrackDetect(object):
         else:
             self.show_debug_frame(frame)
 
-            # Preprocess the image by filtering noise, grayscaling and resizing it.
-            preproc_image = bgsub.preprocess_image(frame, self.show_debug)
+            # Initialize image capture for background subtraction. After an
+            # error recovery, the learned background is restored, if any
+            self.reset_background_model()
 
             # Check if the first frame contains contours of an object.
-            self.blocking_object = bgsub.is_object_at_image(preproc_image,
-                                                            self.show_debug)[0]
+            # The analysis preprocesses the image by filtering noise,
+            # grayscaling and resizing it.
+            self.blocking_object = self.analysis.is_object_present()
+            if self.show_debug:
+                # Debug overlay of the dark and light masks and contours
+                bgsub.is_object_at_image(self.analysis.preprocessed, True)
 
             # Determine if the workspace is free or not and trigger the
             # appropriate transition
@@ -246,27 +655,31 @@ class SurgicalInstrumentTrackDetect(object):
         else:
             self.show_debug_frame(frame)
 
-        learning_rate = 0.1  # Set the learning rate at this stage needs to be
-        # set to 0.1 to quickly forget the shadow of the removed object.
-        # Aprox. 10 frames to clear the background model
+        # The learning rate at this stage needs to be high (0.1, or ramped
+        # up by the scheduler) to quickly forget the shadow of the removed
+        # object. Aprox. 10 frames to clear the background model
 
         # Using parentheses in unpacking does not create a tuple!
-        # Check if there is an object by the contour in the image
-        preproc_img = bgsub.preprocess_image(frame)
-
         (valid_boxes,
          border_boxes,
-         _) = bgsub.locate_object(self.subtractor_bg, frame, learning_rate)
+         _) = self.locate()
         
         if self.workplace_activity is False:
             # preferir forma if len(valid_boxes) > 0 or len(border_boxes) > 0:?
             if valid_boxes or border_boxes:
                 # The workplace has movement, look for no object next iteration
                 self.workplace_activity = True
+                self.nxt_transition = "reflexive_error"  # For firing this method again
+            elif not self.analysis.is_object_present():
+                # No movement and no object contour. The object was removed
+                # before the error state noticed any movement, for example
+                # after its shadow was absorbed by the background model.
+                self.workplace_activity = False
+                self.nxt_transition = "trigger_emptyWorkplace"
             else:
                 # No movement in the workspace.
                 self.workplace_activity = False
-            self.nxt_transition = "reflexive_error"  # For firing this method again
+                self.nxt_transition = "reflexive_error"  # For firing this method again
         else:
         # Check if there are object contours in the workspace. If yes, it returns to
         # workplace_activity = False. If not, it proceeds to Configuration
@@ -274,8 +687,7 @@ class SurgicalInstrumentTrackDetect(object):
             if not valid_boxes or not border_boxes:
                 # Workspace without movement (pixel in the foreground mask),
                 # check if there is an object by the contour in the image
-                preproc_img = bgsub.preprocess_image(frame)
-                self.blocking_object = bgsub.is_object_at_image(preproc_img)[0]
+                self.blocking_object = self.analysis.is_object_present()
 
                 if self.blocking_object is True:
                     # No movement in the workplace and the object remains.
@@ -309,6 +721,15 @@ class SurgicalInstrumentTrackDetect(object):
         if self.show_debug is True:
             self.show_debug_frame(frame)
 
+        if self.idle_frame:
+            # Nothing changed since the last analysed frame. Skip the full
+            # pipeline and the background model update
+            self.skipped_updates += 1
+            self.nxt_transition = "reflexive_workplaceFree"
+            self.image_available_flag = False
+            self.output_image = None
+            return
+
         # If there is no previous transmitted image, must look for a free
         # workplace. Else, if the current image is more than 90% similar
         # to the previously sent image, consider as the no movement case
@@ -318,9 +739,9 @@ class SurgicalInstrumentTrackDetect(object):
         # Using parentheses in unpacking does not create a tuple!
         (valid_boxes,
          border_boxes,
-         _) = bgsub.locate_object(self.subtractor_bg, frame)
+         _) = self.locate()
         
-        if self.output_image is None:  # No previous images
+        if self.reference_orientation is None:  # No previous images
             if valid_boxes or border_boxes:  # No object detected
             # The workplace has movement, transition to tracking state
                 self.nxt_transition = "trigger_movementDetected"
@@ -330,20 +751,31 @@ class SurgicalInstrumentTrackDetect(object):
 
                 # Test for the timeout condition - no foreground object detected
                 # but there is an object at the workplace
-                if bgsub.is_object_at_image(frame) is True:
+                if self.analysis.is_object_present():
                     # Timeout ocorreu, pois não há contorno de objeto em
                     # movimento e existe contorno de objeto no frame
                     self.nxt_transition = 'trigger_timeout'
+                else:
+                    # Clean workplace, keep its background for restarts
+                    self.update_background_snapshot()
+
+        elif not self.analysis.is_object_present():
+            # The captured object was removed from the workplace. Forget
+            # it, and look for movement as usual from the next frame
+            self.reference_orientation = None
+            self.nxt_transition = "reflexive_workplaceFree"
 
         else:  # another image exists from past cycles
-            # Compare current image with the previous one
-            comparison_angle = bgsub.image_rotation_compare(frame, self.output_image)
-            if comparison_angle < 15:
-                # Images are not sufficiently different
+            # Compare current image with the descriptor of the previous one.
+            # Only the current frame is processed, at analysis resolution
+            comparison_angle = bgsub.compare_orientation(
+                self.analysis.orientation, self.reference_orientation)
+            if comparison_angle is None:  # cannot compare (circular symmetry object)
+                # only solution may be a timeout
                 self.nxt_transition = "reflexive_workplaceFree"
 
-            elif comparison_angle is None:  # cannot compare (circular symmetry object)
-                # only solution may be a timeout
+            elif comparison_angle < 15:
+                # Images are not sufficiently different
                 self.nxt_transition = "reflexive_workplaceFree"
 
             else:  # angle greater than 15 degrees mean
@@ -365,9 +797,8 @@ class SurgicalInstrumentTrackDetect(object):
         # Does not differentiate between objects at the edges or in the center
         # of the frames.
 
-        # self.counter = 0
-        # Must have a minimum loop to compare at least three (3) frames and
-        # assert if the object found is still in the scene.
+        # Must have a minimum loop to compare at least stillness_window
+        # frames and assert if the object found is still in the scene.
 
         frame = self.received_image
         if self.is_frame_error():
@@ -375,69 +806,67 @@ class SurgicalInstrumentTrackDetect(object):
         else:
             self.show_debug_frame(frame)
             
-            preproc_image = bgsub.preprocess_image(frame, True)
-            clean_mask = bgsub.find_foreground_object(self.subtractor_bg, preproc_image)
+            clean_mask = self.analysis.foreground_mask(
+                self.subtractor_bg, self.get_learning_rate())
             # Default learning rate (0.0001)
             # Movement occurs and tracks if the movement stops. Then
             # start looking for contours
-            if self.old_mask is None:
-                self.old_mask = clean_mask
+            # Masks are kept bit-packed, and compared by popcounts
+            packed_mask = PackedMask(clean_mask)
+            previous_count = self.mask_history.latest_count()
+            if previous_count is None:
+                self.mask_history.append(packed_mask,
+                                         cv2.boundingRect(clean_mask),
+                                         self.frame_step)
                 # keep this state, in a reflexive transition
                 self.nxt_transition = "reflexive_tracking"
-            else:  # better to calculate Intersect over Union of sequential masks
-                intersect = cv2.bitwise_and(self.old_mask, clean_mask)
-                union = cv2.bitwise_or(self.old_mask, clean_mask)
-                intersection_area = np.sum(intersect > 0)
-                union_area = np.sum(union > 0)
-                if union_area == 0:
-                    # clean union mask means no object
-                    self.nxt_transition = "trigger_noObject"
-                else:
-                    # looking for timeout event, that is a contour in the preproc_image
-                    # that is not present at the clean_mask
-
-                    # If the object is darker than the green background, in grayscale
-                    thresh_dark = cv2.threshold(preproc_image, 90, 255, cv2.THRESH_BINARY_INV)[1]
-                    cv2.imshow("thresh_dark", thresh_dark)
-                    cv2.waitKey(10)
-                    # If the object is lighter than the green background, in grayscale
-                    thresh_light = cv2.threshold(preproc_image, 200, 255, cv2.THRESH_BINARY)[1]
-                    cv2.imshow("thresh_light", thresh_light)
+            elif previous_count == 0 and packed_mask.count == 0:
+                # clean union mask means no object
+                self.nxt_transition = "trigger_noObject"
+                self.mask_history.clear()
+            else:
+                # looking for timeout event, that is a contour in the preproc_image
+                # that is not present at the clean_mask
+
+                # The dark and light object masks, and their combination,
+                # computed once per frame
+                thresh_object = self.analysis.thresh_object
+                if self.show_debug:
+                    cv2.imshow("thresh_dark", self.analysis.thresh_dark)
+                    cv2.imshow("thresh_light", self.analysis.thresh_light)
                     cv2.waitKey(10)
-                    # The final mask is the bitwise OR combination of the two masks. Hysteresis
-                    # tries to avoid shadows on the green sheet.
-                    thresh_object = cv2.bitwise_or(thresh_dark, thresh_light)
-
-                    # comparing with the clean mask, if the IoU
-                    matching_figure = (np.sum(cv2.bitwise_and(thresh_object, clean_mask) > 0) /
-                                       np.sum(thresh_object > 0))
-                    
-                    if matching_figure < 0.2:
-                        # The mask is considering the object as background, causing a timeout
-                        # event
-                        self.nxt_transition = "trigger_timeout"
-                        self.old_mask = None
+
+                # comparing with the clean mask, if the IoU
+                object_area = cv2.countNonZero(thresh_object)
+                if object_area == 0:
+                    # No object contrast at all. Not a timeout, as
+                    # before the division by zero gave NaN
+                    matching_figure = 1.0
+                else:
+                    matching_figure = (cv2.countNonZero(
+                        cv2.bitwise_and(thresh_object, clean_mask))
+                        / object_area)
+
+                if matching_figure < 0.2:
+                    # The mask is considering the object as background, causing a timeout
+                    # event
+                    self.nxt_transition = "trigger_timeout"
+                    self.mask_history.clear()
+                else:
+                    # Masks counted with the frames skipped by the
+                    # processing budget
+                    self.mask_history.append(packed_mask,
+                                             cv2.boundingRect(clean_mask),
+                                             self.frame_step)
+                    if self.is_object_still():
+                        # The masks of the window are almost coincidental.
+                        # It would be a very slow movement or a standstill
+                        # object.
+                        self.nxt_transition = "trigger_objectStopped"
+                        self.mask_history.clear()
                     else:
-                        # Now, can divide by a non-zero value
-                        iou_move = intersection_area / union_area
-                        
-                        if iou_move > 0.9:
-                            self.counter += 1
-                            if self.counter > 2:
-                                # at least 3 masks are almost coincidental. It would be
-                                # a very slow movement or a standstill object.
-                                self.nxt_transition = "trigger_objectStopped"
-                                self.old_mask = None
-                                self.counter = 0
-                            else:
-                                self.nxt_transition = "reflexive_tracking"
-                                self.old_mask = clean_mask
-                        else:
-                            # Non-coincidental masks mean relative movement between them
-                            self.counter = 0
-                            self.nxt_transition = "reflexive_tracking"
-                            # Updating the old_mask for the next comparison
-                            self.old_mask = clean_mask
+                        # Relative movement between the masks
+                        self.nxt_transition = "reflexive_tracking"
 
         # Guarantee the output at every state
         self.image_available_flag = False
@@ -463,7 +892,7 @@ class SurgicalInstrumentTrackDetect(object):
 
             (valid_boxes,
              border_boxes,
-             _) = bgsub.locate_object(self.subtractor_bg, frame)
+             _) = self.locate()
             # Default learning rate (0.0001)
 
             if valid_boxes and not border_boxes:
@@ -487,21 +916,26 @@ class SurgicalInstrumentTrackDetect(object):
         """
         # Capture the image of the object and send it to the central server
         # TODO: Avoid repeated images to be sent to server!
-        frame = self.received_image
         if self.is_frame_error():
             return
         else:
+            # Only captured frames pay for the full resolution decode
+            frame = self.get_full_frame()
             self.show_debug_frame(frame)
-
             
-            self.nxt_transition = "trigger_image_sent"
+            self.nxt_transition = "trigger_imageSent"
             print("Image captured")
-            resized = cv2.resize(frame, None, fx=0.4, fy=0.4,
-                                    interpolation=cv2.INTER_NEAREST)
-            cv2.imshow("captured", resized)
-            cv2.waitKey(0) # stop the debugging only when image is captured
+            if self.show_debug:
+                resized = cv2.resize(frame, None, fx=0.4, fy=0.4,
+                                     interpolation=cv2.INTER_NEAREST)
+                cv2.imshow("captured", resized)
+                cv2.waitKey(0) # stop the debugging only when image is captured
             # cv2.destroyAllWindows()
 
+            # Keep only the orientation descriptor of the captured image,
+            # at analysis resolution, to compare with the next frames
+            self.reference_orientation = self.analysis.orientation
+
             # Guarantee the output at every state
             self.output_image = frame
             self.image_available_flag = True
@@ -524,11 +958,27 @@ class SurgicalInstrumentTrackDetect(object):
 # Auxiliary methods
 #================================
 
-    def object_tracking(self, picture):
+    def object_tracking(self, picture, shape=None, pixel_format="bgr",
+                        analysis=None):
         """
         Starts the object tracking state machine at every image input.
         Cycles through states and triggers transitions dynamically.
 
+        The picture is usually a JPEG, as bytes or any buffer. Pixels the
+        caller has already decoded skip the JPEG round trip: a NumPy
+        array, a memoryview with the shape of the image, or a raw buffer
+        with its shape given.
+
+        Args:
+            picture: The JPEG picture, or the uint8 pixels of the image.
+            shape (tuple): Shape of the pixels of a raw buffer, (height,
+                width) or (height, width, channels). None for JPEG
+                pictures and for arrays.
+            pixel_format (str): Format of the pixels, one of
+                pixel_formats.
+            analysis: The bgsub.FrameAnalysis of the picture returned by
+                prepare_frame, to skip its decoding and preprocessing.
+
         Returns:
             list: A list containing a flag for the resulting object
             tracking and detection and
@@ -543,15 +993,185 @@ class SurgicalInstrumentTrackDetect(object):
         # If the image is available, the flag is true
         # If the image is read, reset the captured image flag
         if self.terminate_flag is not True:
+            if self.skip_frame():
+                # Same result of a processed frame that keeps the state
+                self.image_available_flag = False
+                self.output_image = None
+                return self.image_available_flag, self.get_image()
             try:
-                image_data = np.frombuffer(picture, dtype=np.uint8)
-                frame = cv2.imdecode(image_data, cv2.IMREAD_COLOR)
-                self.received_image = frame  # Saving the received image
+                pixels = self.as_pixels(picture, shape, pixel_format)
+                if pixels is None:
+                    image_data = np.frombuffer(picture, dtype=np.uint8)
+                else:
+                    image_data = picture = pixels
+                gated_frame = self.check_motion_gate(image_data)
+                self.idle_frame = gated_frame is not None
+                if self.idle_frame:
+                    # Only the tiny frame of the motion gate is decoded
+                    frame = gated_frame
+                    analysis = None
+                elif analysis is not None:
+                    frame = analysis.frame
+                elif pixels is None:
+                    frame = cv2.imdecode(image_data,
+                                         self.analysis_decode_flag())
+                else:
+                    frame = self.convert_pixels(pixels)
             except Exception as e:
                 print(f'Ocorreu erro ao receber imagem:/n{e}')
                 self.image_available_flag = False
                 self.output_image = None
                 return self.image_available_flag, self.get_image()
+            return self.process_frame(frame, picture, analysis=analysis)
+
+    def as_pixels(self, picture, shape=None, pixel_format="bgr"):
+        """
+        The pixels of a picture received already decoded.
+
+        Args:
+            picture: Input of object_tracking.
+            shape (tuple): Shape of the pixels of a raw buffer.
+            pixel_format (str): Format of the pixels, one of
+                pixel_formats.
+
+        Returns:
+            The pixels as a BGR or grayscale uint8 array, without a copy
+            for BGR and grayscale, or None if the picture is a JPEG.
+
+        Raises:
+            ValueError: Unknown format, or pixels that don't match it.
+        """
+        if pixel_format not in self.pixel_formats:
+            raise ValueError(f"Unknown pixel format '{pixel_format}'. "
+                             f"Available: {list(self.pixel_formats)}")
+        if shape is not None:
+            pixels = np.frombuffer(picture, dtype=np.uint8).reshape(shape)
+        elif isinstance(picture, np.ndarray) and picture.ndim > 1:
+            pixels = picture
+        elif isinstance(picture, memoryview) and picture.ndim > 1:
+            pixels = np.asarray(picture)
+        else:
+            return None
+        if pixels.dtype != np.uint8:
+            raise ValueError(f"Pixels must be uint8, not {pixels.dtype}")
+        if pixels.ndim == 3 and pixels.shape[2] == 1:
+            pixels = pixels[:, :, 0]
+        channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+        if pixels.ndim not in (2, 3) or channels != (
+                1 if pixel_format == "gray" else 3):
+            raise ValueError(f"Pixels of shape {pixels.shape} are not "
+                             f"'{pixel_format}'")
+        if pixel_format == "rgb":
+            pixels = cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)
+        return pixels
+
+    def convert_pixels(self, pixels):
+        """
+        The analysis frame of pixels received already decoded, as
+        analysis_decode_flag would decode them from a JPEG.
+        """
+        if self.reduced_decode is not None:
+            height, width = pixels.shape[:2]
+            factor = self.reduced_decode
+            # Same size as the reduced JPEG decode, rounded up
+            size = (-(-width // factor), -(-height // factor))
+            return bgsub.to_grayscale(cv2.resize(
+                pixels, size, interpolation=cv2.INTER_AREA))
+        if self.grayscale:
+            return bgsub.to_grayscale(pixels)
+        if pixels.ndim == 2:
+            return cv2.cvtColor(pixels, cv2.COLOR_GRAY2BGR)
+        return pixels
+
+    def analysis_decode_flag(self):
+        """
+        The imdecode flag of the analysis frames, from the decoding
+        settings of this instance.
+        """
+        if self.reduced_decode is not None:
+            # Decode straight to the analysis resolution, in
+            # grayscale. The full frame is decoded lazily.
+            return self.reduced_decode_flags[self.reduced_decode]
+        if self.grayscale:
+            # Single-channel frames from ingestion onwards
+            return cv2.IMREAD_GRAYSCALE
+        return cv2.IMREAD_COLOR
+
+    def decode_picture(self, picture):
+        """
+        Decode a received JPEG picture as an analysis frame.
+
+        Depends only on the decoding settings, not on the state, so it can
+        run on another thread than the state machine.
+
+        Returns:
+            The decoded frame, or None if the picture can't be decoded.
+        """
+        try:
+            return cv2.imdecode(np.frombuffer(picture, dtype=np.uint8),
+                                self.analysis_decode_flag())
+        except Exception as e:
+            print(f'Ocorreu erro ao receber imagem:/n{e}')
+            return None
+
+    def prepare_frame(self, picture, shape=None, pixel_format="bgr"):
+        """
+        Decode and preprocess a picture ahead of the state machine.
+
+        These stages depend only on the settings, not on the state, so
+        they can run on other threads, and for many frames in advance.
+
+        Args:
+            picture, shape, pixel_format: As in object_tracking.
+
+        Returns:
+            The bgsub.FrameAnalysis of the frame, with the preprocessed
+            image computed, or None if the picture can't be decoded.
+        """
+        try:
+            pixels = self.as_pixels(picture, shape, pixel_format)
+            if pixels is None:
+                frame = cv2.imdecode(np.frombuffer(picture, dtype=np.uint8),
+                                     self.analysis_decode_flag())
+            else:
+                frame = self.convert_pixels(pixels)
+            if frame is None:
+                return None
+            analysis = self.analyse_frame(frame)
+            analysis.preprocessed  # computed and cached
+            return analysis
+        except Exception as e:
+            print(f'Ocorreu erro ao receber imagem:/n{e}')
+            return None
+
+    def process_frame(self, frame, picture, frames=1, analysis=None):
+        """
+        Run the state machine on an already decoded frame.
+
+        Args:
+            frame: The frame decoded by decode_picture.
+            picture: The JPEG picture of the frame, or its pixels, for the
+                full resolution capture.
+            frames (int): Received frames represented by this frame, more
+                than 1 if frames were dropped before it.
+            analysis: The bgsub.FrameAnalysis of frame from prepare_frame,
+                or None to create it.
+
+        Returns:
+            tuple: The captured image flag and the captured image or None,
+            as object_tracking.
+        """
+        if self.terminate_flag is not True:
+            self.received_image = frame  # Saving the received image
+            # Results of the previous frame are discarded
+            self.analysis = (analysis if analysis is not None
+                             else self.analyse_frame(frame))
+            self.received_picture = picture
+            self.full_frame = None
+            # Dropped frames count as skipped, as with frame_strides
+            self.frame_step += frames - 1
+            self.skipped_updates += frames - 1
+
             # Displaying which is the state machine current state during debug
             if self.show_debug:
                 print(f"Initial state: {self.state}")
@@ -563,10 +1183,17 @@ class SurgicalInstrumentTrackDetect(object):
             else:
             # When the trigger is called, it executes the on_enter_<state>
                 self.trigger(self.nxt_transition)
-            
+            # The next processed frame represents itself only
+            self.frame_step = 1
+
             if self.show_debug:
                 print(f"Final state: {self.state}") 
 
+            if self.lr_scheduler is not None:
+                # Adapt the learning rate for the next frame
+                self.lr_scheduler.update(self.state,
+                                         self.analysis.foreground_fraction())
+
             if self.state == "stop":
                 # decomission the object
                 pass
@@ -699,25 +1326,18 @@ and {len(videosamples)}. Choose 0 for live camera feed: "))
             print("Camera did not send images. Check the equipment.")
             # Terminate the state machine
             supervisor.trigger_terminate()
-        # imagem corretamente capturada, e deve ser convertida para um arquivo tipo
-        #  .jpeg, mas sem armazenar em disco
-        ret, buffer = cv2.imencode('.jpg', frame)
-        if ret:
-            # Converte o buffer para bytes, se necessário
-            jpeg_bytes = buffer.tobytes()
-            print("Frame convertido para JPEG em memória.")
-        else:
-            print("Falha na codificação JPEG.")
+            break
 
 ## ========================================
 ## Simulating the CME_VISION_API
-## FSM calls only with the .jpeg image
+## FSM calls with the decoded frame. The CME_VISION_API sends .jpeg
+## images, but the frame read locally needs no JPEG round trip
 ## Output must be a tuple with a boolean flag and a None or Image output)
 
-        # Chamar a rotina da máquina de estados que tem o jpeg_bytes como input e
+        # Chamar a rotina da máquina de estados que tem o frame como input e
         # uma lista [flag, imagem\None]
 
-        flag, image = supervisor.object_tracking(jpeg_bytes)
+        flag, image = supervisor.object_tracking(frame)
 
 
     # Segunda versão do CLI de teste